@@ -0,0 +1,72 @@
+import os
+import json
+import argparse
+from utils.corpus.plans import deterministic_layers
+from utils.llm.rules import RuleExtractor, agreement_report
+from benchmarks.notes import ProgressNoteGenerator
+
+DEFAULT_THRESHOLDS = [0.5, 0.8, 0.9]
+
+
+def sample_plans(folder=None, count=200, seed=0, all_plans=False):
+    """
+    The assessment plans of a sample corpus.
+
+    Args:
+        folder (str | None): Folder of progress notes, synthetic notes if None
+        count (int): Number of synthetic notes
+        seed (int): Seed of the note generator
+        all_plans (bool): Every plan with a code, instead of the HCC plans only
+            (the only ones sent to the LLM)
+
+    Returns:
+        plans (list of str): The plans, in corpus order
+    """
+    if folder:
+        notes = []
+        for name in sorted(os.listdir(folder)):
+            with open(os.path.join(folder, name), 'r') as file:
+                notes.append(file.read())
+    else:
+        notes = ProgressNoteGenerator(seed=seed).notes(count)
+    plans = []
+    for progress_note in notes:
+        try:
+            records = deterministic_layers(progress_note)
+        except ValueError:
+            continue
+        plans += [record.plan for record in records if record.is_hcc or (all_plans and record.icd10_code)]
+    return plans
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Agreement of the rule-based extractor with the LLM")
+    parser.add_argument("--folder", default=None, help="folder of progress notes (default: synthetic notes)")
+    parser.add_argument("--count", type=int, default=200, help="number of synthetic notes")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the note generator")
+    parser.add_argument("--all-plans", action="store_true", help="compare every plan with a code, not only HCCs")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=DEFAULT_THRESHOLDS,
+                        help="confidence thresholds to evaluate")
+    parser.add_argument("--output", default=None, help="JSON file receiving the report")
+    args = parser.parse_args(argv)
+
+    # The reference is the configured model, i.e. LLM_BACKEND=cassette to replay recorded answers
+    from pipeline import langGraph_evaluation, LLM_BACKEND
+    plans = sample_plans(args.folder, args.count, args.seed, args.all_plans)
+    llm_outputs = [langGraph_evaluation(plan) for plan in plans]
+    report = agreement_report(plans, llm_outputs, RuleExtractor(), args.thresholds)
+    report["backend"] = LLM_BACKEND
+
+    print(f"{report['plans']} plans compared with the {LLM_BACKEND} backend:")
+    print(f"  all plans       exact {report['exact_agreement'] or 0:.1%}  jaccard {report['mean_jaccard'] or 0:.3f}")
+    for threshold, stats in report["thresholds"].items():
+        print(f"  confidence>={threshold:<4} share {stats['share'] or 0:.1%}"
+              f"  exact {stats['exact_agreement'] or 0:.1%}  jaccard {stats['mean_jaccard'] or 0:.3f}")
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"Report saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
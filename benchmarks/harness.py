@@ -0,0 +1,269 @@
+import os
+import sys
+import json
+import time
+import array
+import argparse
+import platform
+import resource
+import subprocess
+import tracemalloc
+from utils.regex.regex_utils import extract_assessment_plan, extract_each_plan, match_icd10_codes, \
+    is_icd10_an_hcc
+from utils.regex.scanner import scan_note
+from utils.corpus.plans import deterministic_layers, records_output
+from benchmarks.notes import ProgressNoteGenerator
+
+RESULTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+DEFAULT_SIZES = ["1k", "100k", "1M"]
+# Notes traced with tracemalloc to measure the peak memory of each layer
+MEMORY_SAMPLE = 1000
+
+
+def disabled_llm(assessment_plan):
+    """Stand-in for langGraph_evaluation: the benchmarks measure the layers, not the model"""
+    return "[]"
+
+
+def parse_size(size):
+    """'1k' -> 1000, '1M' -> 1000000"""
+    multipliers = {"k": 1000, "K": 1000, "m": 1000000, "M": 1000000}
+    if size[-1] in multipliers:
+        return int(float(size[:-1]) * multipliers[size[-1]])
+    return int(size)
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted sequence"""
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def _run_layers(progress_note, resolver):
+    # Returns the time spent in each layer for one note, in nanoseconds, and its number of plans
+    clock = time.perf_counter_ns
+    timings = {}
+
+    start = clock()
+    assessment_plan = extract_assessment_plan(progress_note)
+    timings["extract_assessment_plan"] = clock() - start
+
+    start = clock()
+    try:
+        plans = extract_each_plan(assessment_plan)
+    except ValueError:
+        plans = []
+    timings["extract_each_plan"] = clock() - start
+
+    start = clock()
+    codes = [match_icd10_codes(plan) for plan in plans]
+    timings["match_icd10_codes"] = clock() - start
+
+    start = clock()
+    for code, plan in zip(codes, plans):
+        if code:
+            is_icd10_an_hcc(code, plan)
+    timings["is_icd10_an_hcc"] = clock() - start
+
+    start = clock()
+    try:
+        scan_note(progress_note)
+    except ValueError:
+        pass
+    timings["scan_note"] = clock() - start
+
+    # layers() of main.py, with the model replaced by `resolver`
+    start = clock()
+    try:
+        records_output(deterministic_layers(progress_note, resolver=resolver))
+    except ValueError:
+        pass
+    timings["layers"] = clock() - start
+    return timings, len(plans)
+
+
+def _peak_memory(notes, resolver):
+    # Peak traced allocation of one call of each layer, the largest over a sample of notes.
+    # The inputs of a layer are computed before its peak is reset, so each entry measures
+    # that layer alone
+    peaks = {}
+    tracemalloc.start()
+    try:
+        for progress_note in notes:
+            assessment_plan = extract_assessment_plan(progress_note)
+            try:
+                plans = extract_each_plan(assessment_plan)
+            except ValueError:
+                plans = []
+            codes = [match_icd10_codes(plan) for plan in plans]
+            calls = {
+                "extract_assessment_plan": lambda: extract_assessment_plan(progress_note),
+                "extract_each_plan": lambda: extract_each_plan(assessment_plan),
+                "match_icd10_codes": lambda: [match_icd10_codes(plan) for plan in plans],
+                "is_icd10_an_hcc": lambda: [is_icd10_an_hcc(code, plan) for code, plan in zip(codes, plans) if code],
+                "scan_note": lambda: scan_note(progress_note),
+                "layers": lambda: records_output(deterministic_layers(progress_note, resolver=resolver)),
+            }
+            for layer, call in calls.items():
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+                try:
+                    call()
+                except ValueError:
+                    pass
+                peaks[layer] = max(peaks.get(layer, 0), tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def run_corpus(count, seed=0, resolver=disabled_llm, **generator_options):
+    """
+    Benchmark every layer and layers() end to end on a synthetic corpus.
+
+    Notes are generated on the fly and only the layer calls are timed, so the
+    generator neither skews the timings nor holds the corpus in memory.
+
+    Args:
+        count (int): Number of notes
+        seed (int): Seed of the note generator
+        resolver (callable): plan -> condition_data used by layers(), the LLM is disabled by default
+        **generator_options: ProgressNoteGenerator arguments
+
+    Returns:
+        report (dict): Per layer notes_per_second, p50_us, p99_us and total_s, plus
+        the tracemalloc peaks of a sample and the peak RSS of the process
+    """
+    latencies = {}
+    plans = 0
+    generator = ProgressNoteGenerator(seed=seed, **generator_options)
+    sample = []
+    for progress_note in generator.notes(count):
+        if len(sample) < MEMORY_SAMPLE:
+            sample.append(progress_note)
+        timings, note_plans = _run_layers(progress_note, resolver)
+        for layer, elapsed in timings.items():
+            latencies.setdefault(layer, array.array('q')).append(elapsed)
+        plans += note_plans
+
+    report = {"notes": count, "plans": plans, "layers": {}}
+    for layer, values in latencies.items():
+        total = sum(values)
+        values = sorted(values)
+        report["layers"][layer] = {
+            "notes_per_second": round(count / (total / 1e9), 1) if total else None,
+            "p50_us": round(percentile(values, 0.50) / 1000, 2),
+            "p99_us": round(percentile(values, 0.99) / 1000, 2),
+            "total_s": round(total / 1e9, 3),
+        }
+    report["peak_traced_bytes"] = _peak_memory(sample, resolver)
+    # ru_maxrss is in kilobytes on Linux
+    report["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return report
+
+
+def git_commit():
+    """Short hash of HEAD, suffixed with -dirty if the tree has local changes"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if dirty else "")
+
+
+def compare(report, baseline, threshold=0.10):
+    """
+    Compare the notes/s of two reports.
+
+    Args:
+        report (dict): Current results
+        baseline (dict): Results of a previous commit
+        threshold (float): Relative slowdown reported as a regression
+
+    Returns:
+        (lines, regressions): Printable comparison lines, and the number of
+        layers slower than the baseline by more than `threshold`
+    """
+    lines = []
+    regressions = 0
+    for size, corpus in report["corpora"].items():
+        previous = baseline.get("corpora", {}).get(size)
+        if previous is None:
+            continue
+        for layer, stats in corpus["layers"].items():
+            before = previous["layers"].get(layer, {}).get("notes_per_second")
+            after = stats["notes_per_second"]
+            if not before or not after:
+                continue
+            ratio = after / before
+            flag = ""
+            if ratio < 1 - threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            lines.append(f"{size:>8} {layer:<24} {before:>12.1f} -> {after:>12.1f} notes/s ({ratio:.2f}x){flag}")
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the layers on synthetic progress notes")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES,
+                        help="corpus sizes, i.e. 1k 100k 1M")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the note generator")
+    parser.add_argument("--llm", choices=["none", "pipeline"], default="none",
+                        help="model used by layers(): none, or the LangGraph pipeline of the LLM_BACKEND backend")
+    parser.add_argument("--output", default=None,
+                        help="results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", default=None, help="results file of a previous commit")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative slowdown reported as a regression by --compare")
+    args = parser.parse_args(argv)
+
+    resolver = disabled_llm
+    if args.llm == "pipeline":
+        # i.e. LLM_BACKEND=simulated or cassette, to load the pipeline without network
+        from pipeline import langGraph_evaluation, LLM_BACKEND
+        resolver = langGraph_evaluation
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "llm": args.llm if args.llm == "none" else f"pipeline:{LLM_BACKEND}",
+        "corpora": {},
+    }
+    for size in args.sizes:
+        count = parse_size(size)
+        corpus = run_corpus(count, seed=args.seed, resolver=resolver)
+        report["corpora"][str(count)] = corpus
+        print(f"{count} notes ({corpus['plans']} plans):")
+        for layer, stats in corpus["layers"].items():
+            print(f"  {layer:<24} {stats['notes_per_second']:>12.1f} notes/s"
+                  f"  p50 {stats['p50_us']:>8.2f} us  p99 {stats['p99_us']:>8.2f} us")
+        print(f"  peak traced bytes {corpus['peak_traced_bytes']}, peak RSS {corpus['peak_rss_kb']} kB")
+
+    output = args.output or os.path.join(RESULTS_FOLDER, f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        lines, regressions = compare(report, baseline, args.threshold)
+        print(f"Compared with {baseline.get('commit', args.compare)}:")
+        print("\n".join(lines))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
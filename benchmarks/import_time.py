@@ -0,0 +1,73 @@
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+# Packages a deterministic-only run (main.py --no-llm) must never load
+HEAVY_MODULES = ("langgraph", "langchain_core", "langchain_google_vertexai", "vertexai", "google.cloud.aiplatform")
+# Cumulative import time allowed for `import main`, in milliseconds
+DEFAULT_BUDGET_MS = 500
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def profile_import(module="main", cwd=None):
+    """
+    Import `module` in a fresh interpreter with -X importtime.
+
+    Args:
+        module (str): The module to import
+        cwd (str | None): Directory the interpreter runs in, the repository root by default
+
+    Returns:
+        (total_us, imports): Cumulative import time of `module` in microseconds, and
+        {module name: cumulative microseconds} for every module it loaded (modules
+        already loaded by the interpreter at startup are not listed)
+    """
+    cwd = cwd or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               cwd=cwd, capture_output=True, text=True, check=True)
+    imports = {}
+    block = {}
+    for line in completed.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        block[match.group(4)] = int(match.group(2))
+        # A top-level entry closes the block of the modules it loaded (site, then `module`)
+        if len(match.group(3)) <= 1:
+            if match.group(4) == module:
+                imports = block
+            block = {}
+    return imports.get(module, 0), imports
+
+
+def heavy_imports(imports, heavy_modules=HEAVY_MODULES):
+    """The loaded modules that belong to one of `heavy_modules`"""
+    return sorted(name for name in imports
+                  if any(name == heavy or name.startswith(heavy + ".") for heavy in heavy_modules))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the startup cost of the deterministic layers")
+    parser.add_argument("--module", default="main", help="module to import")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help="maximum cumulative import time, in milliseconds")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports listed")
+    args = parser.parse_args(argv)
+
+    total_us, imports = profile_import(args.module)
+    print(f"import {args.module}: {total_us / 1000:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    for name, cumulative in sorted(imports.items(), key=lambda item: -item[1])[1:args.top + 1]:
+        print(f"  {cumulative / 1000:>8.1f} ms  {name}")
+
+    heavy = heavy_imports(imports)
+    if heavy:
+        print(f"Heavy packages loaded at import: {', '.join(heavy[:10])}")
+    if heavy or total_us / 1000 > args.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import os
+import random
+import argparse
+from utils.hcc.code_trie import load_hcc_csv, HCC_CSV_FILE_PATH
+
+# How the number of a plan is written, as seen in progress_notes/pn_*
+NUMBERING_STYLES = {
+    "tab": "        {number}.        {name} -",
+    "dot": "{number}. {name} -",
+    "indented": "   {number}. {name} -",
+    "paren": "{number}) {name} -",
+}
+
+# Common non-HCC codes, used for the plans whose code must not be an HCC
+NON_HCC_CODES = [
+    ("I10", "Essential (primary) hypertension"),
+    ("E78.5", "Hyperlipidemia, unspecified"),
+    ("K21.9", "Gastro-esophageal reflux disease without esophagitis"),
+    ("E55.9", "Vitamin D deficiency, unspecified"),
+    ("J06.9", "Acute upper respiratory infection, unspecified"),
+    ("M54.50", "Low back pain, unspecified"),
+    ("G43.909", "Migraine, unspecified, not intractable, without status migrainosus"),
+    ("G47.33", "Obstructive sleep apnea (adult) (pediatric)"),
+    ("E03.9", "Hypothyroidism, unspecified"),
+    ("Z00.00", "Encounter for general adult medical examination without abnormal findings"),
+]
+
+FIRST_NAMES = ["LUCAS", "EMMA", "NOAH", "OLIVIA", "LIAM", "AVA", "MIA", "ELIJAH", "SOFIA", "JAMES"]
+LAST_NAMES = ["HARRIS", "SMITH", "JOHNSON", "LEE", "GARCIA", "BROWN", "DAVIS", "MARTIN", "CLARK", "WHITE"]
+PROVIDERS = ["DR. MORGAN", "DR. STEELE", "DR. SMITH", "DR. GREEN"]
+INSURANCES = ["BLUE CROSS BLUE SHIELD", "*SELF PAY*", "MEDICARE", "AETNA"]
+PHARMACIES = [
+    "WALGREENS PHARMACY 1055 (ERX): 789 FOREST AVENUE, PORTLAND, ME 04101, Ph (207) 555-9876, Fax (207) 555-6789",
+    "CVS/PHARMACY #2231 (ERX): 12 MAIN STREET, SALEM, OR 97301, Ph (503) 555-0142, Fax (503) 555-0143",
+]
+STATUSES = ["Stable", "Improving", "Worsening", "New diagnosis", "Controlled"]
+MANAGEMENT = [
+    "Continue current medications",
+    "Continue Metformin 1000 mg BID",
+    "Recommend a low sugar and low carbohydrate diet.",
+    "Encourage frequent blood sugar monitoring and A1c check in 3 months",
+    "Refer to cardiology for further evaluation",
+    "Recheck lipid panel in 6 months",
+    "Continue counseling and monitor symptoms",
+    "F/U in 3 months",
+]
+MEDICATIONS = [
+    ("Metformin 1000 mg tablet", "Take 1 tablet(s) twice daily by oral route with meals."),
+    ("Losartan 50 mg tablet", "Take 1 tablet(s) once daily by oral route for blood pressure."),
+    ("Atorvastatin 20 mg tablet", "Take 1 tablet(s) once daily by oral route at bedtime."),
+    ("Insulin Glargine 100 units/mL", "Inject 20 units once daily by subcutaneous route at bedtime."),
+]
+NOISE_LINES = [
+    "Reviewed Allergies",
+    "Reviewed Medications",
+    "Reviewed Problems",
+    "Reviewed Family History",
+    "Reviewed Social History",
+    "None recorded.",
+    "ROS as noted in the HPI",
+    "What is your exercise level?: Regular",
+    "General stress level: Low",
+]
+
+
+def hcc_code_pool(csv_file_path=HCC_CSV_FILE_PATH):
+    """(dotted code, description) of every HCC code of the CSV file"""
+    return [(code[:3] + '.' + code[3:] if len(code) > 3 else code, description)
+            for code, description in load_hcc_csv(csv_file_path).items()]
+
+
+class ProgressNoteGenerator:
+    """
+    Deterministic generator of synthetic progress notes, laid out like progress_notes/pn_*:
+    a patient header, pharmacies, vitals, medications, noise sections, then the
+    "Assessment / Plan" section and a "Return to Office" footer.
+
+    Args:
+        seed (int): Seed of the random generator, the same seed yields the same notes
+        plans (tuple): (min, max) number of plans per note
+        header_noise (tuple): (min, max) number of extra noise lines in the header sections
+        pharmacy_repeats (tuple): (min, max) number of times the pharmacy line is repeated
+        numbering_styles (list of str | None): Keys of NUMBERING_STYLES to pick from, all by default
+        hcc_ratio (float): Probability that the code of a plan is an HCC code
+        code_ratio (float): Probability that a plan has a code at all
+        csv_file_path (str): Source of the HCC codes
+    """
+
+    def __init__(self, seed=0, plans=(1, 8), header_noise=(0, 20), pharmacy_repeats=(1, 4),
+                 numbering_styles=None, hcc_ratio=0.5, code_ratio=0.9, csv_file_path=HCC_CSV_FILE_PATH):
+        self.random = random.Random(seed)
+        self.plans = plans
+        self.header_noise = header_noise
+        self.pharmacy_repeats = pharmacy_repeats
+        self.numbering_styles = [NUMBERING_STYLES[style] for style in (numbering_styles or NUMBERING_STYLES)]
+        self.hcc_ratio = hcc_ratio
+        self.code_ratio = code_ratio
+        self.hcc_codes = hcc_code_pool(csv_file_path)
+
+    def _header(self):
+        rnd = self.random
+        lines = [
+            "Patient",
+            "",
+            f"Name: {rnd.choice(LAST_NAMES)}, {rnd.choice(FIRST_NAMES)} ({rnd.randint(18, 95)}yo, {rnd.choice('MF')})",
+            f"ID#: {rnd.randint(1000, 99999)}",
+            f"Appt. Date/Time: {rnd.randint(1, 12):02d}/{rnd.randint(1, 28):02d}/2025 {rnd.randint(1, 12):02d}:00PM",
+            f"Provider: {rnd.choice(PROVIDERS)}",
+            "Insurance:",
+            f"Med Primary: {rnd.choice(INSURANCES)}",
+            f"Insurance #: {rnd.randint(100000000, 999999999)}",
+            "",
+            "Patient’s Pharmacies",
+        ]
+        pharmacy = rnd.choice(PHARMACIES)
+        lines.extend([pharmacy] * rnd.randint(*self.pharmacy_repeats))
+        lines += [
+            "",
+            "Vitals",
+            f"BP: {rnd.randint(100, 160)}/{rnd.randint(60, 100)} sitting L arm",
+            f"BMI: {rnd.uniform(18, 45):.1f}",
+            f"HR: {rnd.randint(50, 110)}",
+            "",
+            "Medications",
+        ]
+        for name, sig in rnd.sample(MEDICATIONS, rnd.randint(1, len(MEDICATIONS))):
+            lines += [name, sig]
+        lines.append("")
+        lines.extend(rnd.choice(NOISE_LINES) for _ in range(rnd.randint(*self.header_noise)))
+        return lines
+
+    def _plan(self, number, style):
+        rnd = self.random
+        roll = rnd.random()
+        if roll < self.code_ratio * self.hcc_ratio:
+            code, description = rnd.choice(self.hcc_codes)
+        elif roll < self.code_ratio:
+            code, description = rnd.choice(NON_HCC_CODES)
+        else:
+            code, description = None, rnd.choice(NON_HCC_CODES)[1]
+        lines = [style.format(number=number, name=description), rnd.choice(STATUSES)]
+        lines += rnd.sample(MANAGEMENT, rnd.randint(1, 4))
+        if code is not None:
+            lines.append(f"{code}: {description}")
+        return lines
+
+    def note(self):
+        """
+        Returns:
+            progress_note (str): A new synthetic progress note
+        """
+        rnd = self.random
+        style = rnd.choice(self.numbering_styles)
+        lines = self._header()
+        lines += ["", "Assessment / Plan", ""]
+        for number in range(1, rnd.randint(*self.plans) + 1):
+            lines += self._plan(number, style)
+        lines += ["", "Return to Office", "Patient will return to the office in 4 months for routine follow-up.",
+                  "", "Encounter Sign-Off", "Encounter not closed."]
+        return "\n".join(lines)
+
+    def notes(self, count):
+        """Yield `count` notes one at a time, so large corpora are never held in memory"""
+        for _ in range(count):
+            yield self.note()
+
+
+def write_corpus(folder, count, **options):
+    """
+    Write `count` synthetic notes as pn_<i> files, i.e. to benchmark main.py --folder.
+
+    Args:
+        folder (str): Destination folder, created if needed
+        count (int): Number of notes
+        **options: ProgressNoteGenerator arguments
+
+    Returns:
+        paths (list of str): The written files
+    """
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for index, progress_note in enumerate(ProgressNoteGenerator(**options).notes(count)):
+        path = os.path.join(folder, f"pn_{index}")
+        with open(path, 'w') as file:
+            file.write(progress_note)
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a corpus of synthetic progress notes")
+    parser.add_argument("folder", help="destination folder")
+    parser.add_argument("--count", type=int, default=1000, help="number of notes")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args(argv)
+    write_corpus(args.folder, args.count, seed=args.seed)
+    print(f"{args.count} notes written to {args.folder}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,61 +1,436 @@
 import os
-from utils.regex.regex_utils import extract_assessment_plan, \
-    extract_each_plan, match_icd10_codes, is_icd10_an_hcc
-from pipeline import langGraph_evaluation
+import json
+import argparse
+from typing import NamedTuple
+from contextlib import contextmanager, ExitStack
+from utils.corpus.plans import deterministic_layers, records_output, resolve_pending
+from utils.corpus.parallel import parse_notes, note_parser, parser_pool
+from utils.corpus.stages import StagedPipeline
+from utils.hcc.code_trie import get_code_trie
+from utils.hcc.code_index import get_code_index, configure_codeset
+from utils.corpus.writer import JSONLResultWriter, load_completed
+from utils.corpus.manifest import Manifest, MISSING
+from utils.corpus.workqueue import WorkQueue, run_worker
+from utils.corpus.ingest import index_corpus, note_id, note_sha256, DEFAULT_DELIMITER, DEFAULT_TEXT_FIELD
+from utils.llm.cache import ConditionDataCache
+from utils.llm.rules import RuleExtractor, apply_rules
+from utils.llm.compaction import token_savings
+from utils.llm.adaptive import deferred_condition_data, DEFERRED_METRIC
+from utils.metrics.registry import get_registry
+from utils.metrics.tracing import trace, span, configure_tracing
+from utils.metrics.profiling import (configure_profiling, write_profile, format_report, DEFAULT_INTERVAL,
+                                     PROFILE_FILE, REPORT_FILE, TRACE_FILE)
 from dotenv import load_dotenv
 load_dotenv()
 
 progress_notes_folder=os.getenv('PROGRESS_NOTES_FOLDER')
+rules_threshold=os.getenv('RULES_THRESHOLD')
+# Empty values (i.e. HCC_CODESET_VERSION= in .env) mean the defaults
+codeset_path=os.getenv('HCC_CODESET_PATH') or None
+codeset_version=os.getenv('HCC_CODESET_VERSION') or None
 
 def layers(progress_note):
+    # pipeline (langgraph, langchain, vertexai) is only imported once an LLM is needed
+    from pipeline import langGraph_evaluation
     try:
-        if not isinstance(progress_note, str):
-            raise ValueError("Input progress_note must be a string")
-        
-        assessment_section = extract_assessment_plan(progress_note)
-        assessment_plans = extract_each_plan(assessment_section)
-        output = []
-        for plan in assessment_plans:
-            icd10_code = match_icd10_codes(plan)
-            output_plan = {}
-            if icd10_code:
-                partial_output = is_icd10_an_hcc(icd10_code, plan)
-                condition_data = langGraph_evaluation(plan)
-                output_plan.update(partial_output)
-                if partial_output["is_hcc"]:
-                    output_plan["condition_data"] = condition_data
-            output.append(output_plan)
+        # The LLM is only called for the plans whose code is an HCC
+        records = deterministic_layers(progress_note, resolver=langGraph_evaluation)
+        output = [record.to_output() for record in records]
 
         # print(output)
         return output
     except ValueError as e:
         print(e)
 
-if __name__ == "__main__":
-    # Define the root folder path
-    root_folder = progress_notes_folder
-    result_folder = 'result'
-
+def list_progress_notes(root_folder):
+    """Return the paths of the progress notes inside root_folder"""
     # Check if the folder exists
-    if os.path.exists(root_folder) and os.path.isdir(root_folder):
+    if root_folder and os.path.exists(root_folder) and os.path.isdir(root_folder):
         # Get the list of files (without extensions) inside the 'pn' folder
-        pn_paths = [os.path.join(root_folder, f) for f in os.listdir(root_folder) if os.path.isfile(os.path.join(root_folder, f))]
+        return [os.path.join(root_folder, f) for f in sorted(os.listdir(root_folder)) if os.path.isfile(os.path.join(root_folder, f))]
+    print(f"Error: The folder '{root_folder}' does not exist.")
+    return []
+
+async def aresolve_records(records, engine, code_trie=None):
+    """Extract the condition_data of the HCC plans of a note concurrently with the engine"""
+    if records is None:
+        return None
+    pending = [record for record in records if record.needs_llm]
+    results = await engine.extract_many([record.plan for record in pending])
+    for record, condition_data in zip(pending, results):
+        if isinstance(condition_data, Exception):
+            # Retries exhausted or circuit open: left for the next --resume or --manifest run
+            condition_data = deferred_condition_data(condition_data)
+        record.resolve(condition_data)
+    return [record.to_output(code_trie) for record in records]
+
+async def alayers(progress_note, engine):
+    """Async variant of layers(): the HCC plans of the note are extracted concurrently by the engine"""
+    try:
+        records = deterministic_layers(progress_note)
+    except ValueError as e:
+        print(e)
+        return None
+    return await aresolve_records(records, engine)
+
+async def aresolve_note(pn_path, records, engine, code_trie=None):
+    """aresolve_records() with the spans of the note grouped under its path"""
+    with trace(note_id(pn_path)), span("llm_stage"):
+        return await aresolve_records(records, engine, code_trie)
+
+def stream_notes_async(parsed_notes, engine, window, code_trie=None, runner=None):
+    """
+    Drive up to `window` notes concurrently through the engine, yielding (pn_path, output)
+    in order as soon as a note and the ones before it are resolved, so that the outputs
+    are written while the rest of the corpus is still in flight.
+
+    The notes run on the event loop of `runner` (asyncio.Runner), a new one if None.
+    """
+    import asyncio
+    from collections import deque
+    if runner is None:
+        with asyncio.Runner() as runner:
+            yield from stream_notes_async(parsed_notes, engine, window, code_trie, runner)
+        return
+    loop = runner.get_loop()
+    in_flight = deque()
+    try:
+        for pn_path, records in parsed_notes:
+            in_flight.append((pn_path, loop.create_task(aresolve_note(pn_path, records, engine, code_trie))))
+            if len(in_flight) >= window:
+                pn_path, task = in_flight.popleft()
+                yield pn_path, loop.run_until_complete(task)
+        while in_flight:
+            pn_path, task = in_flight.popleft()
+            yield pn_path, loop.run_until_complete(task)
+    finally:
+        # A shared loop outlives this call: the notes left behind by an error are cancelled
+        tasks = [task for _, task in in_flight]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+
+def resolve_in_chunks(parsed_notes, evaluate_many, chunk_size):
+    """
+    --two-phase over `chunk_size` notes at a time: the HCC plans of a chunk are resolved
+    together, then its (pn_path, records) are yielded before the next chunk is parsed.
+    """
+    from itertools import islice
+    parsed_notes = iter(parsed_notes)
+    while chunk := list(islice(parsed_notes, chunk_size)):
+        resolve_pending((record for _, records in chunk if records for record in records), evaluate_many)
+        yield from chunk
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Flag HCC conditions in progress notes")
+    parser.add_argument("--folder", default=progress_notes_folder,
+                        help="folder with the progress notes (default: PROGRESS_NOTES_FOLDER)")
+    parser.add_argument("--input", default=None,
+                        help="corpus file (JSONL or delimited notes) read instead of --folder")
+    parser.add_argument("--input-format", choices=["auto", "jsonl", "delimited"], default="auto",
+                        help="format of --input, auto uses the extension (.jsonl/.ndjson)")
+    parser.add_argument("--delimiter", default=DEFAULT_DELIMITER,
+                        help="separator between the notes of a delimited --input, backslash escapes "
+                             "such as \\n are decoded (default: \\x1e)")
+    parser.add_argument("--text-field", default=DEFAULT_TEXT_FIELD,
+                        help="field holding the note text in a JSONL --input")
+    parser.add_argument("--id-field", default=None,
+                        help="field holding the note id in a JSONL --input (default: file:line)")
+    parser.add_argument("--output", default=os.path.join('result', 'output.jsonl'),
+                        help="JSONL file receiving one record per note")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip the notes already in --output with the same content hash")
+    parser.add_argument("--manifest", default=None,
+                        help="SQLite manifest of the previous runs: only the notes whose content, code set "
+                             "or extraction settings changed are processed again")
+    parser.add_argument("--queue", default=None,
+                        help="SQLite work queue shared by several machines or containers (see --queue-mode)")
+    parser.add_argument("--queue-mode", choices=["enqueue", "work", "status", "export"], default="work",
+                        help="enqueue the notes of --folder/--input, process queued notes, print the "
+                             "progress, or write the results to --output")
+    parser.add_argument("--lease", type=float, default=300.0,
+                        help="seconds a worker holds claimed notes without renewing its lease (--queue)")
+    parser.add_argument("--claim-size", type=int, default=16,
+                        help="notes claimed by a worker at a time (--queue)")
+    parser.add_argument("--fsync-every", type=int, default=50,
+                        help="number of notes written between two fsync calls")
+    parser.add_argument("--no-llm", action="store_true",
+                        help="only flag the ICD-10/HCC codes, without loading nor calling the LLM")
+    parser.add_argument("--two-phase", action="store_true",
+                        help="run the regex layers on every note first, then the LLM only on HCC plans")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="process the notes concurrently with the asyncio extraction engine")
+    parser.add_argument("--staged", action="store_true",
+                        help="overlap the regex layers and the LLM calls: separate worker pools "
+                             "connected by bounded queues")
+    parser.add_argument("--llm-workers", type=int, default=4,
+                        help="threads calling the LLM (--staged)")
+    parser.add_argument("--queue-size", type=int, default=16,
+                        help="capacity of each queue between the stages (--staged)")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="maximum number of LLM calls in flight (--async)")
+    parser.add_argument("--rpm", type=int, default=None,
+                        help="requests per minute quota (--async)")
+    parser.add_argument("--tpm", type=int, default=None,
+                        help="tokens per minute quota (--async)")
+    parser.add_argument("--timeout", type=float, default=60.0,
+                        help="seconds allowed for each LLM attempt of a plan (--async)")
+    parser.add_argument("--max-retries", type=int, default=5,
+                        help="retries on 429, 5xx and timeouts (--async)")
+    parser.add_argument("--batch-tokens", type=int, default=None,
+                        help="with --two-phase, pack several plans per LLM request up to this token budget")
+    parser.add_argument("--chunk-size", type=int, default=64,
+                        help="notes in flight at once (--async), or resolved together (--two-phase), "
+                             "before their results are written")
+    parser.add_argument("--cache", default=None,
+                        help="SQLite file caching the LLM extractions (default: LLM_CACHE_PATH)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes running the regex layers (--staged: parse threads, "
+                             "backed by as many processes when > 1)")
+    parser.add_argument("--codeset", default=codeset_path,
+                        help="HCC code set: HCC_relevant_codes.json or a compiled .hccidx file "
+                             "(default: HCC_CODESET_PATH, else HCC_relevant_codes.json)")
+    parser.add_argument("--codeset-version", default=codeset_version,
+                        help="code set of a compiled file, i.e. V24 or V28 (default: HCC_CODESET_VERSION, "
+                             "else the first one of the file)")
+    parser.add_argument("--all-codes", action="store_true",
+                        help="list every ICD-10 code of each plan with its span, HCC ancestor and descendants")
+    parser.add_argument("--rules-threshold", type=float,
+                        default=float(rules_threshold) if rules_threshold else None,
+                        help="resolve with the rule-based extractor the HCC plans whose confidence reaches "
+                             "this value (0: rules only), the others go to the LLM (default: RULES_THRESHOLD)")
+    parser.add_argument("--trace", default=None,
+                        help="JSONL file receiving the span records of every note")
+    parser.add_argument("--metrics", choices=["json", "prometheus", "none"], default="json",
+                        help="format of the metrics summary printed at the end of the run")
+    parser.add_argument("--profile", default=None,
+                        help="folder receiving a sampling profile of every process in the folded format of "
+                             "flamegraph tools, and a report of the slowest and largest notes with the time of "
+                             "each layer and the memory peaks per stage (tracemalloc)")
+    parser.add_argument("--profile-interval", type=float, default=DEFAULT_INTERVAL,
+                        help="seconds between two stack samples (--profile)")
+    return parser.parse_args(argv)
+
+def extraction_fingerprint(args):
+    """Identifies how the condition_data of a run are computed, for the manifest"""
+    if args.no_llm:
+        extraction = "no-llm"
     else:
-        print(f"Error: The folder '{root_folder}' does not exist.")
-    
-    if(len(pn_paths)) != 0:
-        for pn_path in pn_paths:
-            with open(pn_path, 'r') as file:
-                progress_note = file.read()
-            
-            output = layers(progress_note)
-            
-            # Write the output to a file inside the 'result' folder
-            output_file_path = os.path.join(result_folder, 'output.txt')
-            with open(output_file_path, 'a') as output_file:  # Use 'a' to append the output
-                output_file.write(f"{pn_path}:\n")
-                output_file.write(str(output) + '\n\n')
-                print(f"{pn_path}:")
-                print(str(output) + '\n\n')
-                
-            #print(f"Processed {pn_path}, output written to {output_file_path}")
\ No newline at end of file
+        from pipeline import get_pipeline
+        extraction = get_pipeline().extraction_fingerprint
+    return f"{extraction}:rules={args.rules_threshold}"
+
+def records_preparer(args, manifest=None):
+    """(pn_path, records) -> records, resolving what does not need the LLM: the manifest, then the rules"""
+    extractor = RuleExtractor() if args.rules_threshold is not None else None
+
+    def prepare(pn_path, records):
+        if manifest is not None:
+            # Plans evaluated by a previous run keep their condition_data
+            records = manifest.apply(note_id(pn_path), records)
+        if extractor is not None:
+            records = apply_rules(records, extractor, args.rules_threshold)
+        return records
+    return prepare
+
+def process_notes_staged(args, pn_paths, prepare, code_trie=None, executor=None):
+    """--staged: parse workers and LLM workers run concurrently, connected by bounded queues"""
+    resolver = None
+    if not args.no_llm:
+        from pipeline import langGraph_evaluation
+        resolver = langGraph_evaluation
+
+    def resolve(pn_path, records):
+        with trace(note_id(pn_path)), span("llm_stage"):
+            return records_output(records, resolver=resolver, code_trie=code_trie,
+                                  with_condition_data=resolver is not None)
+
+    with note_parser(args.workers, executor=executor) as parse:
+        staged = StagedPipeline(lambda pn_path: prepare(pn_path, parse(pn_path)), resolve,
+                                parse_workers=args.workers, llm_workers=args.llm_workers,
+                                queue_size=args.queue_size)
+        yield from staged.run(pn_paths)
+    print(f"Stages: {json.dumps(staged.stats(), indent=2)}")
+
+class SharedProcessing(NamedTuple):
+    """The long-lived parts of process_notes(), see note_processing()"""
+    executor: object
+    runner: object
+    engine: object
+
+@contextmanager
+def note_processing(args):
+    """
+    Create once what process_notes() needs for several calls, i.e. for the batches of a
+    queue worker: the parse process pool (--workers), and with --async the event loop
+    and the extraction engine.
+
+    Returns:
+        processing (SharedProcessing): To pass to process_notes()
+    """
+    with ExitStack() as stack:
+        executor = stack.enter_context(parser_pool(args.workers))
+        runner = engine = None
+        if args.use_async and not args.no_llm:
+            import asyncio
+            from pipeline import create_async_engine
+            runner = stack.enter_context(asyncio.Runner())
+            engine = create_async_engine(concurrency=args.concurrency, rpm=args.rpm, tpm=args.tpm,
+                                         timeout=args.timeout, max_retries=args.max_retries)
+        yield SharedProcessing(executor, runner, engine)
+
+def process_notes(args, pn_paths, manifest=None, processing=None):
+    """
+    Yield (pn_path, output) for every progress note, in pn_paths order.
+
+    Args:
+        processing (SharedProcessing | None): Pool, event loop and engine of note_processing(),
+            created for this call if None
+    """
+    if processing is None:
+        with note_processing(args) as processing:
+            yield from process_notes(args, pn_paths, manifest, processing)
+        return
+    prepare = records_preparer(args, manifest)
+    code_trie = get_code_trie() if args.all_codes else None
+    if args.staged:
+        yield from process_notes_staged(args, pn_paths, prepare, code_trie, processing.executor)
+        return
+    # The regex layers may run in worker processes, the LLM stage always runs here
+    parsed_notes = ((pn_path, prepare(pn_path, records))
+                    for pn_path, records in parse_notes(pn_paths, workers=args.workers,
+                                                        executor=processing.executor))
+    if args.no_llm:
+        for pn_path, records in parsed_notes:
+            yield pn_path, records_output(records, code_trie=code_trie, with_condition_data=False)
+        return
+
+    from pipeline import langGraph_evaluation, langGraph_batch_evaluation
+    if args.use_async:
+        yield from stream_notes_async(parsed_notes, processing.engine, args.chunk_size, code_trie,
+                                      processing.runner)
+    elif args.two_phase:
+        if args.batch_tokens:
+            evaluate_many = lambda plans: langGraph_batch_evaluation(plans, args.batch_tokens)
+        else:
+            evaluate_many = lambda plans: [langGraph_evaluation(plan) for plan in plans]
+        for pn_path, records in resolve_in_chunks(parsed_notes, evaluate_many, args.chunk_size):
+            yield pn_path, records_output(records, code_trie=code_trie)
+    else:
+        for pn_path, records in parsed_notes:
+            with trace(note_id(pn_path)), span("llm_stage"):
+                output = records_output(records, resolver=langGraph_evaluation, code_trie=code_trie)
+            yield pn_path, output
+
+def list_notes(args):
+    """The notes of --input, or the files of --folder"""
+    if args.input:
+        delimiter = args.delimiter.encode("utf-8").decode("unicode_escape")
+        return index_corpus(args.input, args.input_format, delimiter, args.text_field, args.id_field)
+    return list_progress_notes(args.folder)
+
+def run_queue(args):
+    """--queue: producer, worker, progress or export of the shared work queue"""
+    queue = WorkQueue(args.queue, lease_seconds=args.lease)
+    if args.queue_mode == "enqueue":
+        pn_paths = list_notes(args)
+        added = queue.enqueue(pn_paths, {pn_path: note_sha256(pn_path) for pn_path in pn_paths})
+        print(f"Queue: {added} notes added, {len(pn_paths) - added} already queued, "
+              f"{queue.requeue_deferred()} deferred notes queued again")
+    elif args.queue_mode == "work":
+        # One process pool, event loop and engine for all the batches of this worker
+        with note_processing(args) as processing:
+            committed = run_worker(queue, lambda notes: process_notes(args, notes, processing=processing),
+                                   batch_size=args.claim_size)
+        print(f"Queue: {committed} notes processed by this worker")
+    elif args.queue_mode == "export":
+        with JSONLResultWriter(args.output, fsync_every=args.fsync_every) as writer:
+            for note, sha256, output in queue.results():
+                writer.write(note, sha256, output)
+        print(f"Queue: {writer.written} results written to {args.output}")
+    print(json.dumps(queue.progress(), indent=2))
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.profile:
+        # The note report is built from the spans: tracing is on while profiling
+        if not args.trace:
+            args.trace = os.path.join(args.profile, TRACE_FILE)
+            if os.path.exists(args.trace):
+                os.remove(args.trace)
+        configure_profiling(args.profile_interval)
+    configure_tracing(args.trace)
+    configure_codeset(args.codeset, args.codeset_version)
+    cache = ConditionDataCache(args.cache) if args.cache and not args.no_llm else None
+    if cache is not None:
+        from pipeline import configure_pipeline
+        configure_pipeline(cache=cache)
+    if args.queue:
+        run_queue(args)
+        print_metrics(args)
+        return
+
+    pn_paths = list_notes(args)
+    hashes = {pn_path: note_sha256(pn_path) for pn_path in pn_paths}
+    if args.resume:
+        completed = load_completed(args.output)
+        pn_paths = [pn_path for pn_path in pn_paths if completed.get(note_id(pn_path)) != hashes[pn_path]]
+        print(f"Resuming: {len(hashes) - len(pn_paths)} notes already done, {len(pn_paths)} to process")
+
+    manifest = None
+    if args.manifest:
+        code_index = get_code_index()
+        manifest = Manifest(args.manifest, dict(code_index.codes), code_index.sha256,
+                            extraction_fingerprint(args), "all_codes" if args.all_codes else "")
+
+    with JSONLResultWriter(args.output, fsync_every=args.fsync_every, append=args.resume) as writer:
+        if manifest is not None:
+            # Unchanged notes are written from the manifest without being processed
+            pending = []
+            for pn_path in pn_paths:
+                output = manifest.reusable_output(note_id(pn_path), hashes[pn_path])
+                if output is MISSING:
+                    pending.append(pn_path)
+                else:
+                    writer.write(note_id(pn_path), hashes[pn_path], output)
+            print(f"Manifest: {len(pn_paths) - len(pending)} notes unchanged, {len(pending)} to process")
+            pn_paths = pending
+        for pn_path, output in process_notes(args, pn_paths, manifest):
+            writer.write(note_id(pn_path), hashes[pn_path], output)
+            if manifest is not None:
+                manifest.record(note_id(pn_path), hashes[pn_path], output)
+            print(f"{note_id(pn_path)}:")
+            print(str(output) + '\n\n')
+
+    if manifest is not None:
+        print(f"Manifest: {manifest.stats()}")
+        manifest.close()
+
+    if cache is not None:
+        print(f"LLM cache: {cache.stats()}")
+    print_metrics(args)
+
+def print_metrics(args):
+    """Print the token savings and the metrics summary of the run, and close the trace"""
+    deferred = get_registry().counter(DEFERRED_METRIC)
+    if deferred:
+        # In queue mode run_worker reports the deferred notes and how to retry them
+        retry = "" if args.queue else ", run again with --resume or --manifest to retry them"
+        print(f"LLM: {deferred} plans deferred after errors or an open circuit{retry}")
+    savings = token_savings()
+    if savings["original_tokens"]:
+        print(f"Plan compaction: {savings['original_tokens']} -> {savings['compacted_tokens']} plan tokens "
+              f"({savings['saved_fraction']:.1%} saved)")
+    if args.metrics == "json":
+        print(json.dumps(get_registry().summary(), indent=2))
+    elif args.metrics == "prometheus":
+        print(get_registry().prometheus(), end="")
+    configure_tracing(None)
+    if args.profile:
+        print(format_report(write_profile(args.profile, args.trace, get_registry())))
+        print(f"Profile: {os.path.join(args.profile, PROFILE_FILE)} (flamegraph.pl, inferno, speedscope), "
+              f"{os.path.join(args.profile, REPORT_FILE)}")
+
+if __name__ == "__main__":
+    main()
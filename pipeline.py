@@ -1,40 +1,177 @@
 from typing import Dict, Any, TypedDict
+from contextlib import contextmanager, asynccontextmanager
+import asyncio
 import json
 import os
+import queue
+import threading
 from langgraph.graph import END, StateGraph
-from langchain_google_vertexai import VertexAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
+from utils.llm.engine import AsyncExtractionEngine
+from utils.llm.ratelimit import RateLimiter, estimate_tokens
+from utils.metrics.registry import get_registry
+from utils.metrics.tracing import span, instrumented
+from utils.llm.batching import pack_plans, render_batch, parse_batch_response
+from utils.llm.cache import ConditionDataCache, cache_key, fingerprint
+from utils.llm.backends import SimulatedLLM, Cassette, SIMULATED_MODEL_FINGERPRINT
+from utils.llm.compaction import CompactedPlan, compact_plan, record_savings, source_lines
+from utils.llm.singleflight import SingleFlight, AsyncSingleFlight
+from utils.llm.adaptive import (AdaptiveConcurrency, CallController, CircuitOpenError, DeferredExtraction,
+                                deferred_condition_data)
 from dotenv import load_dotenv
 load_dotenv()
 
 PROJECT_ID = os.getenv('PROJECT_ID')
 LOCATION = os.getenv('LOCATION')
 CREDENTIALS_PATH = os.getenv('CREDENTIALS_PATH')
+MODEL_POOL_SIZE = int(os.getenv('MODEL_POOL_SIZE', '4'))
+BATCH_TOKEN_BUDGET = int(os.getenv('BATCH_TOKEN_BUDGET', '4000'))
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH')
+# Model backend: "vertex", "simulated" (offline load tests) or "cassette" (record/replay)
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'vertex')
+LLM_CASSETTE_PATH = os.getenv('LLM_CASSETTE_PATH', os.path.join('result', 'llm_cassette.jsonl'))
+LLM_CASSETTE_MODE = os.getenv('LLM_CASSETTE_MODE', 'replay')
+# Remove the code, status and vitals lines of a plan before sending it to the model
+PLAN_COMPACTION = os.getenv('PLAN_COMPACTION', '1') != '0'
+
+MODEL_NAME = "gemini-pro"
+MODEL_TEMPERATURE = 0
+MODEL_FINGERPRINT = f"{MODEL_NAME}:temperature={MODEL_TEMPERATURE}"
+
+# Credentials are exported once per process, not on every model initialization
+_credentials_lock = threading.Lock()
+_credentials_path = None
 
 # Define the state schema for the graph
 GraphState = TypedDict('GraphState', {
     'assessment_plan': str,
+    'compacted_plan': str | None,
+    'line_map': list | None,
+    'compacted': CompactedPlan | None,
     'extracted_text': str | None,
     'condition_data': str | None
 })
 
+# Function to set up the Google credentials a single time per process
+def configure_credentials(credentials_path=None):
+    """Export GOOGLE_APPLICATION_CREDENTIALS once, the first time a credentials path is given."""
+    global _credentials_path
+    if not credentials_path or _credentials_path == credentials_path:
+        return
+    with _credentials_lock:
+        if _credentials_path != credentials_path:
+            os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = credentials_path
+            _credentials_path = credentials_path
+
 # Function to initialize Vertex AI with proper authentication
 def initialize_vertex_model(project_id=None, location=None, credentials_path=None):
     """Initialize Vertex AI model with proper authentication."""
-    if credentials_path:
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = credentials_path
+    # Imported here: the Vertex AI SDK alone takes seconds to load, and the simulated
+    # and cassette (replay) backends never need it
+    from langchain_google_vertexai import VertexAI
+    configure_credentials(credentials_path)
     return VertexAI(
-        model_name="gemini-pro",
+        model_name=MODEL_NAME,
         project=project_id,
         location=location or "us-central1",
-        temperature=0
+        temperature=MODEL_TEMPERATURE
+    )
+
+def create_model_factory(backend=None):
+    """
+    Return the function building a model client of the configured backend.
+
+    Args:
+        backend (str | None): "vertex", "simulated" or "cassette", defaults to LLM_BACKEND
+
+    Returns:
+        (factory, model_fingerprint): The client factory for a ModelPool, and the
+        fingerprint of the model answers used in the cache keys
+    """
+    backend = backend or LLM_BACKEND
+    vertex_factory = lambda: initialize_vertex_model(
+        project_id = PROJECT_ID,
+        location = LOCATION,
+        credentials_path = CREDENTIALS_PATH
     )
+    if backend == "vertex":
+        return vertex_factory, MODEL_FINGERPRINT
+    if backend == "simulated":
+        return lambda: SimulatedLLM.from_env().as_runnable(), SIMULATED_MODEL_FINGERPRINT
+    if backend == "cassette":
+        # One cassette shared by every client of the pool; replayed answers are the real model's
+        cassette = Cassette(LLM_CASSETTE_PATH, LLM_CASSETTE_MODE)
+        if cassette.mode == "record":
+            return lambda: cassette.wrap(vertex_factory()), MODEL_FINGERPRINT
+        return cassette.wrap, MODEL_FINGERPRINT
+    raise ValueError(f"Unknown LLM backend {backend!r}, expected vertex, simulated or cassette")
+
+class ModelPool:
+    """
+    Thread-safe pool of reusable model clients.
+
+    Clients are created lazily, up to `size`, and handed out to one caller at a time,
+    so concurrent plans never share a client and no plan pays for building a new one.
+
+    Args:
+        factory (callable): Builds a new model client
+        size (int): Maximum number of clients kept alive
+    """
+
+    def __init__(self, factory, size=MODEL_POOL_SIZE):
+        if size < 1:
+            raise ValueError("Model pool size must be at least 1")
+        self.factory = factory
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _take(self):
+        """Return an idle client, or a new one if the pool is not full, or None."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created >= self.size:
+                return None
+            self._created += 1
+        try:
+            return self.factory()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    @contextmanager
+    def client(self):
+        """Borrow a client for the duration of the `with` block."""
+        model = self._take()
+        if model is None:
+            model = self._idle.get()
+        try:
+            yield model
+        finally:
+            self._idle.put(model)
+
+    @asynccontextmanager
+    async def aclient(self):
+        """Async variant of client(): waits for a free client without blocking the event loop."""
+        # Polling (instead of a blocking get in a thread) keeps cancellation safe
+        model = self._take()
+        while model is None:
+            await asyncio.sleep(0.01)
+            model = self._take()
+        try:
+            yield model
+        finally:
+            self._idle.put(model)
 
 # Define extraction prompt
-def create_extraction_prompt():
-    return ChatPromptTemplate.from_messages([
-        ("system", """You are an expert medical data processor. Your task is to extract relevant condition management details from the assessment plan.
+EXTRACTION_SYSTEM_PROMPT = """You are an expert medical data processor. Your task is to extract relevant condition management details from the assessment plan.
     
     Extract ONLY information that refers to:
     1. Medications or treatment regimens
@@ -50,28 +187,39 @@ def create_extraction_prompt():
     - Assessment headings or condition names (like "GERD", "Chronic obstructive lung disease")
 
     Return ONLY the extracted information, exactly as written in the original text, with each item on a new line.
-    If no relevant management information is found, return an empty string."""),
-        ("human", "Here is the assessment plan text:\n\n{assessment_plan}")
+    If no relevant management information is found, return an empty string."""
+
+BATCH_EXTRACTION_INSTRUCTIONS = """
+
+    You will receive several assessment plans, each one between a <<<PLAN i>>> line and a <<<END PLAN i>>> line.
+    Apply the rules above to every plan independently and answer with one block per plan, using the same numbers:
+    <<<PLAN i>>>
+    extracted information of plan i, one item per line (nothing if there is none)
+    <<<END PLAN i>>>
+    Do not add anything outside the blocks."""
+
+EXTRACTION_HUMAN_TEMPLATE = "Here is the assessment plan text:\n\n{assessment_plan}"
+
+def create_extraction_prompt():
+    return ChatPromptTemplate.from_messages([
+        ("system", EXTRACTION_SYSTEM_PROMPT),
+        ("human", EXTRACTION_HUMAN_TEMPLATE)
+    ])
+
+# Define the prompt used to extract several plans in a single request
+def create_batch_extraction_prompt():
+    return ChatPromptTemplate.from_messages([
+        ("system", EXTRACTION_SYSTEM_PROMPT + BATCH_EXTRACTION_INSTRUCTIONS),
+        ("human", "Here are the assessment plans:\n\n{assessment_plans}")
     ])
 
 # Function to extract condition data using Vertex AI
 def extract_condition_data(state: GraphState) -> GraphState:
     """Extract condition data from assessment plan using LLM"""
-    assessment_plan = state["assessment_plan"]
-    try:
-        model = initialize_vertex_model(
-            project_id = PROJECT_ID,
-            location = LOCATION,
-            credentials_path = CREDENTIALS_PATH
-        )
-        extraction_chain = create_extraction_prompt() | model | StrOutputParser()
-        extracted_text = extraction_chain.invoke({"assessment_plan": assessment_plan})
-        return {**state, "extracted_text": extracted_text}
-    except Exception as e:
-        print(f"Error using LLM for extraction: {e}")
-        return {**state, "extracted_text": ""}
+    return get_pipeline().extract_condition_data(state)
 
 # Function to format the extracted text as proper JSON
+@instrumented("format_as_json")
 def format_as_json(state: GraphState) -> GraphState:
     """Format the extracted text as JSON"""
     if not state.get("extracted_text"):
@@ -80,17 +228,297 @@ def format_as_json(state: GraphState) -> GraphState:
     extracted_lines = [line for line in extracted_lines if line.strip()]
     return {**state, "condition_data": json.dumps(extracted_lines, indent=2)}
 
+# Function to remove the lines already identified by the regex layers before the LLM call
+@instrumented("compact_plan")
+def compact_assessment_plan(state: GraphState) -> GraphState:
+    """Strip the ICD-10 code, status and vitals lines, keeping the line mapping"""
+    compacted = compact_plan(state["assessment_plan"])
+    # The savings are recorded by the extraction, only if the plan reaches the model
+    return {**state, "compacted_plan": compacted.text, "line_map": list(compacted.line_map), "compacted": compacted}
+
 # Create the graph (functional approach)
-def create_graph():
+def create_graph(extract_node=extract_condition_data, compaction=False):
     workflow = StateGraph(GraphState)
-    workflow.add_node("extract_condition_data", extract_condition_data)
+    workflow.add_node("extract_condition_data", extract_node)
     workflow.add_node("format_json", format_as_json)
     workflow.add_edge("extract_condition_data", "format_json")
     workflow.add_edge("format_json", END)
-    workflow.set_entry_point("extract_condition_data")
+    if compaction:
+        workflow.add_node("compact_plan", compact_assessment_plan)
+        workflow.add_edge("compact_plan", "extract_condition_data")
+        workflow.set_entry_point("compact_plan")
+    else:
+        workflow.set_entry_point("extract_condition_data")
     return workflow.compile()
 
 
+class LangGraphPipeline:
+    """
+    Long-lived LangGraph pipeline: the StateGraph is compiled once and the model
+    clients come from a shared ModelPool, so evaluating a plan has no setup cost
+    and the object can be used from several threads at once.
+
+    Args:
+        model_pool (ModelPool): Pool of model clients, defaults to clients of the LLM_BACKEND backend
+        recursion_limit (int): LangGraph recursion limit for each invocation
+        cache (ConditionDataCache | None): Persistent cache in front of extract_condition_data
+        model_fingerprint (str | None): Model name and parameters, part of the cache key,
+            defaults to the fingerprint of the backend
+        backend (str | None): Backend of the default model pool, defaults to LLM_BACKEND
+        compaction (bool): Send the plans without their code, status and vitals lines,
+            defaults to PLAN_COMPACTION
+        controller (CallController | None): Adaptive concurrency limit and circuit breaker
+            around the model calls, growing up to the size of the model pool if None
+        call_timeout (float | None): Seconds allowed for an async model call, no limit if
+            None. The timeout runs inside the controller slot, so it counts as an overload
+        limiter (RateLimiter | None): Requests/tokens per minute quotas of the async model
+            calls, no limit if None. Only the calls reaching the model are charged, not the
+            cache hits nor the evaluations sharing a flight
+    """
+
+    def __init__(self, model_pool=None, recursion_limit=25, cache=None, model_fingerprint=None, backend=None,
+                 compaction=PLAN_COMPACTION, controller=None, call_timeout=None, limiter=None):
+        if model_pool is None:
+            factory, backend_fingerprint = create_model_factory(backend)
+            model_pool = ModelPool(factory)
+            model_fingerprint = model_fingerprint or backend_fingerprint
+        self.model_pool = model_pool
+        self.prompt = create_extraction_prompt()
+        self.batch_prompt = create_batch_extraction_prompt()
+        self.config = {"recursion_limit": recursion_limit}
+        self.cache = cache
+        self.prompt_fingerprint = fingerprint(EXTRACTION_SYSTEM_PROMPT, EXTRACTION_HUMAN_TEMPLATE)
+        self.model_fingerprint = model_fingerprint or MODEL_FINGERPRINT
+        self.system_prompt_tokens = estimate_tokens(EXTRACTION_SYSTEM_PROMPT)
+        self.compaction = compaction
+        self.controller = controller or CallController(AdaptiveConcurrency(max_limit=model_pool.size))
+        self.call_timeout = call_timeout
+        self.limiter = limiter or RateLimiter()
+        # Concurrent evaluations of the same plan share one graph invocation
+        self.flights = SingleFlight()
+        self.async_flights = AsyncSingleFlight()
+        self.graph = create_graph(RunnableLambda(self.extract_condition_data,
+                                                 afunc=self.aextract_condition_data), compaction)
+
+    def prompt_plan(self, assessment_plan):
+        """
+        Returns:
+            (text, compacted): The plan text sent to the model, and its CompactedPlan
+            when compaction is on (None otherwise)
+        """
+        if not self.compaction:
+            return assessment_plan, None
+        compacted = compact_plan(assessment_plan)
+        return compacted.text, compacted
+
+    def cached_extraction(self, assessment_plan):
+        """Return (cache key, cached extracted text); both are None without a cache"""
+        if self.cache is None:
+            return None, None
+        key = cache_key(assessment_plan, self.prompt_fingerprint, self.model_fingerprint)
+        return key, self.cache.get(key)
+
+    def count_tokens(self, prompt, completion, kind="single"):
+        """Record the (estimated) prompt and completion tokens of an LLM request"""
+        registry = get_registry()
+        registry.increment("hcc_llm_requests_total", kind=kind)
+        registry.increment("hcc_llm_prompt_tokens_total", self.system_prompt_tokens + estimate_tokens(prompt))
+        registry.increment("hcc_llm_completion_tokens_total", estimate_tokens(completion))
+
+    def extract_condition_data(self, state: GraphState) -> GraphState:
+        """
+        Extract condition data from assessment plan using a pooled LLM client.
+
+        Raises:
+            DeferredExtraction: If the model call failed or the circuit is open
+        """
+        # The cache is keyed on the text actually sent to the model
+        assessment_plan = state.get("compacted_plan") or state["assessment_plan"]
+        with span("extract_condition_data") as stage:
+            key, extracted_text = self.cached_extraction(assessment_plan)
+            stage.attributes["cached"] = extracted_text is not None
+            if extracted_text is not None:
+                return {**state, "extracted_text": extracted_text}
+            try:
+                with self.controller.slot(), self.model_pool.client() as model:
+                    extraction_chain = self.prompt | model | StrOutputParser()
+                    extracted_text = extraction_chain.invoke({"assessment_plan": assessment_plan})
+            except Exception as e:
+                # Not recorded as an empty extraction: the plan is retried by a later run
+                if not isinstance(e, CircuitOpenError):
+                    print(f"Error using LLM for extraction, plan deferred: {e}")
+                    get_registry().increment("hcc_llm_errors_total")
+                stage.attributes["error"] = str(e)
+                raise DeferredExtraction(str(e)) from e
+            self.count_tokens(assessment_plan, extracted_text)
+            if state.get("compacted") is not None:
+                record_savings(state["compacted"])
+            if key is not None:
+                self.cache.set(key, extracted_text)
+            return {**state, "extracted_text": extracted_text}
+
+    async def aextract_condition_data(self, state: GraphState) -> GraphState:
+        """
+        Async variant of extract_condition_data used by graph.ainvoke. Errors are not
+        swallowed here: the AsyncExtractionEngine retries them or reports them.
+        """
+        assessment_plan = state.get("compacted_plan") or state["assessment_plan"]
+        with span("extract_condition_data") as stage:
+            key, extracted_text = self.cached_extraction(assessment_plan)
+            stage.attributes["cached"] = extracted_text is not None
+            if extracted_text is not None:
+                return {**state, "extracted_text": extracted_text}
+            # The prompt, the plan and a completion as long as the plan, corrected below
+            request_tokens = self.system_prompt_tokens + estimate_tokens(assessment_plan)
+            charged = request_tokens + estimate_tokens(assessment_plan)
+            await self.limiter.acquire(charged)
+            try:
+                async with self.controller.aslot(), self.model_pool.aclient() as model:
+                    extraction_chain = self.prompt | model | StrOutputParser()
+                    async with asyncio.timeout(self.call_timeout):
+                        extracted_text = await extraction_chain.ainvoke({"assessment_plan": assessment_plan})
+            except Exception as e:
+                if isinstance(e, CircuitOpenError):
+                    self.limiter.reconcile(charged, 0)
+                else:
+                    get_registry().increment("hcc_llm_errors_total")
+                raise
+            self.limiter.reconcile(charged, request_tokens + estimate_tokens(extracted_text))
+            self.count_tokens(assessment_plan, extracted_text)
+            if state.get("compacted") is not None:
+                record_savings(state["compacted"])
+            if key is not None:
+                self.cache.set(key, extracted_text)
+            return {**state, "extracted_text": extracted_text}
+
+    @property
+    def extraction_fingerprint(self):
+        """Hash of everything the condition_data of a plan depends on besides its text"""
+        return fingerprint(self.prompt_fingerprint, self.model_fingerprint, f"compaction={self.compaction}")
+
+    def flight_key(self, assessment_plan):
+        """Key shared by the concurrent evaluations of a plan: normalized plan, prompt and model"""
+        return cache_key(assessment_plan, self.prompt_fingerprint,
+                         f"{self.model_fingerprint}:compaction={self.compaction}")
+
+    async def _aevaluate(self, assessment_plan):
+        condition_data = await self.graph.ainvoke({"assessment_plan": assessment_plan}, config=self.config)
+        return condition_data["condition_data"]
+
+    async def aevaluate(self, assessment_plan: str) -> str:
+        """Async variant of evaluate()"""
+        return await self.async_flights.do(self.flight_key(assessment_plan), self._aevaluate, assessment_plan)
+
+    def _evaluate(self, assessment_plan):
+        condition_data = self.graph.invoke({"assessment_plan": assessment_plan}, config=self.config)
+        return condition_data["condition_data"]
+
+    def evaluate(self, assessment_plan: str) -> str:
+        """
+        Run the compiled graph on one assessment plan and return its condition_data.
+        Threads evaluating the same plan at the same time wait for a single invocation.
+
+        Raises:
+            DeferredExtraction: If the model call failed or the circuit is open
+        """
+        return self.flights.do(self.flight_key(assessment_plan), self._evaluate, assessment_plan)
+
+    def evaluate_traced(self, assessment_plan: str):
+        """
+        evaluate() returning as well the origin of every extracted line.
+
+        Returns:
+            (condition_data, sources): sources holds, for every condition_data line, its
+            index in assessment_plan.splitlines() (None if it cannot be traced)
+        """
+        state = self.graph.invoke({"assessment_plan": assessment_plan}, config=self.config)
+        try:
+            extracted_lines = json.loads(state["condition_data"])
+        except ValueError:
+            extracted_lines = []
+        return state["condition_data"], source_lines(extracted_lines, assessment_plan, state.get("line_map"))
+
+    def evaluate_batch(self, assessment_plans, token_budget=BATCH_TOKEN_BUDGET, max_batch_size=None):
+        """
+        Extract the condition_data of several plans, packing them into as few LLM
+        requests as the token budget allows. Plans missing from a batch response, or
+        from a malformed one, fall back to one evaluate() call each, and the plans
+        whose extraction fails are marked deferred.
+
+        Args:
+            assessment_plans (list of str): The individual assessment plans
+            token_budget (int): Maximum estimated plan tokens per request
+            max_batch_size (int | None): Maximum number of plans per request
+        Returns:
+            list (str): The condition_data of each plan, in order
+        """
+        results = [None] * len(assessment_plans)
+        keys = [None] * len(assessment_plans)
+        prompt_plans, compacted = zip(*map(self.prompt_plan, assessment_plans)) if assessment_plans else ((), ())
+        uncached = []
+        for index, prompt_plan in enumerate(prompt_plans):
+            keys[index], extracted_text = self.cached_extraction(prompt_plan)
+            if extracted_text is not None:
+                results[index] = format_as_json({"extracted_text": extracted_text})["condition_data"]
+            else:
+                uncached.append(index)
+
+        uncached_plans = [prompt_plans[index] for index in uncached]
+        for batch in pack_plans(uncached_plans, token_budget, max_batch_size):
+            batch = [uncached[position] for position in batch]
+            plans = [prompt_plans[index] for index in batch]
+            extracted = {}
+            if len(plans) > 1:
+                try:
+                    with span("extract_condition_data_batch", plans=len(plans)):
+                        rendered = render_batch(plans)
+                        with self.controller.slot(), self.model_pool.client() as model:
+                            batch_chain = self.batch_prompt | model | StrOutputParser()
+                            response = batch_chain.invoke({"assessment_plans": rendered})
+                        self.count_tokens(rendered, response, kind="batch")
+                        extracted = parse_batch_response(response, len(plans))
+                except CircuitOpenError:
+                    pass
+                except Exception as e:
+                    print(f"Error using LLM for batch extraction, falling back to single plans: {e}")
+                    get_registry().increment("hcc_llm_errors_total")
+            for position, index in enumerate(batch):
+                if position in extracted:
+                    # Plans falling back to evaluate() record their savings there, once
+                    if compacted[index] is not None:
+                        record_savings(compacted[index])
+                    if keys[index] is not None:
+                        self.cache.set(keys[index], extracted[position])
+                    results[index] = format_as_json({"extracted_text": extracted[position]})["condition_data"]
+                else:
+                    try:
+                        results[index] = self.evaluate(assessment_plans[index])
+                    except DeferredExtraction as e:
+                        results[index] = deferred_condition_data(e)
+        return results
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+def get_pipeline() -> LangGraphPipeline:
+    """Return the process-wide LangGraphPipeline, building it on first use."""
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                cache = ConditionDataCache(LLM_CACHE_PATH) if LLM_CACHE_PATH else None
+                _pipeline = LangGraphPipeline(cache=cache)
+    return _pipeline
+
+def configure_pipeline(**kwargs) -> LangGraphPipeline:
+    """Build the process-wide LangGraphPipeline with the given LangGraphPipeline arguments."""
+    global _pipeline
+    with _pipeline_lock:
+        _pipeline = LangGraphPipeline(**kwargs)
+    return _pipeline
+
+
 # Main pipeline function to process the assessment plan
 def langGraph_evaluation(assessment_plan: str) -> Dict[str, Any]:
     """
@@ -108,11 +536,52 @@ def langGraph_evaluation(assessment_plan: str) -> Dict[str, Any]:
         # Check if the input text is a string
         if not isinstance(assessment_plan, str):
             raise ValueError("Input assessment_plan must be a string")
-        
-        graph = create_graph()
-        config = {"recursion_limit": 25}
-        condition_data = graph.invoke({"assessment_plan": assessment_plan}, config=config)
-        return condition_data["condition_data"]
+
+        # The graph is compiled once and reused for every plan
+        return get_pipeline().evaluate(assessment_plan)
+    except DeferredExtraction as e:
+        # Kept apart from the empty extractions, to be retried by --resume or --manifest
+        return deferred_condition_data(e)
     except Exception as e:
         # Catch all exceptions and print an error message
-        return f"Error occurred: {str(e)}"
\ No newline at end of file
+        return f"Error occurred: {str(e)}"
+
+
+def langGraph_batch_evaluation(assessment_plans, token_budget=BATCH_TOKEN_BUDGET):
+    """
+    Extract the condition_data of several assessment plans, packed into shared LLM requests
+
+    Args:
+        assessment_plans (list of str): Individual assessment plans, from one or more notes
+        token_budget (int): Maximum estimated plan tokens per request
+    Returns:
+        list (str): The condition_data of each plan, in the same order
+    """
+    try:
+        if not all(isinstance(plan, str) for plan in assessment_plans):
+            raise ValueError("Input assessment_plans must be strings")
+        return get_pipeline().evaluate_batch(assessment_plans, token_budget)
+    except Exception as e:
+        return [f"Error occurred: {str(e)}"] * len(assessment_plans)
+
+
+def create_async_engine(concurrency=8, rpm=None, tpm=None, timeout=60.0, max_retries=5):
+    """
+    Build an AsyncExtractionEngine around the process-wide pipeline. The timeout is
+    applied by the pipeline around the model call, inside its concurrency slot, so
+    that timeouts lower the concurrency limit and count towards the circuit breaker.
+    The quotas are charged by the pipeline as well, only when a plan reaches the model.
+
+    Args:
+        concurrency (int): Maximum number of plans in flight
+        rpm (int | None): Requests per minute quota
+        tpm (int | None): Tokens per minute quota
+        timeout (float | None): Seconds allowed for each attempt of a plan
+        max_retries (int): Retries on 429, 5xx and timeouts
+    Returns:
+        engine (AsyncExtractionEngine): Engine whose extract() returns the condition_data of a plan
+    """
+    pipeline = get_pipeline()
+    pipeline.call_timeout = timeout
+    pipeline.limiter = RateLimiter(rpm, tpm)
+    return AsyncExtractionEngine(pipeline.aevaluate, concurrency=concurrency, timeout=None, max_retries=max_retries)
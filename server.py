@@ -0,0 +1,290 @@
+import os
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from utils.corpus.plans import deterministic_layers, records_output, resolve_pending
+from utils.hcc.code_index import get_code_index, configure_codeset
+from utils.hcc.code_trie import get_code_trie
+from utils.metrics.registry import get_registry
+from utils.metrics.tracing import trace, span
+from pipeline import langGraph_evaluation, get_pipeline, MODEL_POOL_SIZE
+from dotenv import load_dotenv
+load_dotenv()
+
+SERVER_HOST = os.getenv('SERVER_HOST', '127.0.0.1')
+SERVER_PORT = int(os.getenv('SERVER_PORT', '8080'))
+SERVER_MAX_CONCURRENCY = int(os.getenv('SERVER_MAX_CONCURRENCY', '16'))
+CODESET_PATH = os.getenv('HCC_CODESET_PATH') or None
+CODESET_VERSION = os.getenv('HCC_CODESET_VERSION') or None
+# Largest request body accepted, in bytes
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+
+class HCCServer(ThreadingHTTPServer):
+    """
+    HTTP server exposing layers(). The compiled regexes, the code index, the code trie
+    and the LLM client pool are loaded once and shared by every request.
+
+    At most `max_concurrency` requests are processed at a time; the others wait up
+    to `queue_timeout` seconds and are then rejected with a 503.
+
+    Args:
+        address (tuple): (host, port), port 0 for any free port
+        evaluate (callable): plan -> condition_data, defaults to langGraph_evaluation
+        max_concurrency (int): Maximum number of requests processed at once
+        queue_timeout (float): Seconds a request may wait for a free slot
+        llm_workers (int): Threads resolving the HCC plans of a batch
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, evaluate=langGraph_evaluation, max_concurrency=SERVER_MAX_CONCURRENCY,
+                 queue_timeout=5.0, llm_workers=MODEL_POOL_SIZE):
+        super().__init__(address, HCCRequestHandler)
+        self.evaluate = evaluate
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.llm_executor = ThreadPoolExecutor(max_workers=llm_workers, thread_name_prefix="hcc-llm")
+        self.started = time.time()
+        self.code_index = get_code_index()
+        self.code_trie = get_code_trie()
+
+    def trie(self, codeset_version=None):
+        """The code trie of `codeset_version`, the configured code set if None"""
+        return get_code_trie(version=codeset_version)
+
+    def layers(self, progress_note, all_codes=False, codeset_version=None):
+        """
+        layers() of main.py for one note, against the code set `codeset_version` of a
+        compiled code set file (the configured one if None).
+
+        Returns:
+            (plans, error): The output of the note, or None and the reason it has no plans
+        """
+        try:
+            records = deterministic_layers(progress_note, resolver=self.evaluate, codeset_version=codeset_version)
+        except ValueError as e:
+            return None, str(e)
+        return records_output(records, code_trie=self.trie(codeset_version) if all_codes else None), None
+
+    def batch_layers(self, progress_notes, all_codes=False, codeset_version=None):
+        """
+        layers() for several notes: the regex layers of every note first, then the HCC
+        plans of the whole batch are resolved concurrently on the LLM threads.
+
+        Returns:
+            results (list of (plans, error)): One pair per note, in order
+        """
+        notes_records = []
+        errors = []
+        for progress_note in progress_notes:
+            try:
+                notes_records.append(deterministic_layers(progress_note, codeset_version=codeset_version))
+                errors.append(None)
+            except ValueError as e:
+                notes_records.append(None)
+                errors.append(str(e))
+        resolve_pending((record for records in notes_records if records for record in records),
+                        lambda plans: list(self.llm_executor.map(self.evaluate, plans)))
+        code_trie = self.trie(codeset_version) if all_codes else None
+        return [(records_output(records, code_trie=code_trie), error)
+                for records, error in zip(notes_records, errors)]
+
+    def server_close(self):
+        super().server_close()
+        self.llm_executor.shutdown(wait=False)
+
+
+class HCCRequestHandler(BaseHTTPRequestHandler):
+    """
+    Routes:
+        POST /layers        {"note": "<text>", "id": "<optional>", "all_codes": false, "codeset_version": null}
+        POST /layers/batch  {"notes": ["<text>", ...] or [{"note": ..., "id": ...}], "all_codes": false,
+                             "codeset_version": null}
+        GET  /health
+        GET  /metrics       Prometheus text, or JSON with ?format=json
+    """
+
+    protocol_version = "HTTP/1.1"
+    server_version = "HCC/1.0"
+
+    def log_message(self, format, *args):
+        # Requests are counted in the metrics, not logged one by one
+        pass
+
+    def send_json(self, status, payload):
+        self.send_body(status, json.dumps(payload, ensure_ascii=False), "application/json")
+
+    def send_body(self, status, body, content_type, headers=None):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type + "; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        self._status = status
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_SIZE:
+            # The body is left unread, so the connection cannot be reused
+            self.close_connection = True
+            raise RequestError(413, f"Request body larger than {MAX_BODY_SIZE} bytes")
+        try:
+            return json.loads(self.rfile.read(length) or b"null")
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise RequestError(400, f"Invalid JSON body: {e}")
+
+    def handle_route(self, method):
+        path = urlsplit(self.path).path.rstrip("/") or "/"
+        self._status = 500
+        start = time.perf_counter()
+        try:
+            if method == "GET" and path == "/health":
+                self.handle_health()
+            elif method == "GET" and path == "/metrics":
+                self.handle_metrics()
+            elif method == "POST" and path in ("/layers", "/layers/batch"):
+                self.handle_layers(batch=path == "/layers/batch")
+            else:
+                path = "other"
+                raise RequestError(404, f"No route for {method} {self.path}")
+        except RequestError as e:
+            self.send_json(e.status, {"error": str(e)})
+        except Exception as e:
+            self.send_json(500, {"error": f"Error occurred: {str(e)}"})
+        finally:
+            registry = get_registry()
+            registry.increment("hcc_http_requests_total", path=path, status=str(self._status))
+            registry.observe("hcc_http_request_seconds", time.perf_counter() - start, path=path)
+
+    def handle_health(self):
+        server = self.server
+        self.send_json(200, {
+            "status": "ok",
+            "uptime_s": round(time.time() - server.started, 3),
+            "hcc_codes": len(server.code_index),
+            "max_concurrency": server.max_concurrency,
+        })
+
+    def handle_metrics(self):
+        query = parse_qs(urlsplit(self.path).query)
+        if query.get("format") == ["json"]:
+            self.send_json(200, get_registry().summary())
+        else:
+            self.send_body(200, get_registry().prometheus(), "text/plain; version=0.0.4")
+
+    def handle_layers(self, batch):
+        body = self.read_json()
+        if not isinstance(body, dict):
+            raise RequestError(400, "The body must be a JSON object")
+        all_codes = bool(body.get("all_codes"))
+        codeset_version = body.get("codeset_version")
+        if codeset_version is not None and not isinstance(codeset_version, str):
+            raise RequestError(400, '"codeset_version" must be a string')
+        if codeset_version is not None:
+            try:
+                get_code_index(version=codeset_version)
+            except (KeyError, ValueError) as e:
+                raise RequestError(400, str(e).strip("'\""))
+        if batch:
+            notes = body.get("notes")
+            if not isinstance(notes, list):
+                raise RequestError(400, '"notes" must be a list')
+            notes = [note if isinstance(note, dict) else {"note": note} for note in notes]
+        else:
+            notes = [body]
+        if not all(isinstance(note.get("note"), str) for note in notes):
+            raise RequestError(400, '"note" must be a string')
+
+        server = self.server
+        if not server.slots.acquire(timeout=server.queue_timeout):
+            raise RequestError(503, "Too many requests in flight, retry later")
+        try:
+            if batch:
+                with span("http_batch", notes=len(notes)):
+                    results = server.batch_layers([note["note"] for note in notes], all_codes, codeset_version)
+            else:
+                with trace(notes[0].get("id")), span("http_note"):
+                    results = [server.layers(notes[0]["note"], all_codes, codeset_version)]
+        finally:
+            server.slots.release()
+
+        outputs = []
+        for note, (plans, error) in zip(notes, results):
+            output = {"id": note.get("id"), "plans": plans}
+            if error is not None:
+                output["error"] = error
+            outputs.append(output)
+        self.send_json(200, {"results": outputs} if batch else outputs[0])
+
+    def do_GET(self):
+        self.handle_route("GET")
+
+    def do_POST(self):
+        self.handle_route("POST")
+
+
+class RequestError(Exception):
+    """A client error, answered with its HTTP status"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def warm_up(server):
+    """Build the LangGraph pipeline and one model client before the first request"""
+    try:
+        pipeline = get_pipeline()
+        with pipeline.model_pool.client():
+            pass
+    except Exception as e:
+        print(f"LLM warm-up failed, clients will be created on first use: {e}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve layers() over HTTP")
+    parser.add_argument("--host", default=SERVER_HOST, help="interface to listen on (default: SERVER_HOST)")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="port to listen on (default: SERVER_PORT)")
+    parser.add_argument("--max-concurrency", type=int, default=SERVER_MAX_CONCURRENCY,
+                        help="maximum number of requests processed at once")
+    parser.add_argument("--queue-timeout", type=float, default=5.0,
+                        help="seconds a request waits for a free slot before a 503")
+    parser.add_argument("--no-warm-up", action="store_true",
+                        help="do not create the LLM client before the first request")
+    parser.add_argument("--codeset", default=CODESET_PATH,
+                        help="HCC code set: HCC_relevant_codes.json or a compiled .hccidx file "
+                             "(default: HCC_CODESET_PATH, else HCC_relevant_codes.json)")
+    parser.add_argument("--codeset-version", default=CODESET_VERSION,
+                        help="default code set of a compiled file, i.e. V24 or V28, overridden by the "
+                             "\"codeset_version\" of a request (default: HCC_CODESET_VERSION, else the first one of the file)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_codeset(args.codeset, args.codeset_version)
+    server = HCCServer((args.host, args.port), max_concurrency=args.max_concurrency,
+                       queue_timeout=args.queue_timeout)
+    if not args.no_warm_up:
+        warm_up(server)
+    host, port = server.server_address[:2]
+    print(f"Serving layers() on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from benchmarks.notes import ProgressNoteGenerator, write_corpus
+from benchmarks.harness import run_corpus, compare, parse_size
+from utils.regex.scanner import scan_note
+
+def test_generator_is_deterministic():
+    first = list(ProgressNoteGenerator(seed=3).notes(5))
+    assert first == list(ProgressNoteGenerator(seed=3).notes(5))
+    assert first != list(ProgressNoteGenerator(seed=4).notes(5))
+
+def test_generated_plans_are_parsed():
+    for style in ("tab", "dot", "indented", "paren"):
+        generator = ProgressNoteGenerator(seed=1, plans=(6, 6), numbering_styles=[style], code_ratio=1.0)
+        plans = scan_note(generator.note())
+        assert len(plans) == 6
+        assert all(plan.codes for plan in plans)
+
+def test_write_corpus(tmp_path):
+    paths = write_corpus(str(tmp_path), 3, seed=0)
+    assert [os.path.basename(path) for path in paths] == ["pn_0", "pn_1", "pn_2"]
+
+def test_run_corpus_reports_every_layer():
+    report = run_corpus(20, seed=0)
+    assert report["notes"] == 20 and report["plans"] > 0
+    assert set(report["layers"]) == {"extract_assessment_plan", "extract_each_plan", "match_icd10_codes",
+                                     "is_icd10_an_hcc", "scan_note", "layers"}
+    for stats in report["layers"].values():
+        assert stats["p50_us"] <= stats["p99_us"]
+    assert report["peak_traced_bytes"]["layers"] > 0
+    # One peak per layer, each measured on its own
+    peaks = report["peak_traced_bytes"]
+    assert set(peaks) == set(report["layers"]) and all(peak > 0 for peak in peaks.values())
+    assert peaks["layers"] >= peaks["scan_note"]
+
+def test_compare_flags_regressions():
+    baseline = {"corpora": {"1000": {"layers": {"layers": {"notes_per_second": 1000.0}}}}}
+    report = {"corpora": {"1000": {"layers": {"layers": {"notes_per_second": 500.0}}}}}
+    lines, regressions = compare(report, baseline, threshold=0.1)
+    assert regressions == 1 and "REGRESSION" in lines[0]
+    assert parse_size("1k") == 1000 and parse_size("1M") == 1000000
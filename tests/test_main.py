@@ -0,0 +1,124 @@
+import os
+import sys
+import json
+import subprocess
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from benchmarks.import_time import profile_import, heavy_imports, HEAVY_MODULES
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+def test_importing_main_loads_no_llm_package():
+    _, imports = profile_import("main", cwd=ROOT)
+    assert "main" in imports
+    assert heavy_imports(imports) == []
+
+def test_no_llm_run_never_loads_the_pipeline(tmp_path):
+    output = str(tmp_path / "output.jsonl")
+    script = (
+        "import sys, main\n"
+        f"main.main(['--no-llm', '--folder', 'progress_notes', '--output', {output!r}, '--metrics', 'none'])\n"
+        f"loaded = [m for m in sys.modules if m.split('.')[0] in {HEAVY_MODULES!r} or m == 'pipeline']\n"
+        "assert not loaded, loaded\n"
+    )
+    subprocess.run([sys.executable, "-c", script], cwd=ROOT, check=True, capture_output=True)
+    with open(output) as file:
+        records = [json.loads(line) for line in file]
+    assert len(records) == len(os.listdir(os.path.join(ROOT, "progress_notes")))
+    plans = [plan for record in records if record["plans"] for plan in record["plans"]]
+    assert any(plan.get("is_hcc") for plan in plans)
+    assert all("condition_data" not in plan for plan in plans)
+
+def test_staged_run_matches_the_sequential_run(tmp_path):
+    import main
+    outputs = {}
+    for name, options in (("sequential", []), ("staged", ["--staged", "--llm-workers", "2", "--queue-size", "1"])):
+        path = str(tmp_path / f"{name}.jsonl")
+        main.main(["--no-llm", "--folder", os.path.join(ROOT, "progress_notes"), "--output", path,
+                   "--metrics", "none"] + options)
+        with open(path) as file:
+            outputs[name] = [json.loads(line) for line in file]
+    assert outputs["staged"] == outputs["sequential"]
+
+def test_profile_of_a_run_with_worker_processes(tmp_path):
+    profile = str(tmp_path / "profile")
+    subprocess.run([sys.executable, "main.py", "--no-llm", "--folder", "progress_notes", "--workers", "2",
+                    "--output", str(tmp_path / "output.jsonl"), "--metrics", "none", "--profile", profile,
+                    "--profile-interval", "0.001"], cwd=ROOT, check=True, capture_output=True)
+    with open(os.path.join(profile, "report.json")) as file:
+        report = json.load(file)
+    assert report["notes"] == len(os.listdir(os.path.join(ROOT, "progress_notes")))
+    slowest = report["slowest"][0]
+    assert slowest["chars"] and "deterministic_layers" in slowest["layers"] and "scan_note" in slowest["layers"]
+    assert any(series.startswith("hcc_stage_memory_peak_bytes") for series in report["memory_peak_bytes"])
+    with open(os.path.join(profile, "profile.folded")) as file:
+        stacks = [line.rsplit(" ", 1) for line in file]
+    assert all(count.strip().isdigit() for _, count in stacks)
+    assert any(stack.startswith("worker;") for stack, _ in stacks)
+
+def test_run_with_the_example_env_values(tmp_path):
+    from dotenv import dotenv_values
+    env = {**os.environ, **{key: value or "" for key, value in dotenv_values(os.path.join(ROOT, ".example.env")).items()}}
+    # Empty values, as in .env files made from older templates, mean the defaults
+    env.update(HCC_CODESET_VERSION="", HCC_CODESET_PATH="")
+    output = str(tmp_path / "output.jsonl")
+    subprocess.run([sys.executable, "main.py", "--no-llm", "--output", output, "--metrics", "none"],
+                   cwd=ROOT, env=env, check=True, capture_output=True)
+    with open(output) as file:
+        assert len(file.readlines()) == len(os.listdir(os.path.join(ROOT, "progress_notes")))
+
+class SlowEngine:
+    """extract_many() of AsyncExtractionEngine, slower for the first notes"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def extract_many(self, plans):
+        import asyncio
+        self.calls += 1
+        await asyncio.sleep(0.02 if self.calls <= 2 else 0.001)
+        return ["[]"] * len(plans)
+
+def numbered_notes(pulled, count=10):
+    from utils.corpus.plans import deterministic_layers
+    note = open(os.path.join(ROOT, "progress_notes", "pn_1")).read()
+    for index in range(count):
+        pulled.append(index)
+        yield f"pn_{index}", deterministic_layers(note)
+
+def test_async_results_stream_in_order():
+    from main import stream_notes_async
+    pulled = []
+    outputs = stream_notes_async(numbered_notes(pulled), SlowEngine(), window=3)
+    pn_path, output = next(outputs)
+    # The first note is yielded while most of the corpus has not been read yet
+    assert pn_path == "pn_0" and len(pulled) == 3
+    assert all(plan["condition_data"] == "[]" for plan in output if plan["is_hcc"])
+    assert [pn_path for pn_path, _ in outputs] == [f"pn_{index}" for index in range(1, 10)]
+
+def test_two_phase_resolves_chunk_by_chunk():
+    from main import resolve_in_chunks
+    pulled, batches = [], []
+    def evaluate_many(plans):
+        batches.append(len(pulled))
+        return ["[]"] * len(plans)
+    chunks = resolve_in_chunks(numbered_notes(pulled), evaluate_many, chunk_size=4)
+    assert next(chunks)[0] == "pn_0" and len(pulled) == 4
+    assert [pn_path for pn_path, _ in chunks] == [f"pn_{index}" for index in range(1, 10)]
+    assert batches == [4, 8, 10]
+
+def test_queue_worker_starts_one_process_pool(tmp_path, monkeypatch):
+    import main
+    from utils.corpus import parallel
+    pools = []
+    class CountedPool(parallel.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            pools.append(1)
+            super().__init__(*args, **kwargs)
+    monkeypatch.setattr(parallel, "ProcessPoolExecutor", CountedPool)
+    queue = str(tmp_path / "queue.sqlite")
+    common = ["--no-llm", "--queue", queue, "--folder", os.path.join(ROOT, "progress_notes"), "--metrics", "none"]
+    main.main(common + ["--queue-mode", "enqueue"])
+    main.main(common + ["--workers", "2", "--claim-size", "2"])
+    from utils.corpus.workqueue import WorkQueue
+    assert WorkQueue(queue).progress()["done"] == len(os.listdir(os.path.join(ROOT, "progress_notes")))
+    assert len(pools) == 1
@@ -0,0 +1,214 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+pytest.importorskip("langgraph")
+from langchain_core.language_models.fake import FakeListLLM
+from langchain_core.runnables import RunnableLambda
+from pipeline import ModelPool, LangGraphPipeline
+from utils.llm.engine import AsyncExtractionEngine
+from utils.llm.ratelimit import RateLimiter
+from utils.llm.compaction import compact_plan
+from utils.metrics.registry import MetricsRegistry
+from utils.llm.cache import ConditionDataCache
+from utils.llm.adaptive import AdaptiveConcurrency, CallController, CircuitBreaker, DeferredExtraction, is_deferred
+
+def test_model_pool_reuses_clients():
+    created = []
+    def factory():
+        created.append(object())
+        return created[-1]
+
+    pool = ModelPool(factory, size=2)
+    with pool.client() as first:
+        pass
+    with pool.client() as second:
+        pass
+    assert first is second
+    assert len(created) == 1
+
+def test_model_pool_is_bounded():
+    pool = ModelPool(object, size=2)
+    barrier = threading.Barrier(4)
+    seen = set()
+    lock = threading.Lock()
+
+    def borrow():
+        barrier.wait()
+        for _ in range(50):
+            with pool.client() as model:
+                with lock:
+                    seen.add(id(model))
+
+    threads = [threading.Thread(target=borrow) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(seen) <= 2
+
+def test_pipeline_compiles_once_and_evaluates():
+    pool = ModelPool(lambda: FakeListLLM(responses=["Continue the antacids\n\nF/U in 3 months"]), size=1)
+    pipeline = LangGraphPipeline(model_pool=pool)
+    graph = pipeline.graph
+    for _ in range(3):
+        result = pipeline.evaluate("1. GERD -\nContinue the antacids\nF/U in 3 months")
+        assert json.loads(result) == ["Continue the antacids", "F/U in 3 months"]
+    assert pipeline.graph is graph
+
+def test_pipeline_aevaluate():
+    pool = ModelPool(lambda: FakeListLLM(responses=["Start atorvastatin 10 mg"]), size=2)
+    pipeline = LangGraphPipeline(model_pool=pool)
+
+    async def run():
+        return await asyncio.gather(*(pipeline.aevaluate("6. CKD\nStart atorvastatin 10 mg") for _ in range(5)))
+
+    for result in asyncio.run(run()):
+        assert json.loads(result) == ["Start atorvastatin 10 mg"]
+
+def test_evaluate_batch_falls_back_for_missing_plans():
+    responses = [
+        "<<<PLAN 0>>>\nContinue the antacids\n<<<END PLAN 0>>>",
+        "Counseled for smoking cessation today",
+    ]
+    pool = ModelPool(lambda: FakeListLLM(responses=responses), size=1)
+    pipeline = LangGraphPipeline(model_pool=pool)
+    results = pipeline.evaluate_batch(["1. GERD -\nContinue the antacids",
+                                       "3. COPD -\nCounseled for smoking cessation today"])
+    assert [json.loads(result) for result in results] == [["Continue the antacids"],
+                                                          ["Counseled for smoking cessation today"]]
+
+def test_pipeline_cache_skips_repeated_calls(tmp_path):
+    calls = []
+    def factory():
+        calls.append(1)
+        return FakeListLLM(responses=["Continue the antacids"])
+
+    cache = ConditionDataCache(str(tmp_path / "cache.sqlite"))
+    pipeline = LangGraphPipeline(model_pool=ModelPool(factory, size=1), cache=cache)
+    first = pipeline.evaluate("1. GERD -\nContinue the antacids")
+    second = LangGraphPipeline(model_pool=ModelPool(factory, size=1), cache=cache).evaluate(
+        "1. GERD -\n   Continue the antacids")
+    assert first == second
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 1
+
+def test_pipeline_with_the_simulated_backend(monkeypatch):
+    monkeypatch.setenv("LLM_SIM_LATENCY", "0")
+    pipeline = LangGraphPipeline(backend="simulated")
+    result = pipeline.evaluate("1. GERD -\nStable\nContinue the antacids\nK21.9: Gastro-esophageal reflux disease")
+    assert json.loads(result) == ["Continue the antacids"]
+    assert pipeline.model_fingerprint == "simulated"
+
+def test_pipeline_compacts_the_plan_before_the_model():
+    prompts = []
+    def model(prompt_value):
+        prompts.append(prompt_value.to_messages()[-1].content)
+        return "Continue the antacids"
+
+    pool = ModelPool(lambda: RunnableLambda(model), size=1)
+    plan = "1. GERD -\n   Stable\n   BP: 140/80 today\n   Continue the antacids\n   K21.9: Gastro-esophageal reflux disease"
+    condition_data, sources = LangGraphPipeline(model_pool=pool, compaction=True).evaluate_traced(plan)
+    assert json.loads(condition_data) == ["Continue the antacids"]
+    assert sources == [3]
+    assert "Stable" not in prompts[0] and "K21.9" not in prompts[0] and "1. GERD" in prompts[0]
+    LangGraphPipeline(model_pool=pool, compaction=False).evaluate(plan)
+    assert "K21.9" in prompts[1]
+
+def test_concurrent_evaluations_of_a_plan_are_coalesced():
+    calls = []
+    def model(prompt_value):
+        calls.append(1)
+        time.sleep(0.05)
+        return "Continue the antacids"
+
+    pipeline = LangGraphPipeline(model_pool=ModelPool(lambda: RunnableLambda(model), size=4))
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(pipeline.evaluate, ["1. GERD -\nContinue the antacids",
+                                                        "1. GERD -\n   Continue the antacids"] * 2))
+    assert len(set(results)) == 1 and len(calls) == 1
+
+def test_failed_extractions_are_deferred_and_the_circuit_opens():
+    calls = []
+    class QuotaError(Exception):
+        status_code = 429
+
+    def model(prompt_value):
+        calls.append(1)
+        raise QuotaError("quota exceeded")
+
+    controller = CallController(AdaptiveConcurrency(initial=4, max_limit=4), CircuitBreaker(failure_threshold=2))
+    pipeline = LangGraphPipeline(model_pool=ModelPool(lambda: RunnableLambda(model), size=4), controller=controller)
+    with pytest.raises(DeferredExtraction):
+        pipeline.evaluate("1. GERD -\nContinue the antacids")
+    assert controller.concurrency.limit == 2
+    results = pipeline.evaluate_batch(["3. COPD -\nCounseled for smoking cessation today",
+                                       "6. CKD\nStart atorvastatin 10 mg"])
+    assert all(is_deferred(result) for result in results)
+    # The batch request failed, the circuit opened, and the single plans never reached the model
+    assert len(calls) == 2 and controller.breaker.state == "open"
+
+def test_async_timeouts_lower_the_limit_and_open_the_circuit():
+    async def slow_model(prompt_value):
+        await asyncio.sleep(1)
+        return "Continue the antacids"
+
+    controller = CallController(AdaptiveConcurrency(initial=4, max_limit=4), CircuitBreaker(failure_threshold=2))
+    pool = ModelPool(lambda: RunnableLambda(lambda prompt_value: "", afunc=slow_model), size=4)
+    pipeline = LangGraphPipeline(model_pool=pool, controller=controller, call_timeout=0.02)
+    engine = AsyncExtractionEngine(pipeline.aevaluate, timeout=None, max_retries=0)
+    started = time.monotonic()
+    for plan in ("1. GERD -\nContinue the antacids", "6. CKD\nStart atorvastatin 10 mg"):
+        with pytest.raises(TimeoutError):
+            asyncio.run(engine.extract(plan))
+    assert time.monotonic() - started < 1
+    # Each timeout halved the limit and counted as a failure
+    assert controller.concurrency.limit == 1 and controller.breaker.state == "open"
+    assert controller.stats()["in_flight"] == 0
+
+def test_only_the_model_calls_are_charged_to_the_quotas(tmp_path):
+    charges = []
+    class CountingLimiter(RateLimiter):
+        async def acquire(self, tokens=1):
+            charges.append(tokens)
+            await super().acquire(tokens)
+
+    pool = ModelPool(lambda: FakeListLLM(responses=["Continue the antacids"]), size=1)
+    cache = ConditionDataCache(str(tmp_path / "cache.sqlite"))
+    limiter = CountingLimiter(rpm=60, tpm=100000)
+    pipeline = LangGraphPipeline(model_pool=pool, cache=cache, limiter=limiter, compaction=False)
+    engine = AsyncExtractionEngine(pipeline.aevaluate)
+    plan = "1. GERD -\nContinue the antacids"
+
+    async def run():
+        # Two evaluations share a flight, the third one is a cache hit
+        first = await asyncio.gather(engine.extract(plan), engine.extract(plan))
+        return first + [await engine.extract(plan)]
+    assert len(set(asyncio.run(run()))) == 1
+    assert len(charges) == 1
+
+def test_savings_are_recorded_once_per_plan_sent(monkeypatch, tmp_path):
+    from utils.llm import compaction
+    registry = MetricsRegistry()
+    monkeypatch.setattr(compaction, "get_registry", lambda: registry)
+    responses = [
+        "<<<PLAN 0>>>\nContinue the antacids\n<<<END PLAN 0>>>",
+        "Counseled for smoking cessation today",
+    ]
+    pool = ModelPool(lambda: FakeListLLM(responses=responses), size=1)
+    cache = ConditionDataCache(str(tmp_path / "cache.sqlite"))
+    pipeline = LangGraphPipeline(model_pool=pool, cache=cache, compaction=True)
+    plans = ["1. GERD -\n   Stable\n   Continue the antacids", "3. COPD -\n   Counseled for smoking cessation today"]
+    # The second plan is missing from the batch response and falls back to a single call
+    pipeline.evaluate_batch(plans)
+    sent = sum(compact_plan(plan).original_tokens for plan in plans)
+    assert registry.counter("hcc_llm_plan_tokens_total", stage="original") == sent
+    # Cache hits never reach the model
+    pipeline.evaluate_batch(plans)
+    pipeline.evaluate(plans[0])
+    assert registry.counter("hcc_llm_plan_tokens_total", stage="original") == sent
@@ -0,0 +1,93 @@
+import os
+import sys
+import json
+import threading
+import urllib.request
+import urllib.error
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+pytest.importorskip("langgraph")
+from server import HCCServer, parse_args
+from utils.hcc.codeset import compile_codesets
+from utils.hcc.code_index import configure_codeset, HCC_JSON_FILE_PATH
+
+NOTE = open(os.path.join(os.path.dirname(__file__), '..', 'progress_notes', 'pn_1')).read()
+
+@pytest.fixture
+def server():
+    calls = []
+    def evaluate(plan):
+        calls.append(plan)
+        return '["managed"]'
+    server = HCCServer(("127.0.0.1", 0), evaluate=evaluate, max_concurrency=2, queue_timeout=0.1)
+    server.calls = calls
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def request(server, path, body=None):
+    url = "http://%s:%d%s" % (*server.server_address[:2], path)
+    data = json.dumps(body).encode() if body is not None else None
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data)) as response:
+            return response.status, response.read().decode()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode()
+
+def test_single_note(server):
+    status, body = request(server, "/layers", {"note": NOTE, "id": "pn_1"})
+    result = json.loads(body)
+    assert status == 200 and result["id"] == "pn_1"
+    hcc_plans = [plan for plan in result["plans"] if plan.get("is_hcc")]
+    assert hcc_plans and all(plan["condition_data"] == '["managed"]' for plan in hcc_plans)
+    assert len(server.calls) == len(hcc_plans)
+
+def test_batch_and_errors(server):
+    status, body = request(server, "/layers/batch", {"notes": [NOTE, {"note": "no plans here", "id": "x"}]})
+    results = json.loads(body)["results"]
+    assert status == 200 and results[0]["plans"] and results[1]["plans"] is None
+    assert results[1] == {"id": "x", "plans": None, "error": "No sections found in the input text."}
+    assert request(server, "/layers", {"text": NOTE})[0] == 400
+    assert request(server, "/nowhere")[0] == 404
+
+def test_health_and_metrics(server):
+    status, body = request(server, "/health")
+    assert status == 200 and json.loads(body)["hcc_codes"] > 0
+    request(server, "/layers", {"note": NOTE})
+    status, body = request(server, "/metrics")
+    assert status == 200 and 'hcc_http_requests_total{path="/layers",status="200"}' in body
+    assert "histograms" in json.loads(request(server, "/metrics?format=json")[1])
+
+def test_concurrency_limit(server):
+    for _ in range(server.max_concurrency):
+        server.slots.acquire()
+    try:
+        assert request(server, "/layers", {"note": NOTE})[0] == 503
+    finally:
+        for _ in range(server.max_concurrency):
+            server.slots.release()
+
+def test_codeset_options(tmp_path):
+    with open(HCC_JSON_FILE_PATH) as json_file:
+        v24 = json.load(json_file)
+    v28 = {code: name for code, name in v24.items() if code != "J449"}
+    path = str(tmp_path / "codes.hccidx")
+    compile_codesets({"V24": v24, "V28": v28}, path)
+    args = parse_args(["--codeset", path, "--codeset-version", "V28"])
+    configure_codeset(args.codeset, args.codeset_version)
+    server = HCCServer(("127.0.0.1", 0), evaluate=lambda plan: "[]")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        hcc_codes = {}
+        for version in (None, "V24"):
+            status, body = request(server, "/layers", {"note": NOTE, "codeset_version": version})
+            assert status == 200
+            hcc_codes[version] = {plan["condition_code"] for plan in json.loads(body)["plans"] if plan["is_hcc"]}
+        assert hcc_codes["V24"] - hcc_codes[None] == {"J449"}
+        assert request(server, "/layers", {"note": NOTE, "codeset_version": "V99"})[0] == 400
+    finally:
+        server.shutdown()
+        server.server_close()
+        configure_codeset(None)
@@ -0,0 +1,41 @@
+import os
+import sys
+import json
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from utils.corpus.ingest import index_corpus, read_note, note_sha256
+from utils.corpus.parallel import parse_notes
+
+NOTES_FOLDER = os.path.join(os.path.dirname(__file__), '../../../progress_notes')
+NOTES = [open(os.path.join(NOTES_FOLDER, f'pn_{i}')).read() for i in range(4)]
+
+def write_jsonl(path):
+    with open(path, 'w') as file:
+        for index, note in enumerate(NOTES):
+            file.write(json.dumps({"id": f"note-{index}", "note": note}) + "\n")
+        file.write("\n")
+
+def test_jsonl_offsets_round_trip(tmp_path):
+    path = str(tmp_path / "notes.jsonl")
+    write_jsonl(path)
+    refs = index_corpus(path)
+    assert [read_note(ref) for ref in refs] == NOTES
+    assert refs[1].note_id == f"{path}:2"
+    assert [ref.note_id for ref in index_corpus(path, id_field="id")] == [f"note-{i}" for i in range(4)]
+    assert note_sha256(refs[0]) != note_sha256(refs[1])
+
+def test_delimited_file(tmp_path):
+    path = str(tmp_path / "notes.txt")
+    with open(path, 'w') as file:
+        file.write("\n=====\n".join(NOTES) + "\n=====\n\n")
+    refs = index_corpus(path, delimiter="=====")
+    assert [read_note(ref) for ref in refs] == [note.strip() for note in NOTES]
+    assert [ref.note_id for ref in refs] == [f"{path}#{i}" for i in range(4)]
+    assert len(index_corpus(path, delimiter="absent")) == 1
+
+def test_workers_parse_refs(tmp_path):
+    path = str(tmp_path / "notes.jsonl")
+    write_jsonl(path)
+    refs = index_corpus(path)
+    sequential = [[record.plan for record in records] for _, records in parse_notes(refs)]
+    parallel = [[record.plan for record in records] for _, records in parse_notes(refs, workers=2)]
+    assert sequential == parallel and all(sequential)
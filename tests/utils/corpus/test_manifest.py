@@ -0,0 +1,53 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from utils.corpus.manifest import Manifest, MISSING
+from utils.corpus.plans import deterministic_layers, records_output
+
+NOTE = """Assessment / Plan
+1. Hyperglycemia due to type 2 diabetes mellitus -
+   Continue Metformin 1000 mg BID
+   E11.65: Type 2 diabetes mellitus with hyperglycemia
+2. GERD -
+   Continue the antacids
+   K21.9: Gastro-esophageal reflux disease without esophagitis
+"""
+CODES = {"E1165": "Type 2 diabetes mellitus with hyperglycemia", "I10": "Essential hypertension"}
+
+def run(path, codes, codeset, note="pn_1", sha256="a", text=NOTE, calls=None):
+    # One run of main.py over a single note, with the code set `codes`
+    with Manifest(path, codes, codeset, "prompt") as manifest:
+        output = manifest.reusable_output(note, sha256)
+        if output is not MISSING:
+            return output, manifest.stats()
+        records = deterministic_layers(text)
+        for record in records:
+            record.partial_output["is_hcc"] = record.partial_output["condition_code"] in codes
+        manifest.apply(note, records)
+        resolver = lambda plan: (calls.append(plan) if calls is not None else None) or '["resolved"]'
+        output = records_output(records, resolver=resolver)
+        manifest.record(note, sha256, output)
+        return output, manifest.stats()
+
+def test_unchanged_notes_are_reused(tmp_path):
+    path = str(tmp_path / "manifest.sqlite")
+    calls = []
+    first, _ = run(path, CODES, "v1", calls=calls)
+    second, stats = run(path, CODES, "v1", calls=calls)
+    assert first == second and stats["reused_notes"] == 1
+    assert len(calls) == 1
+    run(path, CODES, "v1", sha256="b", calls=calls)
+    assert len(calls) == 1
+
+def test_code_set_change_reevaluates_only_affected_notes(tmp_path):
+    path = str(tmp_path / "manifest.sqlite")
+    calls = []
+    run(path, CODES, "v1", calls=calls)
+    # I10 is not in the note: its output is reused
+    _, stats = run(path, {**CODES, "I10": "Hypertension"}, "v2", calls=calls)
+    assert stats == {"reused_notes": 1, "reused_plans": 0, "affected_codes": 1}
+    # K219 becomes an HCC: the note is parsed again, only the new HCC plan goes to the LLM
+    output, stats = run(path, {**CODES, "I10": "Hypertension", "K219": "GERD"}, "v3", calls=calls)
+    assert stats["reused_notes"] == 0 and stats["reused_plans"] == 1
+    assert [plan["is_hcc"] for plan in output] == [True, True]
+    assert len(calls) == 2 and "GERD" in calls[1]
@@ -0,0 +1,23 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from utils.corpus.parallel import parse_notes
+
+PROGRESS_NOTES = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../progress_notes'))
+HCC_JSON = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../HCC_relevant_codes.json'))
+
+def test_worker_pool_matches_serial_run_and_keeps_order():
+    pn_paths = sorted(os.path.join(PROGRESS_NOTES, f) for f in os.listdir(PROGRESS_NOTES))
+    summary = lambda records: records and [(record.plan, record.partial_output) for record in records]
+    serial = [(pn_path, summary(records))
+              for pn_path, records in parse_notes(pn_paths, workers=1, hcc_json_file_path=HCC_JSON)]
+    parallel = [(pn_path, summary(records))
+                for pn_path, records in parse_notes(pn_paths, workers=3, chunksize=2, hcc_json_file_path=HCC_JSON)]
+    assert [pn_path for pn_path, _ in parallel] == pn_paths
+    assert parallel == serial
+
+def test_records_come_back_unresolved():
+    pn_path = os.path.join(PROGRESS_NOTES, 'pn_1')
+    [(_, records)] = list(parse_notes([pn_path, pn_path], workers=2, hcc_json_file_path=HCC_JSON))[:1]
+    assert any(record.needs_llm for record in records)
+    assert all(record.resolver is None for record in records)
@@ -0,0 +1,48 @@
+import os
+import sys
+import pickle
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from utils.corpus.plans import PlanRecord, deterministic_layers, run_two_phase
+
+PROGRESS_NOTES = os.path.join(os.path.dirname(__file__), '../../../progress_notes')
+
+def read_note(name):
+    with open(os.path.join(PROGRESS_NOTES, name), 'r') as file:
+        return file.read()
+
+def test_deterministic_layers_does_not_call_the_llm():
+    records = deterministic_layers(read_note('pn_1'))
+    assert len(records) == 7
+    assert [record.icd10_code for record in records][:3] == ["K21.9", "E11.65", "J44.9"]
+    assert all(record.needs_llm == record.is_hcc for record in records)
+
+def test_condition_data_is_resolved_lazily_and_once():
+    calls = []
+    def evaluate(plan):
+        calls.append(plan)
+        return '["Continue the antacids"]'
+
+    records = deterministic_layers(read_note('pn_1'), resolver=evaluate)
+    assert calls == []
+    outputs = [record.to_output() for record in records]
+    outputs = [record.to_output() for record in records]
+    assert len(calls) == sum(record.is_hcc for record in records)
+    assert outputs[0] == {"condition_code": "K219", "is_hcc": False}
+
+def test_run_two_phase_only_sends_hcc_plans():
+    sent = []
+    def evaluate_many(plans):
+        sent.append(len(plans))
+        return [f"data {i}" for i in range(len(plans))]
+
+    notes = [read_note('pn_1'), read_note('pn_2'), "no assessment section here"]
+    outputs = run_two_phase(notes, evaluate_many=evaluate_many)
+    assert outputs[2] is None
+    hcc_plans = [plan for output in outputs[:2] for plan in output if plan.get("is_hcc")]
+    assert sent == [len(hcc_plans)]
+    assert [plan["condition_data"] for plan in hcc_plans] == [f"data {i}" for i in range(len(hcc_plans))]
+
+def test_plan_record_pickles_without_resolver():
+    record = PlanRecord("1. COPD\nJ44.9", "J44.9", {"condition_code": "J449", "is_hcc": True}, resolver=len)
+    clone = pickle.loads(pickle.dumps(record))
+    assert clone.resolver is None and clone.needs_llm
@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import threading
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from utils.corpus.stages import StagedPipeline, QUEUE_DEPTH_METRIC
+from utils.metrics.registry import get_registry
+
+def test_outputs_in_order_with_flat_memory():
+    lock = threading.Lock()
+    in_memory = [0, 0]
+
+    def parse(note):
+        with lock:
+            in_memory[0] += 1
+            in_memory[1] = max(in_memory[1], in_memory[0])
+        time.sleep(0.001 * (note % 3))
+        return note * 2
+
+    def resolve(note, records):
+        # The LLM stage is the bottleneck
+        time.sleep(0.005)
+        return records + 1
+
+    staged = StagedPipeline(parse, resolve, parse_workers=2, llm_workers=3, queue_size=2)
+    outputs = []
+    for note, output in staged.run(iter(range(60))):
+        outputs.append((note, output))
+        with lock:
+            in_memory[0] -= 1
+    assert outputs == [(note, note * 2 + 1) for note in range(60)]
+    assert in_memory[1] <= staged.window < 60
+
+    stats = staged.stats()
+    assert stats["stages"]["parse"]["items"] == stats["stages"]["llm"]["items"] == 60
+    assert 0 < stats["stages"]["llm"]["utilization"] <= 1
+    assert stats["stages"]["parse"]["blocked_seconds"] > 0
+    assert all(queue["max_depth"] <= 2 for queue in stats["queues"].values())
+    assert get_registry().histogram(QUEUE_DEPTH_METRIC, queue="llm").count >= 60
+
+def test_error_stops_the_pipeline():
+    resolved = []
+
+    def resolve(note, records):
+        if note == 5:
+            raise RuntimeError("quota")
+        resolved.append(note)
+        return records
+
+    before = threading.active_count()
+    staged = StagedPipeline(lambda note: note, resolve, llm_workers=1, queue_size=1)
+    outputs = []
+    with pytest.raises(RuntimeError, match="quota"):
+        for note, _ in staged.run(range(1000)):
+            outputs.append(note)
+    assert outputs == list(range(5))
+    assert len(resolved) < 1000
+    assert threading.active_count() == before
+
+def test_consumer_leaving_early_releases_the_workers():
+    before = threading.active_count()
+    staged = StagedPipeline(lambda note: note, lambda note, records: records, queue_size=1)
+    outputs = staged.run(range(1000))
+    assert [next(outputs) for _ in range(3)] == [(0, 0), (1, 1), (2, 2)]
+    outputs.close()
+    assert threading.active_count() == before
@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+import threading
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from utils.corpus.workqueue import WorkQueue, run_worker
+from utils.corpus.ingest import NoteRef, note_id
+from utils.llm.adaptive import deferred_condition_data
+
+NOTES = [f"pn_{i}" for i in range(10)]
+HASHES = {note: f"sha-{note}" for note in NOTES}
+
+def test_enqueue_and_disjoint_claims(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"))
+    assert queue.enqueue(NOTES, HASHES) == 10
+    assert queue.enqueue(NOTES[:3], HASHES) == 0
+    claimed = []
+    lock = threading.Lock()
+
+    def worker(name):
+        other = WorkQueue(queue.path)
+        while True:
+            items = other.claim(name, batch_size=2)
+            if not items:
+                return
+            with lock:
+                claimed.extend(item.note for item in items)
+
+    threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(NOTES)
+    assert queue.progress()["leased"] == 10
+
+def test_expired_lease_is_requeued(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"), lease_seconds=0.05)
+    ref = NoteRef("corpus.jsonl:1", "corpus.jsonl", 0, 10, "note")
+    queue.enqueue([ref], {ref: "sha"})
+    [stale] = queue.claim("crashed")
+    assert stale.note == ref
+    time.sleep(0.1)
+    [item] = queue.claim("alive")
+    assert item.attempts == 2
+    # The first worker lost its lease: its late result is ignored
+    assert queue.complete("crashed", [(stale, [])]) == 0
+    assert queue.complete("alive", [(item, [{"condition_code": "I10"}])]) == 1
+    assert list(queue.results()) == [("corpus.jsonl:1", "sha", [{"condition_code": "I10"}])]
+
+def test_release_fails_after_max_attempts(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"), max_attempts=2)
+    queue.enqueue(NOTES[:1], HASHES)
+    assert queue.release("w", queue.claim("w"), RuntimeError("quota")) == 1
+    assert queue.progress()["pending"] == 1
+    queue.release("w", queue.claim("w"), RuntimeError("quota"))
+    progress = queue.progress()
+    assert progress["failed"] == 1 and progress["pending"] == 0
+
+def test_run_worker_drains_the_queue(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"))
+    queue.enqueue(NOTES, HASHES)
+    process = lambda notes: ((note, [{"note": note}]) for note in notes)
+    assert run_worker(queue, process, worker_id="w", batch_size=4) == 10
+    progress = queue.progress()
+    assert progress["done"] == 10 and progress["notes_per_second"] > 0
+    assert [output for _, _, output in queue.results()] == [[{"note": note}] for note in NOTES]
+
+def test_heartbeat_keeps_the_lease_of_a_slow_batch(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"), lease_seconds=0.2)
+    queue.enqueue(NOTES[:2], HASHES)
+    stolen = []
+    def process(notes):
+        # Longer than the lease, without yielding in between
+        time.sleep(0.5)
+        stolen.extend(queue.claim("other"))
+        return [(note, [{"note": note}]) for note in notes]
+    assert run_worker(queue, process, worker_id="w", batch_size=2) == 2
+    assert stolen == [] and queue.progress()["done"] == 2
+
+def test_notes_with_deferred_plans_are_set_aside(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"))
+    queue.enqueue(NOTES[:4], HASHES)
+    marker = deferred_condition_data("circuit open")
+    process = lambda notes: ((note, [{"condition_data": marker if note in NOTES[:2] else "[]"}]) for note in notes)
+    assert run_worker(queue, process, worker_id="w", batch_size=4) == 2
+    progress = queue.progress()
+    assert progress["done"] == 2 and progress["deferred"] == 2 and progress["eta_seconds"] == 0
+    assert [note for note, _, _ in queue.results()] == [note_id(note) for note in NOTES[2:4]]
+
+    # The next enqueue retries them, without using their attempts
+    assert queue.requeue_deferred() == 2
+    assert [item.attempts for item in queue.claim("w")] == [1, 1]
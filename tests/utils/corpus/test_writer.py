@@ -0,0 +1,56 @@
+import os
+import sys
+import json
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from utils.corpus.writer import JSONLResultWriter, load_completed, file_sha256
+
+PLANS = [{"condition_code": "J449", "condition_name": "Chronic obstructive pulmonary disease",
+          "is_hcc": True, "condition_data": "[]"}, {}]
+
+def test_records_are_valid_jsonl(tmp_path):
+    output = str(tmp_path / "result" / "output.jsonl")
+    with JSONLResultWriter(output, fsync_every=1) as writer:
+        writer.write("progress_notes/pn_1", "abc", PLANS)
+        writer.write("progress_notes/pn_2", "def", None)
+    with open(output) as file:
+        records = [json.loads(line) for line in file]
+    assert records[0] == {"note": "progress_notes/pn_1", "sha256": "abc", "plans": PLANS}
+    assert records[1]["plans"] is None
+
+def test_resume_after_a_crash(tmp_path):
+    output = str(tmp_path / "output.jsonl")
+    with JSONLResultWriter(output) as writer:
+        writer.write("pn_0", "hash 0", PLANS)
+    # A crashed run left half a record behind
+    with open(output, 'a') as file:
+        file.write('{"note": "pn_1", "sha')
+    assert load_completed(output) == {"pn_0": "hash 0"}
+
+    with JSONLResultWriter(output, append=True) as writer:
+        writer.write("pn_1", "hash 1", PLANS)
+    assert load_completed(output) == {"pn_0": "hash 0", "pn_1": "hash 1"}
+
+def test_notes_with_deferred_plans_are_not_completed(tmp_path):
+    output = str(tmp_path / "output.jsonl")
+    deferred = [{"is_hcc": True, "condition_data": "Deferred: quota exceeded"}]
+    with JSONLResultWriter(output) as writer:
+        writer.write("pn_0", "hash 0", deferred)
+        writer.write("pn_1", "hash 1", PLANS)
+    assert load_completed(output) == {"pn_1": "hash 1"}
+    with JSONLResultWriter(output, append=True) as writer:
+        writer.write("pn_0", "hash 0", PLANS)
+        writer.write("pn_1", "hash 1", deferred)
+    assert load_completed(output) == {"pn_0": "hash 0"}
+
+def test_truncates_without_append(tmp_path):
+    output = str(tmp_path / "output.jsonl")
+    with JSONLResultWriter(output) as writer:
+        writer.write("pn_0", "hash 0", PLANS)
+    with JSONLResultWriter(output) as writer:
+        pass
+    assert load_completed(output) == {}
+
+def test_file_sha256(tmp_path):
+    note = tmp_path / "pn"
+    note.write_text("Assessment / Plan")
+    assert file_sha256(str(note)) == "87b3f627f0728086c5e25e424f7ba1c693152c814830749cbb4bd624e532113d"
@@ -0,0 +1,38 @@
+import os
+import sys
+import json
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from utils.hcc.code_index import HCCCodeIndex, get_code_index
+
+HCC_JSON = os.path.join(os.path.dirname(__file__), '../../../HCC_relevant_codes.json')
+
+def test_lookup_and_lookup_many():
+    index = HCCCodeIndex(HCC_JSON)
+    assert index.lookup("J449") == "Chronic obstructive pulmonary disease"
+    assert index.lookup("K219") is None
+    expected = {"J449": "Chronic obstructive pulmonary disease", "K219": None}
+    result = index.lookup_many(["J449", "K219"])
+    assert result == expected, f"Expected: {expected}, but got: {result}"
+
+def test_get_code_index_is_shared():
+    assert get_code_index(HCC_JSON) is get_code_index(os.path.abspath(HCC_JSON))
+
+def test_reload_only_when_content_changes(tmp_path):
+    json_file = tmp_path / "codes.json"
+    json_file.write_text(json.dumps({"E1165": "Diabetes"}))
+    index = HCCCodeIndex(str(json_file), check_interval=0)
+    assert index.reload_count == 1
+
+    # Touching the file changes the mtime but not the hash: no re-parse
+    os.utime(json_file, ns=(1, 1))
+    index.refresh()
+    assert index.reload_count == 1
+
+    json_file.write_text(json.dumps({"E1165": "Diabetes", "I5022": "Heart failure"}))
+    assert "I5022" in index
+    assert index.reload_count == 2
+
+def test_missing_file():
+    with pytest.raises(FileNotFoundError):
+        HCCCodeIndex("does_not_exist.json")
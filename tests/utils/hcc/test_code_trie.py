@@ -0,0 +1,49 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from utils.hcc.code_trie import ICD10Trie, get_code_trie, load_hcc_csv
+from utils.regex.regex_utils import match_all_icd10_codes
+from utils.hcc.codeset import compile_codesets
+from utils.hcc.code_index import configure_codeset
+
+HCC_CSV = os.path.join(os.path.dirname(__file__), '../../../HCC_relevant_codes.csv')
+
+def test_load_hcc_csv_skips_header_and_keeps_commas():
+    codes = load_hcc_csv(HCC_CSV)
+    assert "ICD-10-CM Codes" not in codes
+    assert codes["J449"] == "Chronic obstructive pulmonary disease, unspecified"
+
+def test_exact_descendants_and_ancestor():
+    trie = ICD10Trie({"E1165": "Type 2 diabetes mellitus with hyperglycemia", "E11": "Type 2 diabetes",
+                      "I5022": "Chronic systolic (congestive) heart failure"})
+    assert trie.exact("E11.65") == "Type 2 diabetes mellitus with hyperglycemia"
+    assert trie.exact("E11.6") is None
+    assert trie.has_hcc_descendants("E11.6")
+    assert not trie.has_hcc_descendants("E11.65")
+    assert trie.nearest_hcc_ancestor("E11.69") == ("E11", "Type 2 diabetes")
+    assert trie.nearest_hcc_ancestor("E11") is None
+    assert trie.nearest_hcc_ancestor("K21.9") is None
+    assert len(trie) == 3
+
+def test_lookup_spans_of_every_code_in_a_plan():
+    plan = "2. Diabetes -\nE11.6: Type 2 diabetes with complication\nE11.65: with hyperglycemia"
+    trie = get_code_trie(HCC_CSV)
+    results = trie.lookup_spans(match_all_icd10_codes(plan))
+    assert [result["code"] for result in results] == ["E11.6", "E11.65"]
+    assert results[0]["is_hcc"] is False and results[0]["has_hcc_descendants"] is True
+    assert results[1]["is_hcc"] is True
+    start, end = results[1]["span"]
+    assert plan[start:end] == "E11.65"
+
+def test_trie_follows_the_configured_code_set(tmp_path):
+    path = str(tmp_path / "codes.hccidx")
+    compile_codesets({"V24": {"I10": "Essential hypertension", "E1165": "Type 2 diabetes mellitus with hyperglycemia"},
+                      "V28": {"E1165": "Type 2 diabetes mellitus with hyperglycemia"}}, path)
+    try:
+        configure_codeset(path, "V28")
+        assert "I10" not in get_code_trie() and "E11.65" in get_code_trie()
+        assert "I10" in get_code_trie(version="V24")
+        assert get_code_trie() is get_code_trie(version="V28")
+    finally:
+        configure_codeset(None)
+    assert "J44.9" in get_code_trie()
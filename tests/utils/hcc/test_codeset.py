@@ -0,0 +1,74 @@
+import os
+import sys
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from utils.hcc.codeset import compile_codesets, CompiledCodeSet, CodeSetFormatError, is_compiled_codeset
+from utils.hcc.code_index import get_code_index, configure_codeset, CompiledCodeIndex, HCC_JSON_FILE_PATH
+from utils.convertCSVtoDictionary import convert_txt_to_json, compile_csv_versions
+from utils.regex.regex_utils import is_icd10_an_hcc
+
+HCC_CSV = os.path.join(os.path.dirname(__file__), '../../../HCC_relevant_codes.csv')
+V24 = {"E1165": "Type 2 diabetes mellitus with hyperglycemia", "I10": "Essential hypertension"}
+V28 = {"E1165": "Type 2 diabetes mellitus with hyperglycemia", "I5022": "Chronic systolic heart failure"}
+
+def test_compiled_versions(tmp_path):
+    path = str(tmp_path / "codes.hccidx")
+    checksums = compile_codesets({"V24": V24, "V28": V28}, path)
+    assert is_compiled_codeset(path) and not is_compiled_codeset(HCC_CSV)
+    codeset = CompiledCodeSet(path)
+    assert codeset.versions == ["V24", "V28"]
+    v28 = codeset.version("V28", verify=True)
+    assert dict(v28) == V28 and v28.sha256 == checksums["V28"]
+    assert v28.get("I10") is None and "I5022" in v28
+    assert codeset.version()["I10"] == "Essential hypertension"
+    with pytest.raises(KeyError):
+        codeset.version("V99")
+
+def test_corrupted_file(tmp_path):
+    path = tmp_path / "codes.hccidx"
+    compile_codesets({"V24": V24}, str(path))
+    data = bytearray(path.read_bytes())
+    data[-3] ^= 0xFF
+    path.write_bytes(bytes(data))
+    with pytest.raises(CodeSetFormatError):
+        CompiledCodeSet(str(path)).verify()
+    path.write_bytes(b"HCCIDX\x00\x00" + bytes(data[8:40]))
+    with pytest.raises(CodeSetFormatError):
+        CompiledCodeSet(str(path))
+
+def test_code_index_rejects_a_corrupted_block(tmp_path):
+    path = tmp_path / "codes.hccidx"
+    compile_codesets({"V24": V24, "V28": V28}, str(path))
+    data = bytearray(path.read_bytes())
+    # The last block is V28; the directory stays valid
+    data[-3] ^= 0xFF
+    path.write_bytes(bytes(data))
+    assert CompiledCodeSet(str(path)).versions == ["V24", "V28"]
+    with pytest.raises(CodeSetFormatError):
+        get_code_index(str(path), version="V28")
+    assert get_code_index(str(path), version="V24").lookup("I10") == "Essential hypertension"
+
+def test_code_index_per_version(tmp_path):
+    path = str(tmp_path / "codes.hccidx")
+    compile_codesets({"V24": V24, "V28": V28}, path)
+    assert isinstance(get_code_index(path), CompiledCodeIndex)
+    assert is_icd10_an_hcc("I10", "", path, version="V24")["is_hcc"]
+    assert not is_icd10_an_hcc("I10", "", path, version="V28")["is_hcc"]
+    try:
+        configure_codeset(path, "V28")
+        assert is_icd10_an_hcc("I50.22", "")["condition_name"] == "Chronic systolic heart failure"
+        assert is_icd10_an_hcc("I10", "", version="V24")["is_hcc"]
+    finally:
+        configure_codeset(None)
+    assert get_code_index().json_file_path == HCC_JSON_FILE_PATH
+    with pytest.raises(ValueError):
+        get_code_index(HCC_JSON_FILE_PATH, version="V24")
+
+def test_converter_skips_header_and_keeps_commas(tmp_path):
+    json_path = tmp_path / "codes.json"
+    convert_txt_to_json(HCC_CSV, str(json_path))
+    text = json_path.read_text()
+    assert "ICD-10-CM Codes" not in text
+    assert '"J449": "Chronic obstructive pulmonary disease, unspecified"' in text
+    compile_csv_versions({"V24": HCC_CSV}, str(tmp_path / "codes.hccidx"))
+    assert CompiledCodeSet(str(tmp_path / "codes.hccidx")).version()["A394"] == "Meningococcemia, unspecified"
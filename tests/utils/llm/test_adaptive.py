@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+import asyncio
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from utils.llm.adaptive import (AdaptiveConcurrency, CircuitBreaker, CallController, CircuitOpenError,
+                                CLOSED, OPEN, HALF_OPEN, is_deferred, deferred_condition_data, has_deferred_plans)
+
+class QuotaError(Exception):
+    status_code = 429
+
+def test_limit_grows_while_healthy_and_halves_once_per_burst():
+    concurrency = AdaptiveConcurrency(initial=1, max_limit=8)
+    for _ in range(60):
+        concurrency.acquire()
+        concurrency.release(time.monotonic() - 0.01)
+    assert concurrency.limit == 8
+
+    # Eight calls in flight hit the quota together: one decrease, not eight
+    started = time.monotonic()
+    for _ in range(8):
+        assert concurrency.try_acquire()
+    assert not concurrency.try_acquire()
+    for _ in range(8):
+        concurrency.release(started, QuotaError())
+    assert concurrency.limit == 4
+    assert concurrency.in_flight == 0
+
+    # A later 429 decreases it again; errors that are not overload signals do not
+    concurrency.acquire()
+    concurrency.release(time.monotonic(), QuotaError())
+    concurrency.acquire()
+    concurrency.release(time.monotonic(), ValueError("bad request"))
+    assert concurrency.limit == 2
+
+def test_slow_calls_do_not_grow_the_limit():
+    concurrency = AdaptiveConcurrency(initial=2, max_limit=8, latency_tolerance=2.0)
+    concurrency.acquire()
+    concurrency.release(time.monotonic() - 0.01)
+    limit = concurrency.limit
+    for _ in range(10):
+        concurrency.acquire()
+        concurrency.release(time.monotonic() - 1.0)
+    assert concurrency.limit == limit
+
+def test_a_fast_early_call_does_not_pin_the_limit():
+    concurrency = AdaptiveConcurrency(initial=2, max_limit=8, latency_window=5)
+    concurrency.acquire()
+    concurrency.release(time.monotonic() - 0.001)
+    # The model settles at a slower latency: healthy again once the fast call left the window
+    for _ in range(30):
+        concurrency.acquire()
+        concurrency.release(time.monotonic() - 0.5)
+    assert concurrency.min_latency >= 0.5
+    assert concurrency.limit > 2
+
+def test_errors_that_are_not_overload_pass_through():
+    breaker = CircuitBreaker(failure_threshold=2)
+    controller = CallController(AdaptiveConcurrency(initial=4, max_limit=4), breaker)
+    for _ in range(5):
+        with pytest.raises(ValueError):
+            with controller.slot():
+                raise ValueError("400 bad request")
+    assert breaker.state == CLOSED and breaker.failures == 0
+    assert controller.concurrency.limit == 4 and controller.stats()["in_flight"] == 0
+
+def test_circuit_opens_then_probes():
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=0.05)
+    controller = CallController(AdaptiveConcurrency(max_limit=4), breaker)
+    for _ in range(3):
+        with pytest.raises(QuotaError):
+            with controller.slot():
+                raise QuotaError()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        with controller.slot():
+            pass
+
+    time.sleep(0.06)
+    # One probe at a time while half-open; its success closes the circuit
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+    async def call():
+        async with controller.aslot():
+            return "ok"
+    assert asyncio.run(call()) == "ok"
+    assert controller.stats()["in_flight"] == 0
+
+def test_deferred_marker():
+    marker = deferred_condition_data(QuotaError("quota exceeded"))
+    assert is_deferred(marker) and not is_deferred("[]") and not is_deferred(None)
+    assert has_deferred_plans([{"is_hcc": False}, {"condition_data": marker}])
+    assert not has_deferred_plans(None)
@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+import asyncio
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+pytest.importorskip("langchain_core")
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.language_models.fake import FakeListLLM
+from utils.llm.backends import SimulatedLLM, SimulatedLLMError, Cassette, CassetteMissError
+from utils.llm.batching import render_batch, parse_batch_response
+from utils.llm.engine import is_retryable
+
+PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "Extract the management lines.\n\nOne per line."),
+    ("human", "Here is the assessment plan text:\n\n{assessment_plan}"),
+])
+PLAN = "2. Hyperglycemia due to type 2 diabetes mellitus -\nWorsening\nContinue Metformin1000 mg BID\nE11.65: Type 2 diabetes mellitus with hyperglycemia"
+
+def test_simulated_extraction_through_a_chain():
+    chain = PROMPT | SimulatedLLM(latency=0).as_runnable() | StrOutputParser()
+    assert chain.invoke({"assessment_plan": PLAN}) == "Continue Metformin1000 mg BID"
+    assert asyncio.run(chain.ainvoke({"assessment_plan": PLAN})) == "Continue Metformin1000 mg BID"
+
+def test_simulated_batch_response_is_parseable():
+    llm = SimulatedLLM(latency=0)
+    response = llm.invoke("Here are the assessment plans:\n\n" + render_batch([PLAN, "1. GERD -\nStable\nContinue the antacids"]))
+    assert parse_batch_response(response, 2) == {0: "Continue Metformin1000 mg BID", 1: "Continue the antacids"}
+
+def test_simulated_errors_are_retryable():
+    with pytest.raises(SimulatedLLMError) as error:
+        SimulatedLLM(latency=0, rate_limit_rate=1.0).invoke(PLAN)
+    assert error.value.status_code == 429 and is_retryable(error.value)
+    with pytest.raises(SimulatedLLMError) as error:
+        SimulatedLLM(latency=0, error_rate=1.0).invoke(PLAN)
+    assert error.value.status_code == 500 and is_retryable(error.value)
+
+def test_simulated_latency_and_throttling():
+    start = time.perf_counter()
+    SimulatedLLM(latency=0.05, latency_sigma=0).invoke(PLAN)
+    assert time.perf_counter() - start >= 0.05
+    start = time.perf_counter()
+    # "Continue Metformin1000 mg BID" is 7 tokens
+    SimulatedLLM(latency=0, tokens_per_second=100).invoke(PLAN)
+    assert time.perf_counter() - start >= 0.06
+
+def test_cassette_records_then_replays(tmp_path):
+    path = str(tmp_path / "cassette.jsonl")
+    recorder = Cassette(path, mode="record").wrap(FakeListLLM(responses=["Continue the antacids"]))
+    assert (PROMPT | recorder).invoke({"assessment_plan": PLAN}) == "Continue the antacids"
+
+    cassette = Cassette(path)
+    player = PROMPT | cassette.wrap()
+    assert player.invoke({"assessment_plan": PLAN}) == "Continue the antacids"
+    assert cassette.hits == 1
+    with pytest.raises(CassetteMissError):
+        player.invoke({"assessment_plan": "1. GERD -\nContinue the antacids"})
@@ -0,0 +1,24 @@
+import os
+import sys
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from utils.llm.batching import pack_plans, render_batch, parse_batch_response, BatchParseError
+
+def test_pack_plans_respects_budget():
+    plans = ["a" * 400, "b" * 400, "c" * 400, "d" * 4000]
+    # 100 + 12 tokens per small plan, the large one is alone
+    assert pack_plans(plans, token_budget=250) == [[0, 1], [2], [3]]
+    assert pack_plans(plans, token_budget=10000, max_batch_size=3) == [[0, 1, 2], [3]]
+
+def test_render_and_parse_round_trip():
+    plans = ["1. GERD -\nContinue the antacids", "2. COPD -\nCounseled for smoking cessation today"]
+    text = render_batch(plans)
+    assert text.startswith("<<<PLAN 0>>>\n1. GERD")
+    response = "<<<PLAN 0>>>\nContinue the antacids\n<<<END PLAN 0>>>\n<<<PLAN 1>>>\n<<<END PLAN 1>>>"
+    assert parse_batch_response(response, 2) == {0: "Continue the antacids", 1: ""}
+
+def test_parse_reports_missing_and_malformed_plans():
+    response = "<<<PLAN 1>>>\nCounseled for smoking cessation today\n<<<END PLAN 1>>>\n<<<PLAN 7>>>\nx\n<<<END PLAN 7>>>"
+    assert parse_batch_response(response, 2) == {1: "Counseled for smoking cessation today"}
+    with pytest.raises(BatchParseError):
+        parse_batch_response("Continue the antacids", 2)
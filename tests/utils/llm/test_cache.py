@@ -0,0 +1,42 @@
+import os
+import sys
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from utils.llm.cache import ConditionDataCache, cache_key, normalize_plan
+
+def test_key_ignores_whitespace_but_not_prompt_or_model():
+    plan = "3. COPD -\n   Unchanged\n   Counseled for smoking cessation today"
+    same_plan = "3. COPD -\nUnchanged\n\n  Counseled for  smoking cessation today  "
+    assert normalize_plan(same_plan) == normalize_plan(plan)
+    key = cache_key(plan, "prompt-v1", "gemini-pro:temperature=0")
+    assert cache_key(same_plan, "prompt-v1", "gemini-pro:temperature=0") == key
+    assert cache_key(plan, "prompt-v2", "gemini-pro:temperature=0") != key
+    assert cache_key(plan, "prompt-v1", "gemini-pro:temperature=1") != key
+
+def test_get_set_and_counters(tmp_path):
+    cache = ConditionDataCache(str(tmp_path / "cache.sqlite"))
+    assert cache.get("key") is None
+    cache.set("key", "Continue the antacids")
+    assert cache.get("key") == "Continue the antacids"
+    stats = cache.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 1, 0.5)
+
+def test_entries_are_shared_between_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    ConditionDataCache(path).set("key", "value")
+    assert ConditionDataCache(path).get("key") == "value"
+
+def test_size_and_age_eviction(tmp_path):
+    cache = ConditionDataCache(str(tmp_path / "cache.sqlite"), max_entries=3, evict_every=1000)
+    for i in range(5):
+        cache.set(f"key {i}", "value")
+        time.sleep(0.001)
+    cache.get("key 0")
+    assert cache.evict() == 2
+    assert cache.get("key 0") == "value"
+    assert cache.get("key 1") is None
+
+    cache.max_age = 0
+    time.sleep(0.001)
+    cache.evict()
+    assert len(cache) == 0
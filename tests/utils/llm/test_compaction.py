@@ -0,0 +1,47 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from utils.llm.compaction import compact_plan, record_savings, token_savings, source_lines
+from utils.metrics.registry import MetricsRegistry
+
+PLAN = """2. Hyperglycemia due to type 2 diabetes mellitus -
+   Worsening
+   Continue Metformin1000 mg BID and Glimepiride 8 mg
+
+   SPO2-98% today
+   Weight today was 259 lbs; Monitor weight daily
+   E11.65: Type 2 diabetes mellitus with hyperglycemia"""
+
+def test_compact_plan_keeps_heading_and_ambiguous_lines():
+    compacted = compact_plan(PLAN)
+    assert compacted.text.splitlines() == ["2. Hyperglycemia due to type 2 diabetes mellitus -",
+                                           "   Continue Metformin1000 mg BID and Glimepiride 8 mg",
+                                           "   Weight today was 259 lbs; Monitor weight daily"]
+    assert compacted.line_map == (0, 2, 5)
+    assert compacted.compacted_tokens < compacted.original_tokens
+
+def test_source_lines_trace_back_to_the_original_plan():
+    compacted = compact_plan(PLAN)
+    extracted = ["Continue Metformin 1000 mg BID and Glimepiride 8 mg", "Monitor weight daily", "Unknown line"]
+    assert source_lines(extracted, PLAN, compacted.line_map) == [2, 5, None]
+    assert source_lines(["E11.65: Type 2 diabetes mellitus with hyperglycemia"], PLAN) == [6]
+
+def test_token_savings(monkeypatch):
+    from utils.llm import compaction
+    registry = MetricsRegistry()
+    monkeypatch.setattr(compaction, "get_registry", lambda: registry)
+    assert token_savings(registry)["saved_fraction"] is None
+    record_savings(compact_plan(PLAN))
+    savings = token_savings(registry)
+    assert 0 < savings["saved_fraction"] < 1
+    assert registry.summary()["llm_plan_token_savings"] == savings["saved_fraction"]
+
+def test_compact_plan_keeps_ratio_dosed_medications():
+    plan = """Essential hypertension
+   Losartan-HCTZ 100/25
+   Advair 250/50
+   BP today 142/88
+   I10: Essential (primary) hypertension"""
+    assert compact_plan(plan).text.splitlines() == ["Essential hypertension",
+                                                    "   Losartan-HCTZ 100/25",
+                                                    "   Advair 250/50"]
@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import asyncio
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from utils.llm.engine import AsyncExtractionEngine, is_retryable, backoff_delay
+from utils.llm.ratelimit import TokenBucket
+
+class QuotaError(Exception):
+    status_code = 429
+
+class BadRequestError(Exception):
+    status_code = 400
+
+def test_is_retryable():
+    assert is_retryable(QuotaError())
+    assert is_retryable(asyncio.TimeoutError())
+    assert not is_retryable(BadRequestError())
+    assert not is_retryable(ValueError("bad input"))
+
+def test_backoff_delay_is_bounded():
+    for attempt in range(10):
+        assert 0 <= backoff_delay(attempt, base_delay=0.5, max_delay=4) <= 4
+
+def test_token_bucket_throttles():
+    async def run():
+        bucket = TokenBucket(capacity=5, rate=50)
+        start = time.monotonic()
+        for _ in range(10):
+            await bucket.acquire(1)
+        return time.monotonic() - start
+    # 5 tokens of burst, then 5 more at 50 tokens/s
+    assert asyncio.run(run()) >= 0.09
+
+def test_engine_bounds_concurrency():
+    in_flight = []
+    peak = []
+    async def evaluate(plan):
+        in_flight.append(plan)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.remove(plan)
+        return plan.upper()
+
+    engine = AsyncExtractionEngine(evaluate, concurrency=3)
+    results = asyncio.run(engine.extract_many([f"plan {i}" for i in range(12)]))
+    assert results == [f"PLAN {i}" for i in range(12)]
+    assert max(peak) == 3
+
+def test_engine_retries_transient_errors():
+    attempts = []
+    async def evaluate(plan):
+        attempts.append(plan)
+        if len(attempts) < 3:
+            raise QuotaError("quota exceeded")
+        return "ok"
+
+    engine = AsyncExtractionEngine(evaluate, base_delay=0.001)
+    assert asyncio.run(engine.extract("plan")) == "ok"
+    assert engine.retries == 2
+
+def test_engine_does_not_retry_client_errors():
+    async def evaluate(plan):
+        raise BadRequestError("bad request")
+
+    engine = AsyncExtractionEngine(evaluate, base_delay=0.001)
+    with pytest.raises(BadRequestError):
+        asyncio.run(engine.extract("plan"))
+    assert engine.retries == 0
+
+def test_engine_times_out_each_attempt():
+    async def evaluate(plan):
+        await asyncio.sleep(1)
+
+    engine = AsyncExtractionEngine(evaluate, timeout=0.01, max_retries=1, base_delay=0.001)
+    results = asyncio.run(engine.extract_many(["plan"]))
+    assert isinstance(results[0], asyncio.TimeoutError)
+    assert engine.retries == 1
+
+def test_engine_charges_the_prompt_and_the_completion():
+    async def evaluate(plan):
+        return "x" * 40
+
+    async def run():
+        engine = AsyncExtractionEngine(evaluate, tpm=6000, prompt_tokens=100)
+        bucket = engine.limiter.tokens
+        before = bucket._tokens
+        await engine.extract("p" * 200)
+        # 100 prompt + 50 plan tokens, then 10 completion tokens once reconciled
+        return before - bucket._tokens
+    assert 150 <= asyncio.run(run()) <= 160
+
+def test_token_bucket_adjust():
+    async def run():
+        bucket = TokenBucket(capacity=10, rate=100)
+        await bucket.acquire(10)
+        # The request used 5 more tokens than charged: the next one waits for them too
+        bucket.adjust(5)
+        start = time.monotonic()
+        await bucket.acquire(5)
+        return time.monotonic() - start
+    assert asyncio.run(run()) >= 0.09
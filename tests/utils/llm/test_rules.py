@@ -0,0 +1,63 @@
+import os
+import sys
+import json
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from utils.llm.rules import RuleExtractor, apply_rules, agreement_report, CONFIDENCE
+from utils.corpus.plans import deterministic_layers, records_output
+
+PLAN = """2. Hyperglycemia due to type 2 diabetes mellitus -
+   Worsening
+   Continue Metformin1000 mg BID and Glimepiride 8 mg
+   Recommend a low sugar and low carbohydrate diet.
+   SPO2-98% today
+   Include healthy fats in your meal like: Olive oil
+   E11.65: Type 2 diabetes mellitus with hyperglycemia"""
+
+NOTE = """Assessment / Plan
+1. Hyperglycemia due to type 2 diabetes mellitus -
+   Stable
+   Continue Metformin 1000 mg BID
+   E11.65: Type 2 diabetes mellitus with hyperglycemia
+2. Heart failure -
+   on Metoprolol and Losartan-HCTZ
+   I50.22: Chronic systolic (congestive) heart failure
+"""
+
+def test_extract_keeps_management_lines():
+    result = RuleExtractor().extract(PLAN)
+    assert result.lines == ["Continue Metformin1000 mg BID and Glimepiride 8 mg",
+                            "Recommend a low sugar and low carbohydrate diet.",
+                            "Include healthy fats in your meal like: Olive oil"]
+    assert json.loads(result.condition_data) == result.lines
+    assert result.confidence == CONFIDENCE["vitals"]
+    assert [decision.rule for decision in result.decisions] == ["heading", "status", "keep", "keep", "vitals",
+                                                                "keep", "icd10"]
+
+def test_unknown_and_mixed_lines_lower_the_confidence():
+    extractor = RuleExtractor()
+    assert extractor.extract("1. CHF -\n   on Metoprolol and Losartan-HCTZ").confidence == CONFIDENCE["unknown"]
+    mixed = extractor.extract("1. CHF -\n   - stable, follow up with cardiology")
+    assert mixed.lines == ["stable, follow up with cardiology"]
+    assert mixed.confidence == CONFIDENCE["mixed"]
+
+def test_apply_rules_leaves_low_confidence_plans_to_the_llm():
+    records = apply_rules(deterministic_layers(NOTE), RuleExtractor(), 0.8)
+    assert [record.needs_llm for record in records] == [False, True]
+    calls = []
+    output = records_output(records, resolver=lambda plan: calls.append(plan) or "[]")
+    assert json.loads(output[0]["condition_data"]) == ["Continue Metformin 1000 mg BID"]
+    assert len(calls) == 1 and "Heart failure" in calls[0]
+    # Without the LLM only the plans resolved by the rules have condition_data
+    records = apply_rules(deterministic_layers(NOTE), RuleExtractor(), 0.8)
+    output = records_output(records, with_condition_data=False)
+    assert "condition_data" in output[0] and "condition_data" not in output[1]
+
+def test_agreement_report():
+    plans = [PLAN, "1. CHF -\n   on Metoprolol"]
+    llm_outputs = [json.dumps(["Continue Metformin 1000 mg BID and Glimepiride 8 mg",
+                               "Recommend a low sugar and low carbohydrate diet",
+                               "Include healthy fats in your meal like: Olive oil"]),
+                   json.dumps(["on Metoprolol"])]
+    report = agreement_report(plans, llm_outputs, thresholds=(0.8,))
+    assert report["plans"] == 2 and report["exact_agreement"] == 0.5
+    assert report["thresholds"]["0.8"] == {"plans": 1, "exact_agreement": 1.0, "mean_jaccard": 1.0, "share": 0.5}
@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from utils.llm.singleflight import SingleFlight, AsyncSingleFlight
+
+def test_threads_share_one_call():
+    flights = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def slow(plan):
+        calls.append(plan)
+        release.wait(5)
+        return plan.upper()
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.do("key", slow, "plan"))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while not calls:
+        time.sleep(0.001)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == ["plan"] and results == ["PLAN"] * 5
+    assert flights.in_flight() == 0
+
+def test_errors_reach_every_caller_and_are_not_remembered():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("quota")
+
+    errors = []
+    def call():
+        try:
+            flights.do("key", failing)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    leader.join()
+    follower.join()
+    assert errors == ["quota", "quota"]
+    assert flights.do("key", lambda: "retried") == "retried"
+
+def test_async_callers_share_one_call():
+    flights = AsyncSingleFlight()
+    calls = []
+
+    async def extract(plan):
+        calls.append(plan)
+        await asyncio.sleep(0.01)
+        return plan.upper()
+
+    async def run():
+        same = await asyncio.gather(*(flights.do("a", extract, "a") for _ in range(4)))
+        return same, await flights.do("b", extract, "b")
+
+    same, other = asyncio.run(run())
+    assert same == ["A"] * 4 and other == "B"
+    assert calls == ["a", "b"]
+
+def test_async_cancellation():
+    flights = AsyncSingleFlight()
+    finished = []
+
+    async def extract():
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            finished.append("cancelled")
+            raise
+        finished.append("done")
+        return "result"
+
+    async def run():
+        # Cancelling one caller leaves the call running for the other
+        first = asyncio.ensure_future(flights.do("key", extract))
+        second = asyncio.ensure_future(flights.do("key", extract))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == "result"
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        # Cancelling every caller cancels the call
+        only = asyncio.ensure_future(flights.do("key", extract))
+        await asyncio.sleep(0)
+        only.cancel()
+        await asyncio.sleep(0.01)
+        assert flights.in_flight() == 0
+
+    asyncio.run(run())
+    assert finished == ["done", "cancelled"]
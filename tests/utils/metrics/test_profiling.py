@@ -0,0 +1,84 @@
+import os
+import sys
+import json
+import time
+import threading
+import tracemalloc
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from utils.metrics.registry import get_registry
+from utils.metrics.tracing import trace, span, configure_tracing, configure_memory_tracking
+from utils.metrics.profiling import SamplingProfiler, note_report, top_functions
+
+def busy_parsing(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+def test_sampling_profiler_folds_the_stacks_of_every_thread():
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_parsing, args=(stop,), name="Thread-7 (parse)")
+    profiler = SamplingProfiler(interval=0.001, role="worker").start()
+    worker.start()
+    time.sleep(0.1)
+    stop.set()
+    worker.join()
+    profiler.stop()
+
+    samples = profiler.drain()
+    assert not profiler.drain()
+    stacks = [stack for stack in samples if "busy_parsing" in stack]
+    assert stacks and all(stack.startswith("worker;Thread (parse);") for stack in stacks)
+    assert stacks[0].split(";")[-1].startswith(("busy_parsing (", "<genexpr>"))
+
+    parent = SamplingProfiler()
+    parent.merge(samples)
+    parent.merge(samples)
+    assert parent.drain() == {stack: 2 * count for stack, count in samples.items()}
+    frames = [frame for frame, _, _ in top_functions(samples)]
+    assert any(frame.startswith("busy_parsing (tests/utils/metrics/test_profiling.py:") for frame in frames)
+
+def test_span_memory_peaks(tmp_path):
+    path = str(tmp_path / "trace.jsonl")
+    tracing = tracemalloc.is_tracing()
+    configure_tracing(path)
+    configure_memory_tracking(True)
+    try:
+        with trace("pn_0"), span("deterministic_layers"):
+            with span("scan_note"):
+                block = bytearray(2 << 20)
+                del block
+    finally:
+        configure_memory_tracking(False)
+        configure_tracing(None)
+        if not tracing:
+            tracemalloc.stop()
+    with open(path) as file:
+        records = {record["name"]: record for record in map(json.loads, file)}
+    assert records["scan_note"]["memory_peak_kb"] >= 2048
+    # The enclosing span keeps the peak of the spans inside it
+    assert records["deterministic_layers"]["memory_peak_kb"] >= records["scan_note"]["memory_peak_kb"]
+    assert get_registry().histogram("hcc_stage_memory_peak_bytes", stage="scan_note").count >= 1
+
+def test_note_report_ranks_the_notes(tmp_path):
+    path = str(tmp_path / "trace.jsonl")
+    spans = [
+        ("pn_0", "deterministic_layers", 2.0, {"chars": 100, "memory_peak_kb": 50.0}),
+        ("pn_0", "scan_note", 1.5, {}),
+        ("pn_0", "llm_stage", 900.0, {"memory_peak_kb": 10.0}),
+        ("pn_0", "extract_condition_data", 880.0, {}),
+        ("pn_1", "deterministic_layers", 30.0, {"chars": 9000, "memory_peak_kb": 400.0}),
+        ("pn_1", "scan_note", 25.0, {}),
+        (None, "extract_condition_data_batch", 5.0, {}),
+    ]
+    with open(path, "w") as file:
+        file.write(json.dumps({"trace_id": "old", "name": "llm_stage", "start": 1.0, "duration_ms": 1e6}) + "\n")
+        for trace_id, name, duration, attributes in spans:
+            file.write(json.dumps({"trace_id": trace_id, "name": name, "start": 100.0,
+                                   "duration_ms": duration, **attributes}) + "\n")
+    report = note_report(path, since=50.0, top=1)
+    assert report["notes"] == 2
+    [slowest] = report["slowest"]
+    assert slowest["note"] == "pn_0" and slowest["total_ms"] == 902.0
+    assert list(slowest["layers"])[:2] == ["llm_stage", "extract_condition_data"]
+    [largest] = report["largest"]
+    assert largest["note"] == "pn_1" and largest["chars"] == 9000 and largest["memory_peak_kb"] == 400.0
+    assert report["layers"]["extract_condition_data_batch"] == 5.0
@@ -0,0 +1,37 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from utils.metrics.registry import MetricsRegistry, Histogram
+
+def test_histogram_quantiles():
+    histogram = Histogram(buckets=(1, 2, 4, 8))
+    for value in [0.5] * 50 + [3] * 49 + [100]:
+        histogram.observe(value)
+    assert histogram.count == 100
+    assert 0 < histogram.quantile(0.5) <= 1
+    assert 2 < histogram.quantile(0.99) <= 4
+    assert histogram.quantile(1.0) == 8
+
+def test_snapshots_merge_across_registries():
+    worker = MetricsRegistry()
+    worker.increment("hcc_notes_total")
+    worker.observe("hcc_stage_seconds", 0.001, stage="scan_note")
+    parent = MetricsRegistry()
+    parent.observe("hcc_stage_seconds", 0.002, stage="scan_note")
+    parent.merge(worker.drain())
+    assert worker.counter("hcc_notes_total") == 0 and worker.histogram("hcc_stage_seconds", stage="scan_note") is None
+    assert parent.counter("hcc_notes_total") == 1
+    assert parent.histogram("hcc_stage_seconds", stage="scan_note").count == 2
+
+def test_summary_and_prometheus_text():
+    registry = MetricsRegistry()
+    registry.increment("hcc_llm_cache_lookups_total", result="hit")
+    registry.increment("hcc_llm_cache_lookups_total", 3, result="miss")
+    registry.observe("hcc_stage_seconds", 0.5, stage="extract_condition_data")
+    summary = registry.summary()
+    assert summary["llm_cache_hit_rate"] == 0.25
+    assert summary["histograms"]['hcc_stage_seconds{stage="extract_condition_data"}']["count"] == 1
+    text = registry.prometheus()
+    assert 'hcc_llm_cache_lookups_total{result="miss"} 3' in text
+    assert 'hcc_stage_seconds_bucket{stage="extract_condition_data",le="+Inf"} 1' in text
+    assert "# TYPE hcc_stage_seconds histogram" in text
@@ -0,0 +1,41 @@
+import os
+import sys
+import json
+import asyncio
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from utils.metrics.registry import get_registry
+from utils.metrics.tracing import trace, span, configure_tracing, instrumented
+from utils.regex.scanner import scan_note
+
+def test_stage_latencies_are_recorded():
+    get_registry().reset()
+    scan_note("Assessment / Plan\n\n1. GERD -\nK21.9: GERD")
+    for stage in ("scan_note", "find_assessment_plan", "scan_plans"):
+        assert get_registry().histogram("hcc_stage_seconds", stage=stage).count == 1
+
+def test_spans_are_written_per_note(tmp_path):
+    path = str(tmp_path / "trace.jsonl")
+    configure_tracing(path)
+    try:
+        @instrumented("inner")
+        def inner():
+            return 1
+
+        async def note(trace_id):
+            with trace(trace_id), span("note", plans=1):
+                await asyncio.sleep(0)
+                inner()
+
+        async def run():
+            await asyncio.gather(note("pn_0"), note("pn_1"))
+        asyncio.run(run())
+    finally:
+        configure_tracing(None)
+
+    with open(path) as file:
+        records = [json.loads(line) for line in file]
+    assert len(records) == 4
+    for trace_id in ("pn_0", "pn_1"):
+        spans = {record["name"]: record for record in records if record["trace_id"] == trace_id}
+        assert spans["inner"]["parent_id"] == spans["note"]["span_id"]
+        assert spans["note"]["plans"] == 1 and spans["note"]["parent_id"] is None
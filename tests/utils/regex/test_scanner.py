@@ -0,0 +1,40 @@
+import os
+import sys
+import pytest
+import constants
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from utils.regex.scanner import scan_note, scan_plans
+from utils.regex.regex_utils import extract_each_plan
+
+def read_note(name):
+    pn_to_analyze = os.path.join(os.path.dirname(__file__), '../../../progress_notes', name)
+    with open(pn_to_analyze, 'r') as file:
+        return file.read()
+
+def test_scan_note_matches_the_layers():
+    text = read_note('pn_1')
+    plans = scan_note(text)
+    assert [plan.text for plan in plans] == constants.list_of_sections
+    assert plans[2].codes[0].code == "J44.9"
+
+def test_offsets_point_into_the_note():
+    text = read_note('pn_1')
+    for plan in scan_note(text):
+        first_line = plan.text.split('\n')[0]
+        assert text[plan.start:plan.start + len(first_line)] == first_line
+        assert text[plan.end - 1] == plan.text[-1]
+        for code in plan.codes:
+            assert text[code.start:code.end] == code.code
+
+def test_other_line_breaks_split_like_splitlines():
+    section = constants.plan_section.replace('\n', '\r\n')
+    plans, has_content = scan_plans(section)
+    assert has_content
+    assert [plan.text for plan in plans] == constants.list_of_sections
+    assert [plan.text for plan in plans] == extract_each_plan(section)
+
+def test_errors():
+    with pytest.raises(ValueError, match="No sections found"):
+        scan_note("Chief Complaint\nFollowup")
+    with pytest.raises(ValueError, match="empty after trimming"):
+        scan_note("Assessment / Plan\n\n   \n")
@@ -1,26 +1,13 @@
 import json
+import argparse
+from utils.hcc.code_trie import load_hcc_csv
+from utils.hcc.codeset import compile_codesets
 
-# Function to read the text file and convert it to a dictionary
+# Function to read the CSV file and convert it to a dictionary
 def convert_txt_to_json(txt_file_path, json_file_path):
     try:
-        # Initialize an empty dictionary to store the data
-        data = {}
-
-        # Open the text file for reading
-        with open(txt_file_path, 'r') as file:
-            # Read the file line by line
-            for line in file:
-                # Strip any extra whitespace and newline characters
-                line = line.strip()
-
-                # Split the line by commas
-                parts = line.split(',')
-
-                # Only process lines that have at least two columns
-                if len(parts) >= 2:
-                    code = parts[0].strip()  # First column (code)
-                    description = parts[1].strip()  # Second column (description)
-                    data[code] = description.replace('\"','')
+        # A real CSV parser: descriptions may hold quoted commas, and the header row is skipped
+        data = load_hcc_csv(txt_file_path)
 
         # Write the dictionary to a JSON file
         with open(json_file_path, 'w') as json_file:
@@ -31,9 +18,46 @@ def convert_txt_to_json(txt_file_path, json_file_path):
     except Exception as e:
         print(f"An error occurred: {e}")
 
-# File paths
-txt_file_path = 'HCC_relevant_codes.csv'  # Replace with your actual txt file path
-json_file_path = 'HCC_relevant_codes.json'     # This is where the json will be saved
-
-# Call the function to convert txt to json
-convert_txt_to_json(txt_file_path, json_file_path)
\ No newline at end of file
+# Function to compile one or more CSV files into a binary code set file
+def compile_csv_versions(versions, output_path):
+    """
+    Build the compiled code set file loaded by the runtime instead of the JSON file.
+
+    Args:
+        versions (dict): version name (i.e. V24, V28 or a payment year) -> CSV file path,
+            the first one being the default version
+        output_path (str): The compiled file, i.e. HCC_relevant_codes.hccidx
+
+    Returns:
+        checksums (dict): version name -> sha256 of its code set
+    """
+    checksums = compile_codesets({name: load_hcc_csv(path) for name, path in versions.items()}, output_path)
+    for name, checksum in checksums.items():
+        print(f"{name}: {versions[name]} -> {output_path} (sha256 {checksum[:12]})")
+    return checksums
+
+def parse_version(value):
+    """'V28=codes_v28.csv' -> ('V28', 'codes_v28.csv')"""
+    name, separator, path = value.partition('=')
+    if not separator or not name or not path:
+        raise argparse.ArgumentTypeError(f"Expected NAME=CSV_PATH, got {value!r}")
+    return name, path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert HCC_relevant_codes.csv for the runtime")
+    parser.add_argument("--csv", default='HCC_relevant_codes.csv', help="CSV file of the JSON output")
+    parser.add_argument("--json", default='HCC_relevant_codes.json', help="JSON hash table written from --csv")
+    parser.add_argument("--compile", default=None,
+                        help="write a compiled binary code set file instead, i.e. HCC_relevant_codes.hccidx")
+    parser.add_argument("--version", dest="versions", type=parse_version, action="append", default=[],
+                        help="NAME=CSV_PATH code set of --compile, repeatable, the first is the default "
+                             "(default: default=--csv)")
+    args = parser.parse_args(argv)
+
+    if args.compile:
+        compile_csv_versions(dict(args.versions or [("default", args.csv)]), args.compile)
+    else:
+        convert_txt_to_json(args.csv, args.json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import os
+import json
+import mmap
+import hashlib
+from typing import NamedTuple
+from utils.corpus.writer import file_sha256
+
+# ASCII record separator: never found in a note, so it is a safe default between notes
+DEFAULT_DELIMITER = "\x1e"
+DEFAULT_TEXT_FIELD = "note"
+JSONL_EXTENSIONS = (".jsonl", ".ndjson")
+_WHITESPACE = b" \t\r\n"
+
+# Memory maps opened by this process, one per file
+_MAPS = {}
+
+
+class NoteRef(NamedTuple):
+    """
+    Location of one note inside a corpus file: a few bytes to send to a worker, which
+    reads the note from its own memory map of the file instead of receiving the text.
+
+    note_id is "<file>:<line>" for JSONL records (or the value of their id field) and
+    "<file>#<index>" for delimited notes; text_field is the JSON field holding the
+    note text, None for delimited files.
+    """
+    note_id: str
+    path: str
+    start: int
+    end: int
+    text_field: str | None = None
+
+
+def _map(path):
+    # The mapping is shared with the page cache: workers never copy the whole file
+    entry = _MAPS.get(path)
+    if entry is None or entry[0] != os.getpid():
+        with open(path, 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        entry = _MAPS[path] = (os.getpid(), mapped)
+    return entry[1]
+
+
+def _is_empty(path):
+    return os.path.getsize(path) == 0
+
+
+def index_jsonl(path, text_field=DEFAULT_TEXT_FIELD, id_field=None):
+    """
+    Record the byte offsets of every record of a JSONL file.
+
+    Args:
+        path (str): The JSONL file, one JSON object per line
+        text_field (str): Field holding the note text
+        id_field (str | None): Field holding the note id. Reading it parses every
+            record; without it the ids are "<file>:<line number>"
+
+    Returns:
+        refs (list of NoteRef): One per non-blank line, in file order
+    """
+    if _is_empty(path):
+        return []
+    mapped = _map(path)
+    refs = []
+    start = 0
+    line_number = 0
+    size = len(mapped)
+    while start < size:
+        end = mapped.find(b"\n", start)
+        if end == -1:
+            end = size
+        line_number += 1
+        if mapped[start:end].strip():
+            note_id = f"{path}:{line_number}"
+            if id_field is not None:
+                record = json.loads(mapped[start:end])
+                if record.get(id_field) is not None:
+                    note_id = str(record[id_field])
+            refs.append(NoteRef(note_id, path, start, end, text_field))
+        start = end + 1
+    return refs
+
+
+def index_delimited(path, delimiter=DEFAULT_DELIMITER):
+    """
+    Record the byte offsets of every note of a file of concatenated notes.
+
+    Args:
+        path (str): The file
+        delimiter (str): Separator between two notes; whitespace around it is ignored
+
+    Returns:
+        refs (list of NoteRef): One per non-blank note, in file order
+    """
+    if _is_empty(path):
+        return []
+    mapped = _map(path)
+    separator = delimiter.encode("utf-8")
+    refs = []
+    start = 0
+    size = len(mapped)
+    while start <= size:
+        end = mapped.find(separator, start)
+        if end == -1:
+            end = size
+        note_start, note_end = start, end
+        while note_start < note_end and mapped[note_start] in _WHITESPACE:
+            note_start += 1
+        while note_end > note_start and mapped[note_end - 1] in _WHITESPACE:
+            note_end -= 1
+        if note_end > note_start:
+            refs.append(NoteRef(f"{path}#{len(refs)}", path, note_start, note_end))
+        start = end + len(separator)
+    return refs
+
+
+def index_corpus(path, input_format="auto", delimiter=DEFAULT_DELIMITER, text_field=DEFAULT_TEXT_FIELD,
+                 id_field=None):
+    """
+    Index a corpus file, JSONL or delimited.
+
+    Args:
+        path (str): The corpus file
+        input_format (str): "jsonl", "delimited", or "auto" to decide from the extension
+        delimiter (str): Separator of a delimited file
+        text_field (str): Note text field of a JSONL file
+        id_field (str | None): Note id field of a JSONL file
+
+    Returns:
+        refs (list of NoteRef): The notes of the file
+    """
+    if input_format == "auto":
+        input_format = "jsonl" if path.lower().endswith(JSONL_EXTENSIONS) else "delimited"
+    if input_format == "jsonl":
+        return index_jsonl(path, text_field, id_field)
+    if input_format == "delimited":
+        return index_delimited(path, delimiter)
+    raise ValueError(f"Unknown input format {input_format!r}, expected auto, jsonl or delimited")
+
+
+def read_note(ref):
+    """
+    Read a note from the memory map of its file.
+
+    Raises:
+        ValueError: If a JSONL record is not an object holding a string in text_field
+    """
+    data = _map(ref.path)[ref.start:ref.end]
+    if ref.text_field is None:
+        return data.decode("utf-8")
+    record = json.loads(data)
+    text = record.get(ref.text_field) if isinstance(record, dict) else None
+    if not isinstance(text, str):
+        raise ValueError(f"Record {ref.note_id} has no string field {ref.text_field!r}")
+    return text
+
+
+def note_id(note):
+    """Identifier of a note given as a file path or a NoteRef"""
+    return note.note_id if isinstance(note, NoteRef) else note
+
+
+def note_sha256(note):
+    """sha256 of a note given as a file path or a NoteRef (the bytes of its record)"""
+    if isinstance(note, NoteRef):
+        return hashlib.sha256(_map(note.path)[note.start:note.end]).hexdigest()
+    return file_sha256(note)
+
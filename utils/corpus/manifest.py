@@ -0,0 +1,176 @@
+import os
+import json
+import sqlite3
+import threading
+from utils.llm.cache import normalize_plan, fingerprint
+from utils.llm.adaptive import DEFERRED_PREFIX, has_deferred_plans
+
+# Returned by Manifest.reusable_output when the note has to be processed again
+MISSING = object()
+# condition_data values that are not persisted: the plan is evaluated again on the next run
+ERROR_PREFIX = "Error occurred"
+
+
+class Manifest:
+    """
+    Record of a previous run, to reprocess only what changed on the next one.
+
+    For every note the manifest stores the sha256 of its content, the hash of the
+    code set, the extraction fingerprint (prompt, model and options) and its output.
+    For every HCC plan it stores the condition_data under the hash of the normalized
+    plan text and the extraction fingerprint, and it keeps a snapshot of the code set.
+
+    On a re-run a note is reused as is when its content and fingerprints are the same.
+    When only the code set changed, the notes without any added, removed or renamed
+    code are reused too; the others go through the regex layers again (is_hcc is
+    evaluated against the new code set) and their plans whose text did not change get
+    their condition_data from the manifest, without calling the LLM.
+
+    A manifest can be shared by the threads of a staged pipeline.
+
+    Args:
+        path (str): The SQLite file
+        codes (Mapping): The current code set, code -> description
+        codeset_sha256 (str): Hash of the current code set
+        extraction_fingerprint (str): Identifies how condition_data is computed
+        options (str): Other options changing the output (i.e. "all_codes")
+    """
+
+    def __init__(self, path, codes, codeset_sha256, extraction_fingerprint, options=""):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.codes = codes
+        self.codeset_sha256 = codeset_sha256
+        self.extraction_fingerprint = extraction_fingerprint
+        self.options = options
+        self.reused_notes = 0
+        self.reused_plans = 0
+        self._records = {}
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS notes ("
+                "note TEXT PRIMARY KEY, sha256 TEXT NOT NULL, codeset TEXT NOT NULL, "
+                "extraction TEXT NOT NULL, options TEXT NOT NULL, codes TEXT NOT NULL, output TEXT NOT NULL)"
+            )
+            connection.execute("CREATE TABLE IF NOT EXISTS plans (key TEXT PRIMARY KEY, condition_data TEXT NOT NULL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS codeset (code TEXT PRIMARY KEY, description TEXT)")
+        row = self._connection.execute("SELECT value FROM meta WHERE key = 'codeset'").fetchone()
+        self.previous_codeset_sha256 = row[0] if row is not None else None
+        self.affected_codes = self._changed_codes()
+
+    def _changed_codes(self):
+        # Codes added, removed or renamed since the code set of the last run
+        if self.previous_codeset_sha256 in (None, self.codeset_sha256):
+            return set()
+        previous = dict(self._connection.execute("SELECT code, description FROM codeset"))
+        return {code for code in previous.keys() | self.codes.keys() if previous.get(code) != self.codes.get(code)}
+
+    def plan_key(self, assessment_plan):
+        return fingerprint(normalize_plan(assessment_plan), self.extraction_fingerprint)
+
+    def reusable_output(self, note, sha256):
+        """
+        Args:
+            note (str): Id of the note
+            sha256 (str): sha256 of its current content
+
+        Returns:
+            output (list of dict | None): The stored output if nothing it depends on
+            changed, MISSING otherwise
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT sha256, codeset, extraction, options, codes, output FROM notes WHERE note = ?", (note,)
+            ).fetchone()
+        if row is None or row[0] != sha256 or row[2] != self.extraction_fingerprint or row[3] != self.options:
+            return MISSING
+        if row[1] != self.codeset_sha256:
+            # The diff is only known from the last code set, and the lookups of
+            # --all-codes depend on the whole code set
+            if row[1] != self.previous_codeset_sha256 or self.options \
+                    or self.affected_codes.intersection(json.loads(row[4])):
+                return MISSING
+            # The output holds for the new code set: the next diff starts from it
+            with self._lock, self._connection as connection:
+                connection.execute("UPDATE notes SET codeset = ? WHERE note = ?", (self.codeset_sha256, note))
+        with self._lock:
+            self.reused_notes += 1
+        return json.loads(row[5])
+
+    def apply(self, note, records):
+        """
+        Resolve the HCC records whose plan text was already evaluated, and keep the
+        records of the note until record() stores its output.
+
+        Returns:
+            records (list of PlanRecord | None): The same records
+        """
+        if records is None:
+            return None
+        with self._lock:
+            self._records[note] = records
+            for record in records:
+                if record.needs_llm:
+                    row = self._connection.execute("SELECT condition_data FROM plans WHERE key = ?",
+                                                   (self.plan_key(record.plan),)).fetchone()
+                    if row is not None:
+                        record.resolve(row[0])
+                        self.reused_plans += 1
+        return records
+
+    def record(self, note, sha256, output):
+        """
+        Store the output of a processed note and the condition_data of its HCC plans.
+        A note with deferred plans is not stored: the next run processes it again, and
+        only its deferred plans go to the LLM.
+        """
+        with self._lock:
+            records = self._records.pop(note, None) or []
+        codes = sorted({span.code.replace('.', '') for record in records for span in record.codes})
+        plans = [(self.plan_key(record.plan), record.condition_data) for record in records
+                 if record.is_hcc and not record.needs_llm]
+        with self._lock, self._connection as connection:
+            if has_deferred_plans(output):
+                connection.execute("DELETE FROM notes WHERE note = ?", (note,))
+            else:
+                connection.execute(
+                    "INSERT OR REPLACE INTO notes (note, sha256, codeset, extraction, options, codes, output) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (note, sha256, self.codeset_sha256, self.extraction_fingerprint, self.options,
+                     json.dumps(codes), json.dumps(output, ensure_ascii=False))
+                )
+            connection.executemany(
+                "INSERT OR REPLACE INTO plans (key, condition_data) VALUES (?, ?)",
+                [(key, condition_data) for key, condition_data in plans
+                 if isinstance(condition_data, str) and not condition_data.startswith((ERROR_PREFIX, DEFERRED_PREFIX))]
+            )
+
+    def close(self):
+        """Save the snapshot of the code set and close the database"""
+        with self._lock, self._connection as connection:
+            row = connection.execute("SELECT value FROM meta WHERE key = 'codeset'").fetchone()
+            if row is None or row[0] != self.codeset_sha256:
+                connection.execute("DELETE FROM codeset")
+                connection.executemany("INSERT INTO codeset (code, description) VALUES (?, ?)", self.codes.items())
+                connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('codeset', ?)",
+                                   (self.codeset_sha256,))
+        self._connection.close()
+
+    def stats(self):
+        """
+        Returns:
+            stats (dict): reused_notes, reused_plans and the number of affected_codes
+        """
+        return {"reused_notes": self.reused_notes, "reused_plans": self.reused_plans,
+                "affected_codes": len(self.affected_codes)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
@@ -0,0 +1,170 @@
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from utils.hcc.code_index import configure_codeset, default_codeset
+from utils.corpus.plans import deterministic_layers
+from utils.corpus.ingest import NoteRef, read_note
+from utils.metrics.registry import get_registry
+from utils.metrics.tracing import trace, span, configure_tracing, tracing_path
+from utils.metrics.profiling import configure_profiling, profiling_interval, drain_profile, merge_profile
+
+
+def _init_worker(hcc_json_file_path, trace_path=None, codeset_version=None, profile_interval=None):
+    # Build the code index once per worker, not once per note
+    configure_codeset(hcc_json_file_path, codeset_version)
+    configure_tracing(trace_path)
+    configure_profiling(profile_interval, role="worker")
+    get_registry().reset()
+
+
+def _parse_note_file_with_metrics(pn_path):
+    # The metrics and profile samples of the note travel back with its records, to be merged by the parent
+    return parse_note_file(pn_path), get_registry().drain(), drain_profile()
+
+
+def parse_note_file(pn_path):
+    """
+    Read a progress note and run the deterministic layers on it.
+
+    Args:
+        pn_path (str | NoteRef): Path to the progress note, or its location in a corpus file
+
+    Returns:
+        records (list of PlanRecord | None): The plans of the note, None if it has no
+        assessment plans
+    """
+    if isinstance(pn_path, NoteRef):
+        trace_id = pn_path.note_id
+    else:
+        trace_id = pn_path
+    with trace(trace_id), span("deterministic_layers") as stage:
+        try:
+            if isinstance(pn_path, NoteRef):
+                progress_note = read_note(pn_path)
+            else:
+                with open(pn_path, 'r') as file:
+                    progress_note = file.read()
+            stage.attributes["chars"] = len(progress_note)
+            return deterministic_layers(progress_note)
+        except ValueError as e:
+            print(e)
+            return None
+
+
+def default_chunksize(count, workers):
+    """Chunks small enough to balance the workers, large enough to amortize the IPC"""
+    return max(1, min(64, count // (workers * 4)))
+
+
+@contextmanager
+def parser_pool(workers, hcc_json_file_path=None, codeset_version=None):
+    """
+    Process pool parsing notes, whose workers load the code index once. It can be
+    shared by several note_parser() and parse_notes() calls, i.e. by the batches of a
+    queue worker, instead of starting processes for each call.
+
+    Args:
+        workers (int): Number of worker processes
+        hcc_json_file_path (str | None): Code index each worker loads once, the code set
+            configured in this process if None
+        codeset_version (str | None): Version of a compiled code set for the workers
+
+    Returns:
+        executor (ProcessPoolExecutor | None): The pool, None when `workers` <= 1
+    """
+    if workers <= 1:
+        yield None
+        return
+    if hcc_json_file_path is None:
+        hcc_json_file_path, codeset_version = default_codeset()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(hcc_json_file_path, tracing_path(), codeset_version,
+                                       profiling_interval())) as executor:
+        yield executor
+
+
+@contextmanager
+def note_parser(workers=1, hcc_json_file_path=None, codeset_version=None, executor=None):
+    """
+    Context manager giving a thread-safe function that parses one note, for the threads
+    of a staged pipeline: parse_note_file itself when `workers` <= 1, otherwise a
+    function running it in a pool of `workers` processes and merging their metrics.
+
+    Args:
+        workers (int): Number of worker processes, 1 to parse in the calling threads
+        hcc_json_file_path (str | None): Code index each worker loads once, the code set
+            configured in this process if None
+        codeset_version (str | None): Version of a compiled code set for the workers
+        executor (ProcessPoolExecutor | None): A parser_pool() to use instead of a new one
+
+    Returns:
+        parse (callable): pn_path -> records, as parse_note_file
+    """
+    if executor is None:
+        with parser_pool(workers, hcc_json_file_path, codeset_version) as executor:
+            if executor is None:
+                yield parse_note_file
+                return
+            with note_parser(workers, executor=executor) as parse:
+                yield parse
+        return
+
+    registry = get_registry()
+
+    def parse(pn_path):
+        records, metrics, samples = executor.submit(_parse_note_file_with_metrics, pn_path).result()
+        registry.merge(metrics)
+        merge_profile(samples)
+        return records
+
+    yield parse
+
+
+def parse_notes(pn_paths, workers=1, chunksize=None, hcc_json_file_path=None, codeset_version=None,
+                executor=None):
+    """
+    Run the deterministic layers on many notes, fanning them out to a process pool
+    when `workers` > 1. Results stream back as soon as they are ready, but always in
+    the order of `pn_paths`.
+
+    The LLM stage is not run here: the records come back with an unresolved
+    condition_data, so the model clients live only in the parent process. The
+    metrics recorded by the workers are merged into the parent's registry.
+
+    Notes given as NoteRef are read by each worker from its own memory map of the
+    corpus file, and consecutive notes go to the same worker (chunks), so every worker
+    reads contiguous regions of the file.
+
+    Args:
+        pn_paths (list of str | NoteRef): Paths to the progress notes, or their locations
+        workers (int): Number of worker processes, 1 to parse in this process
+        chunksize (int | None): Notes sent to a worker at a time
+        hcc_json_file_path (str | None): Code index each worker loads once, the code set
+            configured in this process if None
+        codeset_version (str | None): Version of a compiled code set for the workers
+        executor (ProcessPoolExecutor | None): A parser_pool() of `workers` processes to
+            use instead of a new one
+
+    Returns:
+        iterator of (str | NoteRef, list of PlanRecord | None): (pn_path, records) pairs
+    """
+    if executor is None:
+        if workers > 1:
+            pn_paths = list(pn_paths)
+            workers = min(workers, len(pn_paths))
+        if workers <= 1:
+            for pn_path in pn_paths:
+                yield pn_path, parse_note_file(pn_path)
+            return
+        with parser_pool(workers, hcc_json_file_path, codeset_version) as executor:
+            yield from parse_notes(pn_paths, workers, chunksize, executor=executor)
+        return
+
+    pn_paths = list(pn_paths)
+    if chunksize is None:
+        chunksize = default_chunksize(len(pn_paths), workers)
+    registry = get_registry()
+    results = executor.map(_parse_note_file_with_metrics, pn_paths, chunksize=chunksize)
+    for pn_path, (records, metrics, samples) in zip(pn_paths, results):
+        registry.merge(metrics)
+        merge_profile(samples)
+        yield pn_path, records
@@ -0,0 +1,200 @@
+from utils.regex.regex_utils import is_icd10_an_hcc
+from utils.regex.scanner import scan_note
+from utils.metrics.registry import get_registry
+
+_UNRESOLVED = object()
+
+
+class PlanRecord:
+    """
+    Result of the deterministic layers for one assessment plan.
+
+    `condition_data` is a lazily resolved field: it is only computed (through
+    `resolver`) the first time it is read, and only for HCC plans. A batch stage
+    can fill it beforehand with `resolve()`, in which case the resolver never runs.
+
+    Args:
+        plan (str): The individual assessment plan
+        icd10_code (str | None): The code found by match_icd10_codes
+        partial_output (dict | None): The dictionary returned by is_icd10_an_hcc
+        resolver (callable | None): plan -> condition_data, used on first access
+        codes (list of CodeSpan | None): Every ICD-10 candidate of the plan, with its
+            offsets in the note
+    """
+
+    __slots__ = ("plan", "icd10_code", "partial_output", "resolver", "codes", "_condition_data")
+
+    def __init__(self, plan, icd10_code=None, partial_output=None, resolver=None, codes=None):
+        self.plan = plan
+        self.icd10_code = icd10_code
+        self.partial_output = partial_output
+        self.resolver = resolver
+        self.codes = codes or []
+        self._condition_data = _UNRESOLVED
+
+    def __getstate__(self):
+        # The resolver (an LLM pipeline) stays in the process that created the record
+        resolved = self._condition_data is not _UNRESOLVED
+        return (self.plan, self.icd10_code, self.partial_output, self.codes, resolved,
+                self._condition_data if resolved else None)
+
+    def __setstate__(self, state):
+        self.plan, self.icd10_code, self.partial_output, self.codes, resolved, condition_data = state
+        self._condition_data = condition_data if resolved else _UNRESOLVED
+        self.resolver = None
+
+    @property
+    def is_hcc(self):
+        return bool(self.partial_output and self.partial_output["is_hcc"])
+
+    @property
+    def needs_llm(self):
+        """True if the plan is an HCC whose condition_data was not computed yet"""
+        return self.is_hcc and self._condition_data is _UNRESOLVED
+
+    @property
+    def condition_data(self):
+        if not self.is_hcc:
+            return None
+        if self._condition_data is _UNRESOLVED:
+            if self.resolver is None:
+                raise ValueError("No resolver available to compute the condition_data")
+            self._condition_data = self.resolver(self.plan)
+        return self._condition_data
+
+    def resolve(self, condition_data):
+        """Set the condition_data computed by an external (batch) stage"""
+        self._condition_data = condition_data
+
+    def to_output(self, code_trie=None, with_condition_data=True):
+        """
+        Build the output dictionary of the plan, resolving condition_data if needed.
+
+        Args:
+            code_trie (ICD10Trie | None): If given, every code of the plan is looked up
+                and listed under "icd10_codes" with its span
+            with_condition_data (bool): False to leave condition_data out when it is
+                not already resolved (no LLM call)
+
+        Returns:
+            output_plan (dict): {} if no code was found, otherwise the partial_output
+            of is_icd10_an_hcc plus "condition_data" for HCC plans
+        """
+        output_plan = {}
+        if self.partial_output is not None:
+            output_plan.update(self.partial_output)
+            if self.is_hcc and (with_condition_data or self._condition_data is not _UNRESOLVED):
+                output_plan["condition_data"] = self.condition_data
+        if code_trie is not None and self.codes:
+            output_plan["icd10_codes"] = code_trie.lookup_spans(self.codes)
+        return output_plan
+
+
+def deterministic_layers(progress_note, resolver=None, codeset_version=None):
+    """
+    Run the regex and hash-table layers on a progress note, without calling the LLM.
+
+    Args:
+        progress_note (str): The progress note text
+        resolver (callable | None): plan -> condition_data, attached to every record
+        codeset_version (str | None): Version of the compiled code set for this note,
+            the configured one if None
+
+    Returns:
+        records (list of PlanRecord): One record per individual assessment plan
+
+    Raises:
+        ValueError: If the input is not a string or no plans are found
+    """
+    if not isinstance(progress_note, str):
+        raise ValueError("Input progress_note must be a string")
+
+    # extract_assessment_plan, extract_each_plan and match_icd10_codes fused in one pass
+    records = []
+    for scanned_plan in scan_note(progress_note):
+        plan = scanned_plan.text
+        icd10_code = scanned_plan.codes[0].code if scanned_plan.codes else None
+        partial_output = is_icd10_an_hcc(icd10_code, plan, version=codeset_version) if icd10_code else None
+        records.append(PlanRecord(plan, icd10_code, partial_output, resolver, scanned_plan.codes))
+
+    registry = get_registry()
+    registry.increment("hcc_notes_total")
+    registry.increment("hcc_plans_total", len(records))
+    registry.increment("hcc_hcc_plans_total", sum(1 for record in records if record.is_hcc))
+    return records
+
+
+def records_output(records, resolver=None, code_trie=None, with_condition_data=True):
+    """
+    Build the output of a note from its records.
+
+    Args:
+        records (list of PlanRecord | None): The records of the note
+        resolver (callable | None): plan -> condition_data for the records still unresolved
+        code_trie (ICD10Trie | None): Adds the lookup of every code of each plan
+        with_condition_data (bool): False for the deterministic layers only, without
+            LLM call (only the condition_data resolved beforehand, i.e. by the rules)
+
+    Returns:
+        output (list of dict | None): One dictionary per plan, None if the note had no plans
+    """
+    if records is None:
+        return None
+    if resolver is not None:
+        for record in records:
+            record.resolver = resolver
+    return [record.to_output(code_trie, with_condition_data) for record in records]
+
+
+def resolve_pending(records, evaluate_many):
+    """
+    Compute the condition_data of every HCC record that still needs it.
+
+    Args:
+        records (iterable of PlanRecord): Records from one or more notes
+        evaluate_many (callable): list of plans -> list of condition_data, same order
+
+    Returns:
+        count (int): Number of plans sent to the LLM stage
+    """
+    pending = [record for record in records if record.needs_llm]
+    if pending:
+        results = evaluate_many([record.plan for record in pending])
+        for record, condition_data in zip(pending, results):
+            record.resolve(condition_data)
+    return len(pending)
+
+
+def run_two_phase(progress_notes, evaluate=None, evaluate_many=None):
+    """
+    Process a corpus in two phases: the deterministic layers for every note first,
+    then the LLM stage only for the HCC-positive plans, merged back per note.
+
+    Args:
+        progress_notes (iterable of str): The progress notes texts
+        evaluate (callable | None): plan -> condition_data
+        evaluate_many (callable | None): list of plans -> list of condition_data,
+            defaults to calling `evaluate` on each plan
+
+    Returns:
+        outputs (list): For each note, the list of output dictionaries (None if the
+        note could not be parsed)
+    """
+    if evaluate_many is None:
+        if evaluate is None:
+            raise ValueError("Either evaluate or evaluate_many must be provided")
+        evaluate_many = lambda plans: [evaluate(plan) for plan in plans]
+
+    # Phase 1: regex and code lookups for the whole corpus
+    notes_records = []
+    for progress_note in progress_notes:
+        try:
+            notes_records.append(deterministic_layers(progress_note))
+        except ValueError as e:
+            print(e)
+            notes_records.append(None)
+
+    # Phase 2: LLM only for the HCC-positive plans
+    resolve_pending((record for records in notes_records if records for record in records), evaluate_many)
+
+    return [records_output(records) for records in notes_records]
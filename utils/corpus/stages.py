@@ -0,0 +1,251 @@
+import queue
+import threading
+from time import perf_counter
+from utils.metrics.registry import get_registry
+
+QUEUE_DEPTH_METRIC = "hcc_queue_depth"
+STAGE_BUSY_METRIC = "hcc_stage_busy_seconds_total"
+STAGE_BLOCKED_METRIC = "hcc_stage_blocked_seconds_total"
+# Queue depths are counts, not latencies
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+# How often blocked threads check whether the pipeline was stopped
+_POLL_SECONDS = 0.1
+# End of a queue, one per consumer thread
+_DONE = object()
+
+
+class _Failure:
+    """An exception raised by a stage, carried to the consumer"""
+
+    __slots__ = ("error",)
+
+    def __init__(self, error):
+        self.error = error
+
+
+class StageQueue:
+    """
+    Bounded FIFO between two stages that keeps track of its depth.
+
+    Args:
+        name (str): Label of the queue in the metrics
+        capacity (int): Items the queue holds before put() blocks its producer
+    """
+
+    def __init__(self, name, capacity):
+        self.name = name
+        self.capacity = capacity
+        self.max_depth = 0
+        self._queue = queue.Queue(maxsize=capacity)
+        self._depths = get_registry().series(QUEUE_DEPTH_METRIC, DEPTH_BUCKETS, queue=name)
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def put(self, item, stopped):
+        """
+        Block while the queue is full, which is the backpressure on the producer.
+
+        Returns:
+            put (bool): False if the pipeline was stopped first
+        """
+        while not stopped.is_set():
+            try:
+                self._queue.put(item, timeout=_POLL_SECONDS)
+            except queue.Full:
+                continue
+            depth = self._queue.qsize()
+            self.max_depth = max(self.max_depth, depth)
+            self._depths.observe(depth)
+            return True
+        return False
+
+    def get(self, stopped):
+        """
+        Returns:
+            item: The next item, _DONE if the pipeline was stopped first
+        """
+        while not stopped.is_set():
+            try:
+                return self._queue.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def stats(self):
+        return {"capacity": self.capacity, "depth": self.depth(), "max_depth": self.max_depth}
+
+
+class Stage:
+    """
+    A pool of threads applying `function` to the items of its input queue.
+
+    Args:
+        name (str): Label of the stage in the metrics
+        function (callable): (note, value) -> value
+        workers (int): Threads of the pool
+    """
+
+    def __init__(self, name, function, workers):
+        self.name = name
+        self.function = function
+        self.workers = max(1, workers)
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, busy, blocked):
+        with self._lock:
+            self.items += 1
+            self.busy_seconds += busy
+            self.blocked_seconds += blocked
+        registry = get_registry()
+        registry.increment(STAGE_BUSY_METRIC, busy, stage=self.name)
+        registry.increment(STAGE_BLOCKED_METRIC, blocked, stage=self.name)
+
+    def stats(self, elapsed):
+        """
+        Returns:
+            stats (dict): workers, items, busy_seconds, blocked_seconds (waiting on a
+            full output queue) and utilization, the busy fraction of the pool
+        """
+        with self._lock:
+            capacity = self.workers * elapsed
+            return {"workers": self.workers, "items": self.items,
+                    "busy_seconds": self.busy_seconds, "blocked_seconds": self.blocked_seconds,
+                    "utilization": self.busy_seconds / capacity if capacity else None}
+
+
+class StagedPipeline:
+    """
+    Parse stage and LLM stage running concurrently, connected by bounded queues:
+
+        notes -> [parse queue] -> parse workers -> [llm queue] -> llm workers -> [output queue] -> run()
+
+    While the LLM calls of one note are in flight, the next notes are already parsed.
+    When the LLM stage falls behind, the llm queue fills up and blocks the parse
+    workers, which stop taking notes: at most `window` notes are in memory whatever the
+    size of the corpus. The outputs are yielded in the order of the notes.
+
+    Args:
+        parse (callable): note -> records, i.e. parallel.parse_note_file
+        resolve (callable): (note, records) -> output, the LLM stage
+        parse_workers (int): Threads of the parse stage
+        llm_workers (int): Threads of the LLM stage
+        queue_size (int): Capacity of each queue
+    """
+
+    def __init__(self, parse, resolve, parse_workers=1, llm_workers=4, queue_size=16):
+        self.queue_size = max(1, queue_size)
+        self.stages = [Stage("parse", lambda note, _: parse(note), parse_workers),
+                       Stage("llm", resolve, llm_workers)]
+        self.queues = [StageQueue(name, self.queue_size) for name in ("parse", "llm", "output")]
+        # Notes taken and not yielded yet: every queue full, every worker busy
+        self.window = 3 * self.queue_size + sum(stage.workers for stage in self.stages)
+        self._started = None
+        self._finished = None
+
+    def run(self, notes):
+        """
+        Args:
+            notes (iterable of str | NoteRef): The notes, consumed lazily
+
+        Returns:
+            iterator of (note, output): In the order of `notes`
+
+        Raises:
+            Exception: The first exception raised by parse or resolve, after the
+            pipeline is stopped
+        """
+        stopped = threading.Event()
+        slots = threading.Semaphore(self.window)
+        self._started, self._finished = perf_counter(), None
+        threads = [threading.Thread(target=self._feed, args=(notes, slots, stopped), daemon=True)]
+        for number, stage in enumerate(self.stages):
+            # The consumers of the next queue: the next stage, or run() for the output queue
+            consumers = self.stages[number + 1].workers if number + 1 < len(self.stages) else 1
+            remaining = [stage.workers]
+            threads += [threading.Thread(target=self._work, daemon=True,
+                                         args=(stage, self.queues[number], self.queues[number + 1],
+                                               consumers, remaining, stopped))
+                        for _ in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+
+        pending = {}
+        next_index = 0
+        try:
+            while True:
+                item = self.queues[-1].get(stopped)
+                if item is _DONE:
+                    break
+                index, note, value = item
+                if isinstance(value, _Failure):
+                    raise value.error
+                pending[index] = (note, value)
+                while next_index in pending:
+                    yield pending.pop(next_index)
+                    next_index += 1
+                    slots.release()
+        finally:
+            # Also when the consumer stops early: blocked threads see the event and leave
+            stopped.set()
+            for thread in threads:
+                thread.join()
+            self._finished = perf_counter()
+
+    def _feed(self, notes, slots, stopped):
+        parse_queue = self.queues[0]
+        try:
+            for index, note in enumerate(notes):
+                while not slots.acquire(timeout=_POLL_SECONDS):
+                    if stopped.is_set():
+                        return
+                if not parse_queue.put((index, note, None), stopped):
+                    return
+        except Exception as e:
+            self.queues[-1].put((-1, None, _Failure(e)), stopped)
+        for _ in range(self.stages[0].workers):
+            parse_queue.put(_DONE, stopped)
+
+    def _work(self, stage, source, target, consumers, remaining, stopped):
+        while True:
+            item = source.get(stopped)
+            if item is _DONE:
+                break
+            index, note, value = item
+            if isinstance(value, _Failure):
+                # Failed in an earlier stage: passed on to the consumer untouched
+                target.put(item, stopped)
+                continue
+            started = perf_counter()
+            try:
+                value = stage.function(note, value)
+            except Exception as e:
+                value = _Failure(e)
+            busy = perf_counter() - started
+            if not target.put((index, note, value), stopped):
+                return
+            stage.record(busy, perf_counter() - started - busy)
+        with stage._lock:
+            remaining[0] -= 1
+            last = not remaining[0]
+        if last:
+            # The next stage ends once every worker of this one is done
+            for _ in range(consumers):
+                target.put(_DONE, stopped)
+
+    def stats(self):
+        """
+        Returns:
+            stats (dict): {"elapsed_seconds", "window", "stages": {name: Stage.stats()},
+            "queues": {name: StageQueue.stats()}}
+        """
+        if self._started is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self._finished or perf_counter()) - self._started
+        return {"elapsed_seconds": elapsed, "window": self.window,
+                "stages": {stage.name: stage.stats(elapsed) for stage in self.stages},
+                "queues": {stage_queue.name: stage_queue.stats() for stage_queue in self.queues}}
@@ -0,0 +1,356 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+from typing import NamedTuple
+from utils.sqlite_local import LocalConnection
+from utils.corpus.ingest import NoteRef, note_id
+from utils.llm.adaptive import has_deferred_plans
+
+# Item states
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+# Plans deferred by the LLM stage (errors, open circuit): back to pending with requeue_deferred()
+DEFERRED = "deferred"
+STATES = (PENDING, LEASED, DONE, FAILED, DEFERRED)
+
+
+class WorkItem(NamedTuple):
+    """A note claimed from the queue: its row id, the note (path or NoteRef) and its attempts so far"""
+    item_id: int
+    note: object
+    sha256: str
+    attempts: int
+
+
+def default_worker_id():
+    """<hostname>:<pid>, unique across the machines sharing a queue"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _dump_note(note):
+    if isinstance(note, NoteRef):
+        return json.dumps({"ref": list(note)})
+    return json.dumps({"path": note})
+
+
+def _load_note(data):
+    data = json.loads(data)
+    return NoteRef(*data["ref"]) if "ref" in data else data["path"]
+
+
+class WorkQueue:
+    """
+    Work queue of progress notes in a SQLite file, shared by any number of worker
+    processes, containers or machines, without a broker.
+
+    A producer enqueues notes; workers claim batches under a lease of `lease_seconds`,
+    renew it while they work, and complete the batch in a single transaction that
+    also stores the outputs. A lease that expires (crashed or stalled worker) puts its
+    notes back in the queue for the next claim; a worker whose lease expired cannot
+    complete the notes anymore. Notes failing `max_attempts` times are marked failed.
+    Notes whose plans the LLM stage deferred are set aside, without using an attempt,
+    until requeue_deferred() puts them back in the queue (i.e. the next enqueue).
+
+    The database uses a rollback journal (not WAL), which works on a file shared over
+    the network as long as the file system implements locks.
+
+    Args:
+        path (str): The SQLite file
+        lease_seconds (float): Lifetime of a claim without renewal
+        max_attempts (int): Claims of a note before it is marked failed
+    """
+
+    def __init__(self, path, lease_seconds=300.0, max_attempts=3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._connections = LocalConnection(path, ("journal_mode=DELETE",), timeout=60, isolation_level=None)
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS items ("
+                "id INTEGER PRIMARY KEY, note_id TEXT UNIQUE NOT NULL, note TEXT NOT NULL, "
+                "sha256 TEXT NOT NULL, state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+                "owner TEXT, lease_expires REAL, enqueued REAL NOT NULL, finished REAL, "
+                "output TEXT, error TEXT)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS items_state ON items (state, id)")
+
+    def _connection(self):
+        return self._connections.get()
+
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front: two workers never claim the same rows
+        return _Transaction(self._connection())
+
+    def enqueue(self, notes, hashes):
+        """
+        Add notes to the queue; notes already in it (same id) are left untouched.
+
+        Args:
+            notes (iterable of str | NoteRef): Paths to the notes, or their locations in a corpus file
+            hashes (dict): note -> sha256 of its content
+
+        Returns:
+            count (int): Number of notes added
+        """
+        now = time.time()
+        rows = [(note_id(note), _dump_note(note), hashes[note], PENDING, now) for note in notes]
+        with self._transaction() as connection:
+            before = connection.total_changes
+            connection.executemany(
+                "INSERT OR IGNORE INTO items (note_id, note, sha256, state, enqueued) VALUES (?, ?, ?, ?, ?)", rows)
+            return connection.total_changes - before
+
+    def requeue_expired(self, connection=None):
+        """
+        Put back the notes whose lease expired; those claimed max_attempts times fail.
+
+        Returns:
+            count (int): Number of expired leases
+        """
+        if connection is None:
+            with self._transaction() as connection:
+                return self.requeue_expired(connection)
+        now = time.time()
+        failed = connection.execute(
+            "UPDATE items SET state = ?, owner = NULL, lease_expires = NULL, finished = ?, error = ? "
+            "WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+            (FAILED, now, "lease expired", LEASED, now, self.max_attempts)).rowcount
+        requeued = connection.execute(
+            "UPDATE items SET state = ?, owner = NULL, lease_expires = NULL WHERE state = ? AND lease_expires < ?",
+            (PENDING, LEASED, now)).rowcount
+        return failed + requeued
+
+    def claim(self, worker_id, batch_size=16):
+        """
+        Lease up to `batch_size` pending notes, oldest first.
+
+        Returns:
+            items (list of WorkItem): The claimed notes, [] if none is pending
+        """
+        with self._transaction() as connection:
+            self.requeue_expired(connection)
+            rows = connection.execute(
+                "SELECT id, note, sha256, attempts FROM items WHERE state = ? ORDER BY id LIMIT ?",
+                (PENDING, batch_size)).fetchall()
+            expires = time.time() + self.lease_seconds
+            connection.executemany(
+                "UPDATE items SET state = ?, owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                [(LEASED, worker_id, expires, row[0]) for row in rows])
+        return [WorkItem(row[0], _load_note(row[1]), row[2], row[3] + 1) for row in rows]
+
+    def renew(self, worker_id, items):
+        """
+        Extend the lease of claimed notes.
+
+        Returns:
+            count (int): Number of notes still leased by `worker_id`
+        """
+        expires = time.time() + self.lease_seconds
+        with self._transaction() as connection:
+            return sum(connection.execute(
+                "UPDATE items SET lease_expires = ? WHERE id = ? AND owner = ? AND state = ?",
+                (expires, item.item_id, worker_id, LEASED)).rowcount for item in items)
+
+    def complete(self, worker_id, results):
+        """
+        Store the outputs of claimed notes and mark them done, in one transaction.
+
+        Args:
+            worker_id (str): The worker holding the lease
+            results (list of (WorkItem, output)): output being the list of plans of the note
+
+        Returns:
+            count (int): Number of notes committed; notes whose lease was lost are skipped
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            return sum(connection.execute(
+                "UPDATE items SET state = ?, owner = NULL, lease_expires = NULL, finished = ?, output = ? "
+                "WHERE id = ? AND owner = ? AND state = ?",
+                (DONE, now, json.dumps(output, ensure_ascii=False), item.item_id, worker_id, LEASED)).rowcount
+                for item, output in results)
+
+    def release(self, worker_id, items, error):
+        """
+        Give back claimed notes after an error: they are claimed again later, or marked
+        failed after max_attempts.
+
+        Returns:
+            count (int): Number of notes released
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            return sum(connection.execute(
+                "UPDATE items SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, owner = NULL, "
+                "lease_expires = NULL, error = ?, finished = CASE WHEN attempts >= ? THEN ? END "
+                "WHERE id = ? AND owner = ? AND state = ?",
+                (self.max_attempts, FAILED, PENDING, str(error), self.max_attempts, now,
+                 item.item_id, worker_id, LEASED)).rowcount for item in items)
+
+    def defer(self, worker_id, items, reason):
+        """
+        Set aside claimed notes whose plans were deferred by the LLM stage; the claim
+        does not count as an attempt.
+
+        Returns:
+            count (int): Number of notes deferred
+        """
+        with self._transaction() as connection:
+            return sum(connection.execute(
+                "UPDATE items SET state = ?, owner = NULL, lease_expires = NULL, attempts = attempts - 1, "
+                "error = ? WHERE id = ? AND owner = ? AND state = ?",
+                (DEFERRED, str(reason), item.item_id, worker_id, LEASED)).rowcount for item in items)
+
+    def requeue_deferred(self):
+        """
+        Put the deferred notes back in the queue.
+
+        Returns:
+            count (int): Number of notes requeued
+        """
+        with self._transaction() as connection:
+            return connection.execute("UPDATE items SET state = ?, error = NULL WHERE state = ?",
+                                      (PENDING, DEFERRED)).rowcount
+
+    def progress(self, window=60.0):
+        """
+        Returns:
+            progress (dict): count of notes per state, total, notes_per_second over the
+            last `window` seconds, the workers holding leases and the estimated seconds left
+        """
+        now = time.time()
+        connection = self._connection()
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(connection.execute("SELECT state, COUNT(*) FROM items GROUP BY state").fetchall())
+        recent = connection.execute("SELECT COUNT(*) FROM items WHERE state = ? AND finished >= ?",
+                                    (DONE, now - window)).fetchone()[0]
+        workers = [row[0] for row in connection.execute(
+            "SELECT DISTINCT owner FROM items WHERE state = ? AND lease_expires >= ?", (LEASED, now))]
+        rate = recent / window
+        remaining = counts[PENDING] + counts[LEASED]
+        return {
+            **counts,
+            "total": sum(counts.values()),
+            "notes_per_second": rate,
+            "workers": workers,
+            "eta_seconds": remaining / rate if rate else None,
+        }
+
+    def results(self):
+        """
+        Returns:
+            iterator of (str, str, list | None): (note id, sha256, output) of the done notes, in queue order
+        """
+        rows = self._connection().execute(
+            "SELECT note_id, sha256, output FROM items WHERE state = ? ORDER BY id", (DONE,))
+        for note, sha256, output in rows:
+            yield note, sha256, json.loads(output)
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+
+class LeaseHeartbeat:
+    """
+    Renews the lease of claimed notes from a background thread every `interval` seconds
+    while their batch is in flight, so a note slower than the lease (i.e. a long LLM
+    stage) does not hand the batch to another worker. A crashed process stops renewing.
+
+    Args:
+        queue (WorkQueue): The queue
+        worker_id (str): The worker holding the lease
+        items (list of WorkItem): The claimed notes
+        interval (float | None): Seconds between two renewals, a third of the lease if None
+    """
+
+    def __init__(self, queue, worker_id, items, interval=None):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.items = items
+        self.interval = interval or queue.lease_seconds / 3
+        self.renewals = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="hcc-lease-heartbeat", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.queue.renew(self.worker_id, self.items)
+                self.renewals += 1
+            except sqlite3.Error as e:
+                # The next beat tries again, before the lease runs out
+                print(f"Lease renewal failed: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+class _Transaction:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.connection.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        return False
+
+
+def run_worker(queue, process, worker_id=None, batch_size=16, poll_interval=1.0, stop_when_idle=True):
+    """
+    Claim batches of notes until the queue is drained. Notes with deferred plans are
+    set aside with WorkQueue.defer() instead of being committed.
+
+    Args:
+        queue (WorkQueue): The queue
+        process (callable): list of notes -> iterable of (note, output), i.e. main.process_notes
+        worker_id (str | None): Owner of the leases, default_worker_id() if None
+        batch_size (int): Notes claimed at a time
+        poll_interval (float): Seconds between two claims while other workers hold leases
+        stop_when_idle (bool): Return once no note is pending nor leased, otherwise keep polling
+
+    Returns:
+        count (int): Number of notes this worker committed
+    """
+    worker_id = worker_id or default_worker_id()
+    committed = 0
+    deferred = 0
+    while True:
+        items = queue.claim(worker_id, batch_size)
+        if not items:
+            progress = queue.progress()
+            if stop_when_idle and not progress[PENDING] and not progress[LEASED]:
+                if deferred:
+                    print(f"Queue: {deferred} notes deferred after LLM errors or an open circuit, "
+                          f"enqueue again to retry them")
+                return committed
+            # Leases of other workers may still expire and come back to the queue
+            time.sleep(poll_interval)
+            continue
+        outputs = []
+        try:
+            with LeaseHeartbeat(queue, worker_id, items):
+                outputs = [output for _, output in process([item.note for item in items])]
+        except Exception as e:
+            queue.release(worker_id, items, e)
+            print(f"Batch released after an error: {e}")
+            continue
+        results = list(zip(items, outputs))
+        deferred += queue.defer(worker_id, [item for item, output in results if has_deferred_plans(output)],
+                                "plans deferred by the LLM stage")
+        committed += queue.complete(worker_id, [(item, output) for item, output in results
+                                                if not has_deferred_plans(output)])
@@ -0,0 +1,106 @@
+import os
+import json
+import hashlib
+from utils.llm.adaptive import has_deferred_plans
+
+
+def file_sha256(path):
+    """sha256 hex digest of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_completed(output_file_path):
+    """
+    Read the notes already present in a JSONL results file.
+
+    A truncated last line (left by a crashed run) is ignored, and so are the notes
+    whose last record holds deferred plans: they are processed again.
+
+    Args:
+        output_file_path (str): The JSONL results file
+
+    Returns:
+        completed (dict): note path -> sha256 of the note when it was processed
+    """
+    completed = {}
+    if not os.path.exists(output_file_path):
+        return completed
+    with open(output_file_path, 'r') as output_file:
+        for line in output_file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if has_deferred_plans(record["plans"]):
+                completed.pop(record["note"], None)
+            else:
+                completed[record["note"]] = record["sha256"]
+    return completed
+
+
+class JSONLResultWriter:
+    """
+    Buffered writer of one JSON record per note, fsync-ed every `fsync_every` records
+    so that a crash loses at most one batch.
+
+    Args:
+        output_file_path (str): The JSONL results file
+        fsync_every (int): Number of records between two fsync calls
+        append (bool): Keep the records already in the file (resume) instead of truncating it
+    """
+
+    def __init__(self, output_file_path, fsync_every=50, append=False):
+        directory = os.path.dirname(output_file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.output_file_path = output_file_path
+        self.fsync_every = fsync_every
+        self.written = 0
+        self._file = open(output_file_path, 'a' if append else 'w', buffering=1 << 16)
+        if append:
+            self._terminate_partial_line()
+
+    def _terminate_partial_line(self):
+        # A crash may leave half a record: start on a fresh line so the next one stays valid
+        with open(self.output_file_path, 'rb') as output_file:
+            output_file.seek(0, os.SEEK_END)
+            if output_file.tell() == 0:
+                return
+            output_file.seek(-1, os.SEEK_END)
+            if output_file.read(1) != b"\n":
+                self._file.write("\n")
+
+    def write(self, note, sha256, plans):
+        """
+        Append the record of one note.
+
+        Args:
+            note (str): Path (or id) of the progress note
+            sha256 (str): sha256 of the note content
+            plans (list of dict | None): The output of layers() for the note
+        """
+        record = {"note": note, "sha256": sha256, "plans": plans}
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.written += 1
+        if self.written % self.fsync_every == 0:
+            self.sync()
+
+    def sync(self):
+        """Flush the buffer and fsync the file"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
@@ -0,0 +1,211 @@
+import os
+import json
+import hashlib
+import threading
+import time
+from types import MappingProxyType
+from utils.hcc.codeset import CompiledCodeSet, is_compiled_codeset
+
+HCC_JSON_FILE_PATH = "HCC_relevant_codes.json"
+
+# Process-wide registry of indexes, one per resolved source file and code set version
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+# Code set used when no source is given: (path, version), see configure_codeset()
+_default_codeset = (HCC_JSON_FILE_PATH, None)
+
+
+class HCCCodeIndex:
+    """
+    Read-only, process-wide index of the HCC relevant codes.
+
+    The source JSON file is parsed once and kept in memory. Before a lookup the
+    index checks (at most every `check_interval` seconds) whether the file's mtime
+    changed, and only re-parses it when the content hash differs as well.
+
+    Args:
+        json_file_path (str): Path to the HCC_relevant_codes.json file
+        check_interval (float): Minimum seconds between two checks of the source file
+    """
+
+    def __init__(self, json_file_path=HCC_JSON_FILE_PATH, check_interval=1.0):
+        self.json_file_path = json_file_path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._codes = MappingProxyType({})
+        self._mtime = None
+        self._sha256 = None
+        self._last_check = 0.0
+        self.reload_count = 0
+        self._load()
+
+    def _load(self):
+        """Parse the source file and swap it in if its content changed."""
+        try:
+            stat = os.stat(self.json_file_path)
+            with open(self.json_file_path, 'rb') as json_file:
+                raw = json_file.read()
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Error: The file '{self.json_file_path}' was not found.")
+
+        sha256 = hashlib.sha256(raw).hexdigest()
+        if sha256 != self._sha256:
+            try:
+                data = json.loads(raw)
+            except json.JSONDecodeError:
+                raise ValueError(f"Error: The file '{self.json_file_path}' is not a valid JSON file.")
+            self._codes = MappingProxyType(data)
+            self._sha256 = sha256
+            self.reload_count += 1
+        self._mtime = stat.st_mtime_ns
+        self._last_check = time.monotonic()
+
+    def refresh(self, force=False):
+        """
+        Reload the index if the source file changed since the last check.
+
+        Args:
+            force (bool): Check the file even if `check_interval` has not elapsed
+
+        Returns:
+            codes (Mapping): The current read-only code -> description mapping
+        """
+        if force or time.monotonic() - self._last_check >= self.check_interval:
+            with self._lock:
+                try:
+                    mtime = os.stat(self.json_file_path).st_mtime_ns
+                except FileNotFoundError:
+                    raise FileNotFoundError(f"Error: The file '{self.json_file_path}' was not found.")
+                if mtime != self._mtime:
+                    self._load()
+                else:
+                    self._last_check = time.monotonic()
+        return self._codes
+
+    @property
+    def codes(self):
+        return self.refresh()
+
+    @property
+    def sha256(self):
+        return self._sha256
+
+    def lookup(self, code):
+        """
+        Get the HCC description of a dot-less ICD-10 code.
+
+        Args:
+            code (str): The icd-10 code without dots (i.e: J449)
+
+        Returns:
+            description (str | None): The condition name, or None if the code is not an HCC
+        """
+        return self.codes.get(code)
+
+    def lookup_many(self, codes):
+        """
+        Get the HCC descriptions of several dot-less ICD-10 codes at once.
+
+        Args:
+            codes (iterable of str): The icd-10 codes without dots
+
+        Returns:
+            descriptions (dict): code -> condition name (None if the code is not an HCC)
+        """
+        data = self.codes
+        return {code: data.get(code) for code in codes}
+
+    def __contains__(self, code):
+        return code in self.codes
+
+    def __len__(self):
+        return len(self.codes)
+
+
+class CompiledCodeIndex(HCCCodeIndex):
+    """
+    HCCCodeIndex over one code set of a compiled file (utils/hcc/codeset.py). Loading
+    it maps the file and reads its directory, without parsing the codes; the other
+    code sets of the file are never read. The file is reopened when it is replaced.
+
+    Args:
+        json_file_path (str): Path to the compiled file, i.e. HCC_relevant_codes.hccidx
+        version (str | None): The code set, the default one of the file if None
+        check_interval (float): Minimum seconds between two checks of the source file
+    """
+
+    def __init__(self, json_file_path, version=None, check_interval=1.0):
+        self.version = version
+        super().__init__(json_file_path, check_interval)
+
+    def _load(self):
+        """Map the compiled file, check the sha256 of the code set and swap it in if it changed."""
+        try:
+            stat = os.stat(self.json_file_path)
+            # Once per load or change of the file, so a corrupted block is never served
+            codes = CompiledCodeSet(self.json_file_path).version(self.version, verify=True)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Error: The file '{self.json_file_path}' was not found.")
+        if codes.sha256 != self._sha256:
+            self._codes = codes
+            self._sha256 = codes.sha256
+            self.reload_count += 1
+        self._mtime = stat.st_mtime_ns
+        self._last_check = time.monotonic()
+
+
+def configure_codeset(path=None, version=None):
+    """
+    Select the code set used by default in this process, i.e. by is_icd10_an_hcc().
+
+    Args:
+        path (str | None): HCC_relevant_codes.json or a compiled file, the JSON file if None
+        version (str | None): Code set of a compiled file, its default one if None
+
+    Returns:
+        index (HCCCodeIndex): The index of the selected code set
+    """
+    global _default_codeset
+    _default_codeset = (path or HCC_JSON_FILE_PATH, version or None)
+    return get_code_index()
+
+
+def default_codeset():
+    """The (path, version) selected with configure_codeset()"""
+    return _default_codeset
+
+
+def get_code_index(json_file_path=None, version=None):
+    """
+    Return the shared index of a code set, building it on first use.
+
+    Args:
+        json_file_path (str | None): Path to the HCC_relevant_codes.json file or to a
+            compiled code set file, the configured code set if None
+        version (str | None): Code set of a compiled file, the configured one if None
+
+    Returns:
+        index (HCCCodeIndex): The process-wide index for that file and version
+
+    Raises:
+        ValueError: If a version is requested from a JSON file
+    """
+    # An empty version (i.e. from an empty environment variable) is no version
+    version = version or None
+    if json_file_path is None:
+        json_file_path = _default_codeset[0]
+        version = version or _default_codeset[1]
+    key = (os.path.abspath(json_file_path), version)
+    index = _INDEXES.get(key)
+    if index is None:
+        with _INDEXES_LOCK:
+            index = _INDEXES.get(key)
+            if index is None:
+                if is_compiled_codeset(json_file_path):
+                    index = CompiledCodeIndex(json_file_path, version)
+                elif version is not None:
+                    raise ValueError(f"Error: The file '{json_file_path}' has no code set versions.")
+                else:
+                    index = HCCCodeIndex(json_file_path)
+                _INDEXES[key] = index
+    return index
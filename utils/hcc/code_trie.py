@@ -0,0 +1,190 @@
+import os
+import csv
+import threading
+from utils.hcc.code_index import get_code_index
+
+HCC_CSV_FILE_PATH = "HCC_relevant_codes.csv"
+
+# Process-wide registry of tries, one per resolved source file or per code set content
+_TRIES = {}
+_TRIES_LOCK = threading.Lock()
+
+
+def normalize_code(code):
+    """Upper-case ICD-10 code without the dot (i.e: e11.65 -> E1165)"""
+    return code.replace('.', '').strip().upper()
+
+
+def load_hcc_csv(csv_file_path=HCC_CSV_FILE_PATH):
+    """
+    Read HCC_relevant_codes.csv with a real CSV parser (descriptions may hold commas).
+
+    Args:
+        csv_file_path (str): Path to the CSV file, whose first row is the header
+
+    Returns:
+        codes (dict): dot-less code -> description
+    """
+    codes = {}
+    with open(csv_file_path, 'r', newline='') as csv_file:
+        reader = csv.reader(csv_file)
+        next(reader, None)
+        for row in reader:
+            if len(row) >= 2 and row[0].strip():
+                codes[normalize_code(row[0])] = row[1].strip()
+    return codes
+
+
+class ICD10Trie:
+    """
+    Prefix trie of the HCC relevant codes. Every query walks at most one node per
+    character of the code, whatever the size of the code set.
+
+    Nodes are integers indexing three parallel lists: the children of the node,
+    the description if the node is an HCC code, and the number of HCC codes
+    strictly below it.
+
+    Args:
+        codes (dict): dot-less code -> description, i.e. from load_hcc_csv()
+    """
+
+    def __init__(self, codes):
+        self._children = [{}]
+        self._names = [None]
+        self._below = [0]
+        for code, description in codes.items():
+            self._insert(normalize_code(code), description)
+
+    def _insert(self, code, description):
+        node = 0
+        path = []
+        for char in code:
+            path.append(node)
+            child = self._children[node].get(char)
+            if child is None:
+                child = len(self._names)
+                self._children[node][char] = child
+                self._children.append({})
+                self._names.append(None)
+                self._below.append(0)
+            node = child
+        if self._names[node] is None:
+            for ancestor in path:
+                self._below[ancestor] += 1
+        self._names[node] = description
+
+    def _walk(self, code):
+        """Return (node of the code or None, (code, description) of the nearest HCC proper prefix or None)"""
+        node = 0
+        ancestor = None
+        for depth, char in enumerate(code):
+            if depth and self._names[node] is not None:
+                ancestor = (code[:depth], self._names[node])
+            node = self._children[node].get(char)
+            if node is None:
+                return None, ancestor
+        return node, ancestor
+
+    def exact(self, code):
+        """
+        Args:
+            code (str): ICD-10 code, with or without the dot
+
+        Returns:
+            description (str | None): The HCC description, None if the code is not an HCC
+        """
+        node, _ = self._walk(normalize_code(code))
+        return self._names[node] if node is not None else None
+
+    def has_hcc_descendants(self, code):
+        """True if a more specific code than `code` is an HCC (i.e: E11.6 -> E11.65)"""
+        node, _ = self._walk(normalize_code(code))
+        return node is not None and self._below[node] > 0
+
+    def nearest_hcc_ancestor(self, code):
+        """
+        Returns:
+            ancestor (tuple | None): (code, description) of the longest HCC code that
+            is a proper prefix of `code`, None if there is none
+        """
+        _, ancestor = self._walk(normalize_code(code))
+        return ancestor
+
+    def lookup(self, code):
+        """
+        All the queries of a code in a single walk.
+
+        Returns:
+            result (dict): {
+                "condition_code": "<str>",
+                "condition_name": "<str>" (only for HCC codes),
+                "is_hcc": <boolean>,
+                "has_hcc_descendants": <boolean>,
+                "hcc_ancestor": "<str>" | None,
+            }
+        """
+        code = normalize_code(code)
+        node, ancestor = self._walk(code)
+        result = {"condition_code": code}
+        name = self._names[node] if node is not None else None
+        if name is not None:
+            result["condition_name"] = name
+        result["is_hcc"] = name is not None
+        result["has_hcc_descendants"] = node is not None and self._below[node] > 0
+        result["hcc_ancestor"] = ancestor[0] if ancestor else None
+        return result
+
+    def lookup_spans(self, code_spans):
+        """
+        Look up every ICD-10 candidate of a plan.
+
+        Args:
+            code_spans (iterable): (code, start, end) tuples, i.e. ScannedPlan.codes
+
+        Returns:
+            results (list of dict): lookup() of each code plus its "span": [start, end]
+        """
+        results = []
+        for code, start, end in code_spans:
+            result = self.lookup(code)
+            result["code"] = code
+            result["span"] = [start, end]
+            results.append(result)
+        return results
+
+    def __contains__(self, code):
+        return self.exact(code) is not None
+
+    def __len__(self):
+        return self._below[0] + (self._names[0] is not None)
+
+
+def get_code_trie(csv_file_path=None, version=None):
+    """
+    Return the shared ICD10Trie of a code set, building it on first use.
+
+    Args:
+        csv_file_path (str | None): Path to a CSV file such as HCC_relevant_codes.csv,
+            None for the code set of get_code_index(), so that the trie and is_hcc agree
+        version (str | None): Code set of a compiled file, the configured one if None
+
+    Returns:
+        trie (ICD10Trie): The process-wide trie for that file or code set; a new one is
+        built when the code index reloads a changed file
+    """
+    if csv_file_path is not None:
+        key = os.path.abspath(csv_file_path)
+        load = lambda: load_hcc_csv(csv_file_path)
+    else:
+        index = get_code_index(version=version)
+        codes = index.codes
+        key = (os.path.abspath(index.json_file_path), getattr(index, "version", None), index.sha256)
+        load = lambda: codes
+    trie = _TRIES.get(key)
+    if trie is None:
+        with _TRIES_LOCK:
+            trie = _TRIES.get(key)
+            if trie is None:
+                trie = ICD10Trie(load())
+                _TRIES[key] = trie
+    return trie
@@ -0,0 +1,245 @@
+import os
+import mmap
+import zlib
+import struct
+import hashlib
+from collections.abc import Mapping
+
+# File layout, little-endian:
+#   header     MAGIC, format version (u32), number of code sets (u32)
+#   directory  one entry per code set: name, offset, size, number of codes, sha256 of the block
+#   checksum   sha256 of the header and the directory
+#   blocks     one per code set: slot count (u32), code count (u32), the hash slots (u32 each,
+#              entry number + 1, 0 when empty), the entries (key offset u32, key length u16,
+#              value offset u32, value length u16) and the utf-8 strings
+MAGIC = b"HCCIDX\x00\x00"
+FORMAT_VERSION = 1
+COMPILED_EXTENSION = ".hccidx"
+_HEADER = struct.Struct("<8sII")
+_DIRECTORY_ENTRY = struct.Struct("<32sQQI32s")
+_BLOCK_HEADER = struct.Struct("<II")
+_SLOT = struct.Struct("<I")
+_ENTRY = struct.Struct("<IHIH")
+_CHECKSUM_SIZE = 32
+
+
+class CodeSetFormatError(ValueError):
+    """The file is not a compiled code set, or it is corrupted"""
+
+
+def _slot_count(count):
+    # Load factor of at most 0.5 keeps the probe sequences short
+    slots = 8
+    while slots < count * 2:
+        slots *= 2
+    return slots
+
+
+def _compile_block(codes):
+    keys = sorted(codes)
+    strings = bytearray()
+    entries = []
+    for key in keys:
+        key_bytes = key.encode("utf-8")
+        value_bytes = (codes[key] or "").encode("utf-8")
+        entries.append((len(strings), len(key_bytes), len(strings) + len(key_bytes), len(value_bytes)))
+        strings += key_bytes + value_bytes
+    slot_count = _slot_count(len(keys))
+    slots = [0] * slot_count
+    for number, key in enumerate(keys):
+        slot = zlib.crc32(key.encode("utf-8")) & (slot_count - 1)
+        while slots[slot]:
+            slot = (slot + 1) & (slot_count - 1)
+        slots[slot] = number + 1
+    return b"".join([
+        _BLOCK_HEADER.pack(slot_count, len(keys)),
+        struct.pack(f"<{slot_count}I", *slots),
+        b"".join(_ENTRY.pack(*entry) for entry in entries),
+        bytes(strings),
+    ])
+
+
+def compile_codesets(codesets, output_path):
+    """
+    Write several code sets (i.e. HCC model versions V24 and V28, or payment years)
+    into one compiled file. The file is replaced atomically.
+
+    Args:
+        codesets (dict): version name -> {dot-less code: description}, the first
+            version being the default one
+        output_path (str): The compiled file, i.e. HCC_relevant_codes.hccidx
+
+    Returns:
+        checksums (dict): version name -> sha256 of its block
+    """
+    if not codesets:
+        raise ValueError("At least one code set is required")
+    blocks = [(name, _compile_block(codes), len(codes)) for name, codes in codesets.items()]
+    offset = _HEADER.size + _DIRECTORY_ENTRY.size * len(blocks) + _CHECKSUM_SIZE
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, len(blocks))
+    directory = []
+    checksums = {}
+    for name, block, count in blocks:
+        encoded_name = name.encode("utf-8")
+        if len(encoded_name) > 32:
+            raise ValueError(f"Code set name {name!r} is longer than 32 bytes")
+        checksum = hashlib.sha256(block).digest()
+        directory.append(_DIRECTORY_ENTRY.pack(encoded_name, offset, len(block), count, checksum))
+        checksums[name] = checksum.hex()
+        offset += len(block)
+    head = header + b"".join(directory)
+
+    directory_name = os.path.dirname(output_path)
+    if directory_name:
+        os.makedirs(directory_name, exist_ok=True)
+    temporary_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'wb') as output_file:
+        output_file.write(head)
+        output_file.write(hashlib.sha256(head).digest())
+        for _, block, _ in blocks:
+            output_file.write(block)
+    os.replace(temporary_path, output_path)
+    return checksums
+
+
+def is_compiled_codeset(path):
+    """True if `path` starts with the magic bytes of a compiled code set"""
+    try:
+        with open(path, 'rb') as file:
+            return file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class CompiledCodeSet:
+    """
+    A compiled code set file, memory-mapped. Opening it only reads the directory: the
+    code sets are looked up in place, so a process only touches the pages of the
+    version it uses.
+
+    Args:
+        path (str): The compiled file
+
+    Raises:
+        CodeSetFormatError: If the file is not a compiled code set or its directory is corrupted
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mapped) < _HEADER.size:
+            raise CodeSetFormatError(f"{path} is not a compiled code set")
+        magic, format_version, count = _HEADER.unpack_from(self._mapped, 0)
+        if magic != MAGIC:
+            raise CodeSetFormatError(f"{path} is not a compiled code set")
+        if format_version != FORMAT_VERSION:
+            raise CodeSetFormatError(f"{path} has format version {format_version}, expected {FORMAT_VERSION}")
+        head_size = _HEADER.size + _DIRECTORY_ENTRY.size * count
+        if len(self._mapped) < head_size + _CHECKSUM_SIZE or \
+                hashlib.sha256(self._mapped[:head_size]).digest() != self._mapped[head_size:head_size + _CHECKSUM_SIZE]:
+            raise CodeSetFormatError(f"The directory of {path} is corrupted")
+        self._directory = {}
+        for number in range(count):
+            name, offset, size, codes, checksum = _DIRECTORY_ENTRY.unpack_from(
+                self._mapped, _HEADER.size + number * _DIRECTORY_ENTRY.size)
+            self._directory[name.rstrip(b"\0").decode("utf-8")] = (offset, size, codes, checksum.hex())
+
+    @property
+    def versions(self):
+        """Names of the code sets, the default one first"""
+        return list(self._directory)
+
+    def version(self, name=None, verify=False):
+        """
+        Args:
+            name (str | None): The code set, the default (first) one if None
+            verify (bool): Check the sha256 of its block first
+
+        Returns:
+            codes (CodeSetVersion): Read-only mapping of the code set
+
+        Raises:
+            KeyError: If the file has no such code set
+            CodeSetFormatError: If verify finds a corrupted block
+        """
+        name = name or self.versions[0]
+        if name not in self._directory:
+            raise KeyError(f"No code set {name!r} in {self.path}, available: {', '.join(self.versions)}")
+        offset, size, count, checksum = self._directory[name]
+        if offset + size > len(self._mapped):
+            raise CodeSetFormatError(f"The code set {name!r} of {self.path} is truncated")
+        if verify and hashlib.sha256(self._mapped[offset:offset + size]).hexdigest() != checksum:
+            raise CodeSetFormatError(f"The code set {name!r} of {self.path} is corrupted")
+        return CodeSetVersion(self._mapped, name, offset, count, checksum)
+
+    def verify(self):
+        """Check the checksum of every code set, raising CodeSetFormatError on a mismatch"""
+        for name in self.versions:
+            self.version(name, verify=True)
+
+
+class CodeSetVersion(Mapping):
+    """
+    Read-only code -> description mapping of one code set of a compiled file,
+    backed by its memory map. Looked up codes are memoized, so the codes of a
+    corpus are decoded once.
+    """
+
+    def __init__(self, mapped, name, offset, count, sha256):
+        self.name = name
+        self.sha256 = sha256
+        self._mapped = mapped
+        self._count = count
+        self._slot_count = _BLOCK_HEADER.unpack_from(mapped, offset)[0]
+        self._slots = offset + _BLOCK_HEADER.size
+        self._entries = self._slots + self._slot_count * _SLOT.size
+        self._strings = self._entries + count * _ENTRY.size
+        self._memo = {}
+
+    def _entry(self, number):
+        key_offset, key_length, value_offset, value_length = _ENTRY.unpack_from(
+            self._mapped, self._entries + number * _ENTRY.size)
+        strings = self._strings
+        return (self._mapped[strings + key_offset:strings + key_offset + key_length],
+                self._mapped[strings + value_offset:strings + value_offset + value_length])
+
+    def _find(self, code):
+        key = code.encode("utf-8")
+        mask = self._slot_count - 1
+        slot = zlib.crc32(key) & mask
+        while True:
+            number = _SLOT.unpack_from(self._mapped, self._slots + slot * _SLOT.size)[0]
+            if not number:
+                return None
+            stored_key, value = self._entry(number - 1)
+            if stored_key == key:
+                return value.decode("utf-8")
+            slot = (slot + 1) & mask
+
+    def get(self, code, default=None):
+        try:
+            value = self._memo[code]
+        except KeyError:
+            value = self._memo[code] = self._find(code)
+        return default if value is None else value
+
+    def __getitem__(self, code):
+        value = self.get(code)
+        if value is None:
+            raise KeyError(code)
+        return value
+
+    def __contains__(self, code):
+        return self.get(code) is not None
+
+    def __iter__(self):
+        for number in range(self._count):
+            yield self._entry(number)[0].decode("utf-8")
+
+    def __len__(self):
+        return self._count
+
+    def items(self):
+        return ((key.decode("utf-8"), value.decode("utf-8"))
+                for key, value in map(self._entry, range(self._count)))
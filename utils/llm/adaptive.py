@@ -0,0 +1,285 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from utils.llm.engine import is_retryable
+from utils.metrics.registry import get_registry
+
+# condition_data of a plan whose extraction failed: retried by the next run instead of kept
+DEFERRED_PREFIX = "Deferred: "
+DEFERRED_METRIC = "hcc_llm_deferred_total"
+CONCURRENCY_METRIC = "hcc_llm_concurrency_changes_total"
+CIRCUIT_METRIC = "hcc_llm_circuit_transitions_total"
+BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', '5'))
+BREAKER_RESET_SECONDS = float(os.getenv('LLM_BREAKER_RESET_SECONDS', '30'))
+
+# Circuit breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """The model calls are suspended after sustained failures"""
+
+
+class DeferredExtraction(Exception):
+    """The extraction of a plan failed; the plan is to be retried later, not recorded as empty"""
+
+
+def deferred_condition_data(reason):
+    """The condition_data marking a deferred plan, counted in hcc_llm_deferred_total"""
+    get_registry().increment(DEFERRED_METRIC)
+    return f"{DEFERRED_PREFIX}{reason}"
+
+
+def is_deferred(condition_data):
+    return isinstance(condition_data, str) and condition_data.startswith(DEFERRED_PREFIX)
+
+
+def has_deferred_plans(output):
+    """True if a note output (list of plan dictionaries or None) holds a deferred plan"""
+    return any(is_deferred(plan.get("condition_data")) for plan in output or [])
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit on the number of model calls in flight, as TCP congestion control: every
+    healthy call adds `increase` / limit (one more slot per window of healthy calls),
+    and an overload signal (429, 5xx or timeout) multiplies the limit by `decrease`.
+    A call is healthy when its latency stays within `latency_tolerance` times the
+    fastest latency of the last `latency_window` calls; slower calls leave the limit
+    unchanged. The window lets the baseline follow the model when it slows down for good,
+    instead of one fast early call holding the limit in place.
+
+    The calls started before a decrease do not decrease it again, so a burst of
+    concurrent 429 halves the limit once instead of collapsing it to the minimum.
+
+    Args:
+        initial (int): Starting limit
+        min_limit (int): Lower bound of the limit
+        max_limit (int): Upper bound of the limit, i.e. the size of the model pool
+        increase (float): Slots added per window of healthy calls
+        decrease (float): Factor applied to the limit on overload
+        latency_tolerance (float): Latency, relative to the fastest one, still healthy
+        latency_window (int): Number of recent successful calls the fastest latency is taken from
+    """
+
+    def __init__(self, initial=1, min_limit=1, max_limit=16, increase=1.0, decrease=0.5, latency_tolerance=2.0,
+                 latency_window=100):
+        if not 1 <= min_limit <= max_limit:
+            raise ValueError("Concurrency limits must satisfy 1 <= min_limit <= max_limit")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self._latencies = deque(maxlen=latency_window)
+        self._limit = float(min(max(initial, min_limit), max_limit))
+        self._last_decrease = float("-inf")
+        self._condition = threading.Condition()
+
+    @property
+    def min_latency(self):
+        """Fastest latency of the recent successful calls, None before the first one"""
+        return min(self._latencies, default=None)
+
+    @property
+    def limit(self):
+        """Number of calls allowed in flight"""
+        return int(self._limit)
+
+    def try_acquire(self):
+        """Take a slot if one is free, returning whether it was taken"""
+        with self._condition:
+            if self.in_flight < self.limit:
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        """Wait for a free slot and take it"""
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    async def aacquire(self):
+        """Async variant of acquire(): waits for a free slot without blocking the event loop"""
+        while not self.try_acquire():
+            await asyncio.sleep(0.01)
+
+    def release(self, started, error=None, adapt=True):
+        """
+        Give back a slot and adapt the limit to the outcome of the call.
+
+        Args:
+            started (float): time.monotonic() when the call started
+            error (Exception | None): The exception raised by the call
+            adapt (bool): False to leave the limit unchanged (i.e. cancelled call)
+        """
+        now = time.monotonic()
+        direction = None
+        with self._condition:
+            self.in_flight -= 1
+            if error is not None:
+                if adapt and is_retryable(error) and started >= self._last_decrease:
+                    self._limit = max(self.min_limit, self._limit * self.decrease)
+                    self._last_decrease = now
+                    direction = "down"
+            elif adapt:
+                latency = now - started
+                self._latencies.append(latency)
+                if latency <= self.min_latency * self.latency_tolerance and self._limit < self.max_limit:
+                    before = self.limit
+                    self._limit = min(self.max_limit, self._limit + self.increase / self._limit)
+                    direction = "up" if self.limit > before else None
+            self._condition.notify_all()
+        if direction is not None:
+            get_registry().increment(CONCURRENCY_METRIC, direction=direction)
+
+
+class CircuitBreaker:
+    """
+    Stops the model calls after `failure_threshold` consecutive failures. Once
+    `reset_seconds` have passed, a single probe call is let through (half-open): its
+    success closes the circuit, its failure opens it again.
+
+    Args:
+        failure_threshold (int): Consecutive failures opening the circuit
+        reset_seconds (float): Seconds the circuit stays open before the probe
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURES, reset_seconds=BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self._opened = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        self.state = state
+        get_registry().increment(CIRCUIT_METRIC, state=state)
+
+    def allow(self):
+        """True if a call may go through now"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened >= self.reset_seconds:
+                self._transition(HALF_OPEN)
+                self._probing = False
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+                return True
+            return self.state == CLOSED
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+
+    def abandon(self):
+        """The call let through was cancelled: the next one may probe"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self._opened = time.monotonic()
+                self._transition(OPEN)
+
+
+class CallController:
+    """
+    Guards the model calls with an AdaptiveConcurrency limit and a CircuitBreaker.
+    Only the overload signals (is_retryable: timeouts, 429 and 5xx) count as failures;
+    other errors (e.g. a 400 or a missing cassette) say nothing about the health of the
+    model and pass through without adapting the limit or tripping the breaker.
+
+    Args:
+        concurrency (AdaptiveConcurrency): The in-flight limit
+        breaker (CircuitBreaker | None): The breaker, a default one if None
+    """
+
+    def __init__(self, concurrency, breaker=None):
+        self.concurrency = concurrency
+        self.breaker = breaker or CircuitBreaker()
+
+    def _check(self):
+        if not self.breaker.allow():
+            raise CircuitOpenError("model calls suspended after repeated failures, retry later")
+
+    def _done(self, started, error=None):
+        if error is None:
+            self.concurrency.release(started)
+            self.breaker.record_success()
+        elif is_retryable(error):
+            self.concurrency.release(started, error)
+            self.breaker.record_failure()
+        else:
+            self._abandon(started)
+
+    def _abandon(self, started):
+        # Cancelled, interrupted or a non-retryable error: no signal about the health of the model
+        self.concurrency.release(started, adapt=False)
+        self.breaker.abandon()
+
+    @contextmanager
+    def slot(self):
+        """
+        Hold a slot for the duration of one model call.
+
+        Raises:
+            CircuitOpenError: If the circuit is open
+        """
+        self._check()
+        self.concurrency.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self._done(started, e)
+            raise
+        except BaseException:
+            self._abandon(started)
+            raise
+        self._done(started)
+
+    @asynccontextmanager
+    async def aslot(self):
+        """Async variant of slot()"""
+        self._check()
+        try:
+            await self.concurrency.aacquire()
+        except BaseException:
+            self.breaker.abandon()
+            raise
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self._done(started, e)
+            raise
+        except BaseException:
+            self._abandon(started)
+            raise
+        self._done(started)
+
+    def stats(self):
+        """
+        Returns:
+            stats (dict): limit, in_flight, min_latency and the circuit state
+        """
+        return {"limit": self.concurrency.limit, "in_flight": self.concurrency.in_flight,
+                "min_latency": self.concurrency.min_latency, "circuit": self.breaker.state}
@@ -0,0 +1,244 @@
+import os
+import re
+import json
+import math
+import time
+import random
+import asyncio
+import threading
+from langchain_core.runnables import RunnableLambda
+from utils.llm.cache import fingerprint
+from utils.llm.ratelimit import estimate_tokens
+from utils.regex.scanner import ICD10_PATTERN
+
+BATCH_BLOCK_PATTERN = re.compile(r"<<<PLAN (\d+)>>>\n(.*?)\n?<<<END PLAN \1>>>", re.DOTALL)
+# Status lines left out of the simulated extraction, like the prompt asks the model to
+STATUS_LINES = {"stable", "improving", "worsening", "unchanged", "new diagnosis", "controlled"}
+CASSETTE_MODES = ("replay", "record")
+# Cache keys of the simulated answers never collide with the ones of a real model
+SIMULATED_MODEL_FINGERPRINT = "simulated"
+
+
+class SimulatedLLMError(Exception):
+    """Error injected by SimulatedLLM, carrying an HTTP status code like the real clients"""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def prompt_text(prompt_value):
+    """The text of a rendered prompt (ChatPromptValue, StringPromptValue or str)"""
+    if isinstance(prompt_value, str):
+        return prompt_value
+    return prompt_value.to_string()
+
+
+def last_message_text(prompt_value):
+    """The text of the last (human) message of a rendered prompt, where the plans are"""
+    if hasattr(prompt_value, "to_messages"):
+        return prompt_value.to_messages()[-1].content
+    return prompt_text(prompt_value)
+
+
+def response_text(response):
+    """The text of a model response, whether the client is an LLM (str) or a chat model (message)"""
+    return response if isinstance(response, str) else response.content
+
+
+def simulated_extraction(assessment_plan):
+    """
+    Deterministic stand-in for the model's answer: the management lines of the plan,
+    without its heading, status and ICD-10 code lines.
+    """
+    lines = [line.strip() for line in assessment_plan.splitlines() if line.strip()]
+    kept = []
+    for line in lines[1:]:
+        if line.lower() in STATUS_LINES or ICD10_PATTERN.match(line):
+            continue
+        kept.append(line)
+    return "\n".join(kept)
+
+
+class SimulatedLLM:
+    """
+    Local model backend for offline load tests, usable wherever a model client is.
+
+    Each call waits for a latency drawn from a log-normal distribution, plus the time
+    needed to "generate" the answer at `tokens_per_second`, and may fail with an
+    injected 429 (before any latency, like a quota rejection) or 500 error. Batch
+    prompts (<<<PLAN i>>> blocks) get one answer block per plan.
+
+    Args:
+        latency (float): Median latency of a call, in seconds
+        latency_sigma (float): Sigma of the log-normal latency, 0 for a fixed latency
+        error_rate (float): Probability that a call fails with a 500 error
+        rate_limit_rate (float): Probability that a call fails with a 429 error
+        tokens_per_second (float | None): Output throughput, None for no throttling
+        seed (int | None): Seed of the latency and error draws
+    """
+
+    def __init__(self, latency=0.5, latency_sigma=0.5, error_rate=0.0, rate_limit_rate=0.0,
+                 tokens_per_second=None, seed=None):
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.tokens_per_second = tokens_per_second
+        self.random = random.Random(seed)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, environ=None):
+        """Build a SimulatedLLM from the LLM_SIM_* environment variables"""
+        environ = os.environ if environ is None else environ
+        tokens_per_second = float(environ.get('LLM_SIM_TOKENS_PER_SECOND', '0'))
+        seed = environ.get('LLM_SIM_SEED')
+        return cls(
+            latency=float(environ.get('LLM_SIM_LATENCY', '0.5')),
+            latency_sigma=float(environ.get('LLM_SIM_LATENCY_SIGMA', '0.5')),
+            error_rate=float(environ.get('LLM_SIM_ERROR_RATE', '0')),
+            rate_limit_rate=float(environ.get('LLM_SIM_RATE_LIMIT_RATE', '0')),
+            tokens_per_second=tokens_per_second or None,
+            seed=int(seed) if seed else None,
+        )
+
+    def respond(self, text):
+        """The answer to the human message of a prompt, without latency nor errors"""
+        blocks = BATCH_BLOCK_PATTERN.findall(text)
+        if blocks:
+            return "\n".join(f"<<<PLAN {number}>>>\n{simulated_extraction(plan)}\n<<<END PLAN {number}>>>"
+                             for number, plan in blocks)
+        # The plan follows the "Here is the assessment plan text:" line
+        return simulated_extraction(text.split("\n\n", 1)[-1] if "\n\n" in text else text)
+
+    def _draw(self, response):
+        # Returns (delay of the call, whether it ends with a 500), or raises the injected 429
+        with self._lock:
+            self.calls += 1
+            roll = self.random.random()
+            if roll < self.rate_limit_rate:
+                raise SimulatedLLMError("429 Resource exhausted (simulated)", 429)
+            delay = self.latency
+            if self.latency_sigma and self.latency > 0:
+                delay = self.random.lognormvariate(math.log(self.latency), self.latency_sigma)
+            failed = roll < self.rate_limit_rate + self.error_rate
+        if self.tokens_per_second:
+            delay += estimate_tokens(response) / self.tokens_per_second
+        return delay, failed
+
+    def invoke(self, prompt_value):
+        response = self.respond(last_message_text(prompt_value))
+        delay, failed = self._draw(response)
+        time.sleep(delay)
+        if failed:
+            raise SimulatedLLMError("500 Internal error (simulated)", 500)
+        return response
+
+    async def ainvoke(self, prompt_value):
+        response = self.respond(last_message_text(prompt_value))
+        delay, failed = self._draw(response)
+        await asyncio.sleep(delay)
+        if failed:
+            raise SimulatedLLMError("500 Internal error (simulated)", 500)
+        return response
+
+    def as_runnable(self):
+        """The backend as a runnable, to be piped between the prompt and the output parser"""
+        return RunnableLambda(self.invoke, afunc=self.ainvoke, name="simulated_llm")
+
+
+class CassetteMissError(LookupError):
+    """Raised in replay mode for a prompt that was never recorded"""
+
+
+class Cassette:
+    """
+    Record/replay store of model responses, keyed by the hash of the rendered prompt.
+
+    In "record" mode, prompts already on the cassette are replayed and the others go
+    to the wrapped model, their responses being appended to the file. In "replay"
+    mode the model is never called and an unknown prompt raises CassetteMissError,
+    so a run is deterministic and needs no network.
+
+    The file is JSONL, one {"key", "prompt", "response"} record per line.
+
+    Args:
+        path (str): The cassette file
+        mode (str): "replay" or "record"
+    """
+
+    def __init__(self, path, mode="replay"):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Unknown cassette mode {mode!r}, expected one of {CASSETTE_MODES}")
+        self.path = path
+        self.mode = mode
+        self.responses = {}
+        self.hits = 0
+        self.recorded = 0
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r') as cassette_file:
+                for line in cassette_file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.responses[record["key"]] = record["response"]
+
+    @staticmethod
+    def key(text):
+        return fingerprint(text)
+
+    def lookup(self, text):
+        """The recorded response of a rendered prompt, or None"""
+        response = self.responses.get(self.key(text))
+        if response is not None:
+            with self._lock:
+                self.hits += 1
+        elif self.mode == "replay":
+            raise CassetteMissError(f"Prompt {self.key(text)[:12]} is not on the cassette {self.path}")
+        return response
+
+    def record(self, text, response):
+        """Append a response to the cassette"""
+        key = self.key(text)
+        with self._lock:
+            self.responses[key] = response
+            self.recorded += 1
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a') as cassette_file:
+                cassette_file.write(json.dumps({"key": key, "prompt": text, "response": response},
+                                               ensure_ascii=False) + "\n")
+
+    def wrap(self, model=None):
+        """
+        Args:
+            model (Runnable | None): The real model client, only needed in record mode
+
+        Returns:
+            runnable (RunnableLambda): Replays the cassette, recording `model` on misses
+        """
+        if model is None and self.mode == "record":
+            raise ValueError("Record mode needs the model to record")
+
+        def invoke(prompt_value):
+            text = prompt_text(prompt_value)
+            response = self.lookup(text)
+            if response is None:
+                response = response_text(model.invoke(prompt_value))
+                self.record(text, response)
+            return response
+
+        async def ainvoke(prompt_value):
+            text = prompt_text(prompt_value)
+            response = self.lookup(text)
+            if response is None:
+                response = response_text(await model.ainvoke(prompt_value))
+                self.record(text, response)
+            return response
+
+        return RunnableLambda(invoke, afunc=ainvoke, name="cassette")
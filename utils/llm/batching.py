@@ -0,0 +1,79 @@
+import re
+from utils.llm.ratelimit import estimate_tokens
+
+# Tokens taken by the delimiters around each plan
+PLAN_OVERHEAD_TOKENS = 12
+
+_BATCH_RESPONSE_PATTERN = re.compile(r"<<<PLAN (\d+)>>>[ \t]*\n?(.*?)<<<END PLAN \1>>>", re.DOTALL)
+
+
+class BatchParseError(ValueError):
+    """Raised when a batch response cannot be split back into plans"""
+
+
+def pack_plans(plans, token_budget=4000, max_batch_size=None):
+    """
+    Group plans into batches whose estimated token count fits in `token_budget`.
+
+    A plan larger than the budget gets a batch of its own.
+
+    Args:
+        plans (list of str): The individual assessment plans
+        token_budget (int): Maximum estimated tokens of the plans of one batch
+        max_batch_size (int | None): Maximum number of plans in one batch
+
+    Returns:
+        batches (list of list of int): Indexes of `plans`, in order, grouped by batch
+    """
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for index, plan in enumerate(plans):
+        tokens = estimate_tokens(plan) + PLAN_OVERHEAD_TOKENS
+        full = batch_tokens + tokens > token_budget or (max_batch_size and len(batch) >= max_batch_size)
+        if batch and full:
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(index)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def render_batch(plans):
+    """
+    Join several plans into one text, each one wrapped in numbered delimiters.
+
+    Args:
+        plans (list of str): The plans of the batch
+
+    Returns:
+        text (str): The plans as `<<<PLAN i>>>` ... `<<<END PLAN i>>>` blocks
+    """
+    return "\n\n".join(f"<<<PLAN {i}>>>\n{plan}\n<<<END PLAN {i}>>>" for i, plan in enumerate(plans))
+
+
+def parse_batch_response(text, count):
+    """
+    Split a batch response back into the extracted text of each plan.
+
+    Args:
+        text (str): The model response
+        count (int): Number of plans sent in the batch
+
+    Returns:
+        extracted (dict): plan position -> extracted text, only for the plans found
+
+    Raises:
+        BatchParseError: If no delimited block is found in the response
+    """
+    extracted = {}
+    for match in _BATCH_RESPONSE_PATTERN.finditer(text or ""):
+        position = int(match.group(1))
+        if position < count and position not in extracted:
+            extracted[position] = match.group(2).strip()
+    if not extracted:
+        raise BatchParseError("The batch response has no delimited plans")
+    return extracted
@@ -0,0 +1,158 @@
+import re
+import time
+import hashlib
+import threading
+from utils.sqlite_local import LocalConnection
+from utils.metrics.registry import get_registry
+
+_WHITESPACE = re.compile(r"[ \t]+")
+
+
+def normalize_plan(text):
+    """
+    Normalize an assessment plan so that copies differing only in whitespace share a key.
+
+    Args:
+        text (str): The assessment plan
+
+    Returns:
+        text (str): The plan with trimmed lines, collapsed blanks and no empty lines
+    """
+    lines = (_WHITESPACE.sub(" ", line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def fingerprint(*parts):
+    """sha256 hex digest of the given strings"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def cache_key(assessment_plan, prompt_fingerprint, model_fingerprint):
+    """
+    Content-addressed key of an LLM extraction.
+
+    Args:
+        assessment_plan (str): The plan sent to the model
+        prompt_fingerprint (str): Hash of the extraction prompt
+        model_fingerprint (str): Model name and parameters
+
+    Returns:
+        key (str): sha256 hex digest
+    """
+    return fingerprint(normalize_plan(assessment_plan), prompt_fingerprint, model_fingerprint)
+
+
+class ConditionDataCache:
+    """
+    Persistent SQLite cache of the LLM extraction results, shared by threads and
+    worker processes (WAL journal and a busy timeout serialize the writers).
+
+    Entries older than `max_age` seconds are dropped, and beyond `max_entries` the
+    least recently used ones are evicted. Eviction runs every `evict_every` writes.
+
+    Args:
+        path (str): The SQLite database file
+        max_entries (int): Maximum number of entries kept
+        max_age (float | None): Maximum age of an entry in seconds, None to keep them forever
+        evict_every (int): Number of writes between two evictions
+    """
+
+    def __init__(self, path, max_entries=100000, max_age=30 * 24 * 3600, evict_every=100):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._connections = LocalConnection(path, ("journal_mode=WAL", "synchronous=NORMAL"), timeout=30)
+        self._counters_lock = threading.Lock()
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+    def _connection(self):
+        return self._connections.get()
+
+    def get(self, key):
+        """
+        Args:
+            key (str): Key built with cache_key()
+
+        Returns:
+            value (str | None): The cached extraction, None on a miss or an expired entry
+        """
+        now = time.time()
+        with self._connection() as connection:
+            row = connection.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.max_age is not None and now - row[1] > self.max_age:
+                connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+            if row is not None:
+                connection.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        with self._counters_lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        get_registry().increment("hcc_llm_cache_lookups_total", result="miss" if row is None else "hit")
+        return row[0] if row is not None else None
+
+    def set(self, key, value):
+        """Store the extraction `value` under `key`"""
+        now = time.time()
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO entries (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+        with self._counters_lock:
+            self._writes += 1
+            evict = self._writes % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Drop the expired entries, then the least recently used ones above max_entries.
+
+        Returns:
+            count (int): Number of entries removed
+        """
+        removed = 0
+        with self._connection() as connection:
+            if self.max_age is not None:
+                removed += connection.execute("DELETE FROM entries WHERE created < ?",
+                                              (time.time() - self.max_age,)).rowcount
+            excess = connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+            if excess > 0:
+                removed += connection.execute(
+                    "DELETE FROM entries WHERE key IN "
+                    "(SELECT key FROM entries ORDER BY accessed LIMIT ?)", (excess,)
+                ).rowcount
+        return removed
+
+    def stats(self):
+        """
+        Returns:
+            stats (dict): entries, hits, misses and hit_rate of this process
+        """
+        entries = self._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def __len__(self):
+        return self.stats()["entries"]
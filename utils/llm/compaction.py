@@ -0,0 +1,101 @@
+from typing import NamedTuple
+from utils.llm.ratelimit import estimate_tokens
+from utils.llm.rules import RuleExtractor, CONFIDENCE, normalize_line
+from utils.metrics.registry import get_registry
+
+# Rules whose lines the extraction prompt tells the model to ignore; they are removed
+# from the prompt only when the rule is certain (a line made of a code, a status or vitals)
+DROPPED_RULES = ("icd10", "status", "vitals")
+PROMPT_TOKENS_METRIC = "hcc_llm_plan_tokens_total"
+
+_extractor = RuleExtractor()
+
+
+class CompactedPlan(NamedTuple):
+    """
+    An assessment plan without the lines the model would drop anyway.
+
+    line_map holds, for every line of text, its index in assessment_plan.splitlines(),
+    so the lines returned by the model can be traced back to the original plan.
+    """
+    text: str
+    line_map: tuple
+    original_tokens: int
+    compacted_tokens: int
+
+
+def compact_plan(assessment_plan, extractor=None):
+    """
+    Remove the ICD-10 code lines, status lines and vitals of a plan before the LLM call.
+    The heading is kept: it gives the model the condition the lines refer to.
+
+    Args:
+        assessment_plan (str): An individual assessment plan
+        extractor (RuleExtractor | None): The rule engine classifying the lines
+
+    Returns:
+        compacted (CompactedPlan): The text to send, with its line mapping
+    """
+    extractor = extractor or _extractor
+    kept = []
+    line_map = []
+    for index, line in enumerate(assessment_plan.splitlines()):
+        if not line.strip():
+            continue
+        if line_map:
+            decision = extractor.classify(line)
+            if decision.rule in DROPPED_RULES and decision.confidence >= CONFIDENCE["vitals"]:
+                continue
+        kept.append(line)
+        line_map.append(index)
+    text = "\n".join(kept)
+    return CompactedPlan(text, tuple(line_map), estimate_tokens(assessment_plan), estimate_tokens(text))
+
+
+def record_savings(compacted):
+    """Count the plan tokens before and after compaction in the metrics registry"""
+    registry = get_registry()
+    registry.increment(PROMPT_TOKENS_METRIC, compacted.original_tokens, stage="original")
+    registry.increment(PROMPT_TOKENS_METRIC, compacted.compacted_tokens, stage="compacted")
+
+
+def token_savings(registry=None):
+    """
+    Returns:
+        savings (dict): original and compacted plan tokens of the run, and the saved
+        fraction (None before the first compaction)
+    """
+    registry = registry or get_registry()
+    original = registry.counter(PROMPT_TOKENS_METRIC, stage="original")
+    compacted = registry.counter(PROMPT_TOKENS_METRIC, stage="compacted")
+    return {"original_tokens": original, "compacted_tokens": compacted,
+            "saved_fraction": 1 - compacted / original if original else None}
+
+
+def source_lines(extracted_lines, assessment_plan, line_map=None):
+    """
+    Trace the lines returned by the model to the lines of the original plan.
+
+    Args:
+        extracted_lines (list of str): The condition_data lines
+        assessment_plan (str): The original plan
+        line_map (tuple | None): CompactedPlan.line_map of the text sent to the model,
+            None if the plan was sent as is
+
+    Returns:
+        indexes (list of int | None): For every extracted line, the index of its line in
+        assessment_plan.splitlines(), None if it cannot be found
+    """
+    original = assessment_plan.splitlines()
+    candidates = line_map if line_map is not None else range(len(original))
+    normalized = [(index, normalize_line(original[index])) for index in candidates]
+    indexes = []
+    for line in extracted_lines:
+        target = normalize_line(line)
+        match = None
+        if target:
+            match = next((index for index, text in normalized if text == target), None)
+            if match is None:
+                match = next((index for index, text in normalized if target in text), None)
+        indexes.append(match)
+    return indexes
@@ -0,0 +1,132 @@
+import asyncio
+import random
+from utils.llm.ratelimit import RateLimiter, estimate_tokens
+from utils.metrics.registry import get_registry
+
+RETRYABLE_STATUS_CODES = {408, 429}
+
+
+def error_status_code(error):
+    """
+    Get the HTTP status code carried by an exception raised by the model client.
+
+    Args:
+        error (Exception): The exception raised by the call
+
+    Returns:
+        status_code (int | None): The status code if the error exposes one
+    """
+    for attribute in ("status_code", "code", "status"):
+        value = getattr(error, attribute, None)
+        if callable(value):
+            continue
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    if response is not None and isinstance(getattr(response, "status_code", None), int):
+        return response.status_code
+    return None
+
+
+def is_retryable(error):
+    """True for timeouts, 429 (quota) and 5xx (server) errors"""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return True
+    status_code = error_status_code(error)
+    if status_code is None:
+        return False
+    return status_code in RETRYABLE_STATUS_CODES or 500 <= status_code < 600
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=60.0):
+    """
+    Exponential backoff with full jitter.
+
+    Args:
+        attempt (int): Number of the failed attempt, starting at 0
+        base_delay (float): Delay of the first retry, in seconds
+        max_delay (float): Upper bound of the delay, in seconds
+
+    Returns:
+        delay (float): Seconds to wait before the next attempt
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+class AsyncExtractionEngine:
+    """
+    Runs an async plan -> condition_data function with bounded concurrency,
+    requests/tokens-per-minute rate limiting, per-plan timeouts and jittered
+    exponential backoff on 429, 5xx and timeout errors.
+
+    Args:
+        evaluate (coroutine function): plan -> condition_data, i.e. LangGraphPipeline.aevaluate
+        concurrency (int): Maximum number of plans in flight
+        rpm (int | None): Requests per minute quota
+        tpm (int | None): Tokens per minute quota
+        timeout (float | None): Seconds allowed for each attempt of a plan
+        max_retries (int): Retries after the first attempt
+        base_delay (float): Backoff delay of the first retry, in seconds
+        max_delay (float): Upper bound of the backoff delay, in seconds
+        prompt_tokens (int): Tokens of every request besides the plan, i.e. the system prompt
+
+    The tokens quota is charged before each attempt for the prompt and the plan, plus a
+    completion as long as the plan (condition_data lines are taken from it), then
+    reconciled with the length of the completion received. The quotas suit an evaluate
+    function calling the model on every attempt; LangGraphPipeline charges its own
+    limiter instead, skipping the plans answered from its cache.
+    """
+
+    def __init__(self, evaluate, concurrency=8, rpm=None, tpm=None, timeout=60.0,
+                 max_retries=5, base_delay=1.0, max_delay=60.0, prompt_tokens=0):
+        if concurrency < 1:
+            raise ValueError("Concurrency must be at least 1")
+        self.evaluate = evaluate
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rpm, tpm)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.prompt_tokens = prompt_tokens
+        self.retries = 0
+        self._semaphore = None
+
+    async def extract(self, assessment_plan):
+        """
+        Get the condition_data of one plan, retrying transient errors.
+
+        Raises:
+            Exception: The last error once the retries are exhausted, or any
+            non-retryable error
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            attempt = 0
+            request_tokens = self.prompt_tokens + estimate_tokens(assessment_plan)
+            charged = request_tokens + estimate_tokens(assessment_plan)
+            while True:
+                await self.limiter.acquire(charged)
+                try:
+                    condition_data = await asyncio.wait_for(self.evaluate(assessment_plan), self.timeout)
+                    self.limiter.reconcile(charged, request_tokens + estimate_tokens(condition_data or ""))
+                    return condition_data
+                except Exception as e:
+                    if attempt >= self.max_retries or not is_retryable(e):
+                        raise
+                    self.retries += 1
+                    get_registry().increment("hcc_llm_retries_total", status=str(error_status_code(e) or type(e).__name__))
+                    await asyncio.sleep(backoff_delay(attempt, self.base_delay, self.max_delay))
+                    attempt += 1
+
+    async def extract_many(self, assessment_plans):
+        """
+        Get the condition_data of several plans concurrently.
+
+        Returns:
+            results (list): condition_data per plan, in order, or the exception
+            raised for that plan
+        """
+        return await asyncio.gather(*(self.extract(plan) for plan in assessment_plans),
+                                    return_exceptions=True)
@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+
+def estimate_tokens(text):
+    """
+    Rough token count of a text (about 4 characters per token for English prose).
+
+    Args:
+        text (str): The text sent to or received from the model
+
+    Returns:
+        tokens (int): The estimated number of tokens, at least 1
+    """
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    """
+    Asyncio token bucket refilled continuously at `rate` tokens per second.
+
+    Args:
+        capacity (float): Maximum number of tokens the bucket holds (the burst size)
+        rate (float): Tokens added per second
+    """
+
+    def __init__(self, capacity, rate):
+        if capacity <= 0 or rate <= 0:
+            raise ValueError("Token bucket capacity and rate must be positive")
+        self.capacity = capacity
+        self.rate = rate
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount=1):
+        """
+        Wait until `amount` tokens are available and take them. Requests larger than
+        the capacity are clamped to it, otherwise they could never be served.
+        """
+        amount = min(amount, self.capacity)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # The lock keeps the waiters in FIFO order
+        async with self._lock:
+            self._refill()
+            while self._tokens < amount:
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= amount
+
+    def adjust(self, amount):
+        """
+        Correct a past acquire() by `amount` tokens once the real usage is known: a
+        positive amount takes more (the bucket may go below zero, delaying the next
+        waiters), a negative one gives tokens back.
+        """
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens - amount)
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute quotas enforced with two token buckets.
+
+    Args:
+        rpm (int | None): Requests per minute, None for no limit
+        tpm (int | None): Tokens per minute, None for no limit
+    """
+
+    def __init__(self, rpm=None, tpm=None):
+        self.requests = TokenBucket(rpm, rpm / 60) if rpm else None
+        self.tokens = TokenBucket(tpm, tpm / 60) if tpm else None
+
+    async def acquire(self, tokens=1):
+        """Wait for one request slot and `tokens` tokens of quota"""
+        if self.requests is not None:
+            await self.requests.acquire(1)
+        if self.tokens is not None:
+            await self.tokens.acquire(tokens)
+
+    def reconcile(self, charged, used):
+        """Correct the tokens quota charged for a request with the tokens it used"""
+        if self.tokens is not None:
+            self.tokens.adjust(used - charged)
@@ -0,0 +1,209 @@
+import re
+import json
+from typing import NamedTuple
+from utils.regex.scanner import ICD10_PATTERN
+from utils.metrics.registry import get_registry
+
+# Lines made only of a status, which the extraction prompt excludes
+STATUS_WORDS = (
+    "stable", "unchanged", "improving", "improved", "worsening", "worse", "better", "controlled",
+    "uncontrolled", "well controlled", "resolved", "resolving", "new diagnosis", "new", "chronic",
+    "no issues", "no relapses", "no changes", "no complaints",
+)
+# Management, medication, counseling, testing and referral vocabulary
+KEEP_WORDS = (
+    r"continue[sd]?", r"start(?:ed)?", r"initiate[sd]?", r"stop(?:ped)?", r"discontinue[sd]?",
+    r"increase[sd]?", r"decrease[sd]?", r"reduce[sd]?", r"titrate[sd]?", r"take", r"use", r"inject",
+    r"apply", r"maintain", r"recommend(?:s|ed)?", r"encourage[sd]?", r"counsel(?:ed|led|ing)?",
+    r"educate[sd]?", r"education", r"discuss(?:ed)?", r"advise[sd]?", r"refer(?:red|ral)?",
+    r"follow[- ]?up", r"f/u", r"schedule[sd]?", r"order(?:ed)?", r"check(?:s|ed)?", r"recheck",
+    r"monitor(?:ing)?", r"track", r"test(?:s|ing)?", r"labs?", r"panel", r"consult", r"therapy",
+    r"diet(?:ary)?", r"exercises?", r"activity", r"avoid", r"include", r"consider", r"plan",
+    r"next", r"supplementation", r"mg", r"mcg", r"units?", r"tablets?", r"daily", r"bid", r"tid",
+    r"qid", r"prn", r"as needed", r"inhaler", r"regimen", r"medications?", r"meds", r"weight loss",
+    r"lifestyle", r"specialist", r"appointments?", r"ophthalmology", r"cardiology", r"vaccine",
+)
+# Vital signs and point-of-care values (i.e. "BP: 140/80", "SPO2-98%", "Wt 259 lbs"). A ratio
+# is a blood pressure only next to a keyword: "Losartan-HCTZ 100/25" and "Advair 250/50" are doses
+VITALS_PATTERN = re.compile(
+    r"^(?:bp|blood pressure|spo2|o2 sat|hr|heart rate|rr|temp|t|wt|weight|bmi|a1c|egfr)\b[^a-z]*\d"
+    r"|\b(?:bp|blood pressure)\b[^/]*?\b\d{2,3}/\d{2,3}\b|\bspo2\W*\d+\s*%|\b\d+(?:\.\d+)?\s*(?:lbs|kg|bpm|mmhg)\b",
+    re.IGNORECASE,
+)
+STATUS_PATTERN = re.compile(r"^(?:" + "|".join(re.escape(word) for word in STATUS_WORDS) + r")\b\W*",
+                            re.IGNORECASE)
+KEEP_PATTERN = re.compile(r"\b(?:" + "|".join(KEEP_WORDS) + r")\b", re.IGNORECASE)
+# List bullets and stray quotes around a line
+BULLET_PATTERN = re.compile(r'^[\s\-–•*"]+|[\s"]+$')
+
+# Confidence of each rule: how sure it is that the model would treat the line the same way
+CONFIDENCE = {
+    "heading": 1.0,
+    "icd10": 0.99,
+    "status": 0.95,
+    "vitals": 0.9,
+    "keep": 0.9,
+    "mixed": 0.5,
+    "unknown": 0.3,
+}
+
+
+class LineDecision(NamedTuple):
+    """The rule applied to a line of a plan"""
+    text: str
+    keep: bool
+    rule: str
+    confidence: float
+
+
+class RuleResult(NamedTuple):
+    """
+    Rule-based extraction of an assessment plan.
+
+    condition_data has the format of the LangGraph pipeline (a JSON list of lines),
+    lines are the kept lines, and confidence the lowest confidence of the line rules.
+    """
+    condition_data: str
+    lines: list
+    confidence: float
+    decisions: list
+
+
+class RuleExtractor:
+    """
+    Deterministic condition_data extractor applying the rules of the extraction prompt
+    with compiled lexicons and patterns: medication, counseling, management, testing
+    and referral lines are kept; the heading, ICD-10 code lines, statuses and vitals
+    are dropped. Lines matching no rule, or rules that disagree, lower the confidence,
+    so that those plans can be sent to the LLM instead.
+    """
+
+    def classify(self, line):
+        """
+        Args:
+            line (str): A line of the plan body (not its heading)
+
+        Returns:
+            decision (LineDecision): Whether the line is kept, by which rule
+        """
+        text = BULLET_PATTERN.sub("", line)
+        if ICD10_PATTERN.match(text) and ":" in text[:10]:
+            return LineDecision(text, False, "icd10", CONFIDENCE["icd10"])
+        status = STATUS_PATTERN.match(text)
+        rest = text[status.end():] if status else text
+        if status and not rest:
+            return LineDecision(text, False, "status", CONFIDENCE["status"])
+        keep = KEEP_PATTERN.search(rest) is not None
+        vitals = VITALS_PATTERN.search(rest) is not None
+        if status or (keep and vitals):
+            # Management mixed with a status or a measurement: the model may keep part of it
+            return LineDecision(text, keep, "mixed", CONFIDENCE["mixed"])
+        if vitals:
+            return LineDecision(text, False, "vitals", CONFIDENCE["vitals"])
+        if keep:
+            return LineDecision(text, True, "keep", CONFIDENCE["keep"])
+        return LineDecision(text, False, "unknown", CONFIDENCE["unknown"])
+
+    def extract(self, assessment_plan):
+        """
+        Args:
+            assessment_plan (str): An individual assessment plan
+
+        Returns:
+            result (RuleResult): The extraction and its confidence
+        """
+        lines = [line.strip() for line in assessment_plan.splitlines() if line.strip()]
+        decisions = [LineDecision(lines[0], False, "heading", CONFIDENCE["heading"])] if lines else []
+        decisions += [self.classify(line) for line in lines[1:]]
+        kept = [decision.text for decision in decisions if decision.keep and decision.text]
+        confidence = min((decision.confidence for decision in decisions), default=1.0)
+        condition_data = json.dumps(kept, indent=2) if kept else "[]"
+        return RuleResult(condition_data, kept, confidence, decisions)
+
+    def __call__(self, assessment_plan):
+        return self.extract(assessment_plan).condition_data
+
+
+def apply_rules(records, extractor, threshold):
+    """
+    Resolve with the rules the HCC records whose extraction is confident enough, leaving
+    the others to the LLM stage.
+
+    Args:
+        records (list of PlanRecord | None): The records of a note
+        extractor (RuleExtractor): The rule engine
+        threshold (float): Minimum confidence to skip the LLM, 0 for rules only, above 1
+            for the LLM only
+
+    Returns:
+        records (list of PlanRecord | None): The same records
+    """
+    if records is None:
+        return None
+    registry = get_registry()
+    for record in records:
+        if record.needs_llm:
+            result = extractor.extract(record.plan)
+            if result.confidence >= threshold:
+                record.resolve(result.condition_data)
+                registry.increment("hcc_condition_data_total", source="rules")
+            else:
+                registry.increment("hcc_condition_data_total", source="llm")
+    return records
+
+
+def normalize_line(line):
+    """A line without case, punctuation or whitespace, to match rule and model lines"""
+    return re.sub(r"[\W_]+", "", line).lower()
+
+
+def condition_data_lines(condition_data):
+    """The lines of a condition_data JSON list, [] if it is not one (i.e. an error message)"""
+    try:
+        lines = json.loads(condition_data)
+    except (TypeError, ValueError):
+        return []
+    return [line for line in lines if isinstance(line, str)] if isinstance(lines, list) else []
+
+
+def agreement_report(assessment_plans, llm_outputs, extractor=None, thresholds=(0.5, 0.8, 0.9)):
+    """
+    Compare the rule-based extractions with the LLM ones on a sample of plans.
+
+    Lines are compared ignoring case, spaces and punctuation.
+
+    Args:
+        assessment_plans (list of str): The plans
+        llm_outputs (list of str): condition_data returned by the LLM for each plan
+        extractor (RuleExtractor | None): The rule engine, a new one by default
+        thresholds (iterable of float): Confidence thresholds to evaluate
+
+    Returns:
+        report (dict): plans, exact_agreement, mean_jaccard, and for every threshold
+        the share of plans the rules would resolve and their agreement with the LLM
+    """
+    extractor = extractor or RuleExtractor()
+    rows = []
+    for assessment_plan, llm_output in zip(assessment_plans, llm_outputs):
+        result = extractor.extract(assessment_plan)
+        rule_lines = {normalize_line(line) for line in result.lines}
+        llm_lines = {normalize_line(line) for line in condition_data_lines(llm_output)}
+        union = rule_lines | llm_lines
+        jaccard = len(rule_lines & llm_lines) / len(union) if union else 1.0
+        rows.append((result.confidence, rule_lines == llm_lines, jaccard))
+
+    def summarize(selected):
+        return {
+            "plans": len(selected),
+            "exact_agreement": sum(exact for _, exact, _ in selected) / len(selected) if selected else None,
+            "mean_jaccard": sum(jaccard for _, _, jaccard in selected) / len(selected) if selected else None,
+        }
+
+    report = summarize(rows)
+    report["thresholds"] = {}
+    for threshold in thresholds:
+        selected = [row for row in rows if row[0] >= threshold]
+        by_rules = summarize(selected)
+        by_rules["share"] = len(selected) / len(rows) if rows else None
+        report["thresholds"][str(threshold)] = by_rules
+    return report
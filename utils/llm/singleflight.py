@@ -0,0 +1,132 @@
+import asyncio
+import threading
+from utils.metrics.registry import get_registry
+
+COALESCED_METRIC = "hcc_llm_coalesced_total"
+
+
+class _Call:
+    """An in-flight call and the callers waiting for it"""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key, for threads: the first caller runs
+    the function, the others block until it finishes and receive the same result, or
+    the same exception. The key is forgotten as soon as the call ends, so a failed
+    call is retried by the next caller instead of being remembered.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def in_flight(self):
+        """Number of keys being computed"""
+        with self._lock:
+            return len(self._calls)
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        Args:
+            key (hashable): Identifies the call, i.e. the cache key of a plan
+            function (callable): The call to run once per key in flight
+            *args, **kwargs: Arguments of function
+
+        Returns:
+            result: The result of the call, shared by every caller with the same key
+
+        Raises:
+            Exception: The exception raised by the call, in every caller
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            get_registry().increment(COALESCED_METRIC, mode="thread")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+        except BaseException as e:
+            # BaseException (i.e. KeyboardInterrupt) too, so the waiters never hang
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class AsyncSingleFlight:
+    """
+    Coalesces concurrent coroutine calls with the same key. The call runs in its own
+    task that every caller awaits through asyncio.shield: cancelling one caller does
+    not cancel the others, and the task is only cancelled when every caller is gone.
+    Keys are scoped to the running event loop.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    def in_flight(self):
+        """Number of keys being computed"""
+        return len(self._calls)
+
+    async def do(self, key, function, *args, **kwargs):
+        """
+        Args:
+            key (hashable): Identifies the call, i.e. the cache key of a plan
+            function (callable): Coroutine function to run once per key in flight
+            *args, **kwargs: Arguments of function
+
+        Returns:
+            result: The result of the call, shared by every caller with the same key
+
+        Raises:
+            Exception: The exception raised by the call, in every caller
+            asyncio.CancelledError: If this caller is cancelled
+        """
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+        entry = self._calls.get(flight_key)
+        if entry is None:
+            task = loop.create_task(function(*args, **kwargs))
+            entry = self._calls[flight_key] = [task, 0]
+            task.add_done_callback(lambda _: self._forget(flight_key, task))
+        else:
+            get_registry().increment(COALESCED_METRIC, mode="async")
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and entry[1] == 1:
+                # The last caller left: nobody needs the result anymore, and new
+                # callers must not join the cancelled task
+                task.cancel()
+                self._forget(flight_key, task)
+            raise
+        finally:
+            entry[1] -= 1
+
+    def _forget(self, flight_key, task):
+        entry = self._calls.get(flight_key)
+        if entry is not None and entry[0] is task:
+            del self._calls[flight_key]
+        if task.done() and not task.cancelled():
+            # Mark the exception as retrieved when every caller was cancelled
+            task.exception()
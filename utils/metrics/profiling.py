@@ -0,0 +1,258 @@
+import os
+import re
+import sys
+import json
+import time
+import threading
+from collections import Counter, defaultdict
+from functools import lru_cache
+from utils.metrics.tracing import configure_memory_tracking
+
+PROFILE_FILE = "profile.folded"
+REPORT_FILE = "report.json"
+TRACE_FILE = "trace.jsonl"
+DEFAULT_INTERVAL = 0.005
+# Spans timing a whole note, the other spans of the note are its layers
+NOTE_SPANS = ("deterministic_layers", "llm_stage")
+
+_profiler = None
+
+
+@lru_cache(maxsize=None)
+def _short_path(filename):
+    # Paths relative to the project or to site-packages, file names for the standard library
+    marker = "site-packages" + os.sep
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    try:
+        relative = os.path.relpath(filename)
+    except ValueError:
+        return filename
+    return os.path.basename(filename) if relative.startswith("..") else relative
+
+
+@lru_cache(maxsize=None)
+def _frame_label(code):
+    return f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _thread_label(name):
+    # "Thread-3 (_work)" and "Thread-4 (_work)" are the same pool: one root in the flamegraph
+    return re.sub(r"[-_]\d+", "", name)
+
+
+def folded_stack(frame, root):
+    """
+    The stack of a frame in the folded format of flamegraph.pl, outermost frame first.
+
+    Args:
+        frame (frame): The innermost frame
+        root (str): First element of the stack, i.e. the process role and thread name
+
+    Returns:
+        stack (str): "root;outer (file:line);...;inner (file:line)"
+    """
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.append(root)
+    return ";".join(reversed(labels))
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampling profiler: a background thread records the stack of every other
+    thread each `interval` seconds, so threads waiting on the LLM show up as well as
+    the ones parsing. Unlike cProfile it covers every thread, and its overhead does
+    not depend on the number of function calls.
+
+    Samples are counted per folded stack and can be drained and merged, which is how
+    the samples of the worker processes reach the parent.
+
+    Args:
+        interval (float): Seconds between two samples
+        role (str): Root of the stacks, i.e. "main" or "worker"
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, role="main"):
+        self.interval = interval
+        self.role = role
+        self.samples = Counter()
+        self.started = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="hcc-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = [folded_stack(frame, f"{self.role};{_thread_label(names.get(ident, 'thread'))}")
+                      for ident, frame in sys._current_frames().items() if ident != own]
+            with self._lock:
+                self.samples.update(stacks)
+
+    def drain(self):
+        """Samples since the last drain, as a picklable dict"""
+        with self._lock:
+            samples = dict(self.samples)
+            self.samples.clear()
+        return samples
+
+    def merge(self, samples):
+        with self._lock:
+            self.samples.update(samples)
+
+
+def configure_profiling(interval, role="main"):
+    """
+    Start the process-wide sampling profiler and the memory peaks of the spans, or
+    stop both with None.
+
+    Returns:
+        profiler (SamplingProfiler | None): The active profiler
+    """
+    global _profiler
+    if _profiler is not None:
+        _profiler.stop()
+    _profiler = SamplingProfiler(interval, role).start() if interval else None
+    configure_memory_tracking(_profiler is not None)
+    return _profiler
+
+
+def profiling_interval():
+    """Interval of the active profiler, None when profiling is off"""
+    return _profiler.interval if _profiler is not None else None
+
+
+def drain_profile():
+    """Samples of this process since the last drain, None when profiling is off"""
+    return _profiler.drain() if _profiler is not None else None
+
+
+def merge_profile(samples):
+    """Add the samples of a worker process to the active profiler"""
+    if _profiler is not None and samples:
+        _profiler.merge(samples)
+
+
+def note_report(trace_path, since=None, top=10):
+    """
+    Rank the notes of a trace file by duration and by memory.
+
+    Args:
+        trace_path (str): JSONL file of span records
+        since (float | None): Ignore the spans that started before this epoch time,
+            i.e. the previous runs appended to the same file
+        top (int): Notes per ranking
+
+    Returns:
+        report (dict): "slowest" and "largest" notes, each with its total_ms,
+        memory_peak_kb, chars and per-layer milliseconds, and "layers" with the total
+        milliseconds of every layer over the run
+    """
+    notes = defaultdict(lambda: {"total_ms": 0.0, "memory_peak_kb": 0.0, "chars": None,
+                                 "layers": defaultdict(float)})
+    layers = defaultdict(float)
+    with open(trace_path, 'r') as trace_file:
+        for line in trace_file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if since is not None and record.get("start", 0) < since:
+                continue
+            name, duration = record["name"], record["duration_ms"]
+            layers[name] += duration
+            if record.get("trace_id") is None:
+                continue
+            note = notes[record["trace_id"]]
+            note["layers"][name] += duration
+            if name in NOTE_SPANS:
+                note["total_ms"] += duration
+                note["memory_peak_kb"] = max(note["memory_peak_kb"], record.get("memory_peak_kb", 0.0))
+            if "chars" in record:
+                note["chars"] = record["chars"]
+
+    ranked = [{"note": note_id, **{key: value for key, value in note.items() if key != "layers"},
+               "layers": {name: round(ms, 3) for name, ms in sorted(note["layers"].items(), key=lambda item: -item[1])}}
+              for note_id, note in notes.items()]
+    return {
+        "notes": len(ranked),
+        "slowest": sorted(ranked, key=lambda note: -note["total_ms"])[:top],
+        "largest": sorted(ranked, key=lambda note: (-note["memory_peak_kb"], -(note["chars"] or 0)))[:top],
+        "layers": {name: round(ms, 3) for name, ms in sorted(layers.items(), key=lambda item: -item[1])},
+    }
+
+
+def top_functions(samples, top=15):
+    """
+    Returns:
+        functions (list of (str, int, int)): (frame, self samples, total samples),
+        most self samples first
+    """
+    own = Counter()
+    total = Counter()
+    for stack, count in samples.items():
+        frames = stack.split(";")[2:]
+        if frames:
+            own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+    return [(frame, count, total[frame]) for frame, count in own.most_common(top)]
+
+
+def write_profile(directory, trace_path, registry=None, top=10):
+    """
+    Stop the profiler and write the profile of the run into `directory`: profile.folded
+    (for flamegraph.pl, inferno or speedscope) and report.json (note rankings, layer
+    totals, the memory peaks per stage and the functions with the most samples).
+
+    Returns:
+        report (dict): The content of report.json
+    """
+    profiler = _profiler
+    configure_profiling(None)
+    samples = profiler.drain() if profiler is not None else {}
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, PROFILE_FILE), 'w') as folded_file:
+        for stack, count in sorted(samples.items()):
+            folded_file.write(f"{stack} {count}\n")
+
+    report = note_report(trace_path, profiler.started if profiler is not None else None, top)
+    report["samples"] = sum(samples.values())
+    report["top_functions"] = [{"frame": frame, "self": own, "total": total}
+                               for frame, own, total in top_functions(samples)]
+    if registry is not None:
+        report["memory_peak_bytes"] = {
+            series: {"p50": stats["p50"], "p99": stats["p99"], "count": stats["count"]}
+            for series, stats in registry.summary()["histograms"].items() if series.startswith("hcc_stage_memory")}
+    with open(os.path.join(directory, REPORT_FILE), 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+    return report
+
+
+def format_report(report, top=5):
+    """Short text version of a report, for the end of a run"""
+    lines = [f"Profile: {report['notes']} notes, {report['samples']} samples"]
+    for title, key in (("Slowest notes", "slowest"), ("Largest notes", "largest")):
+        lines.append(f"{title}:")
+        for note in report[key][:top]:
+            layers = ", ".join(f"{name} {ms:.1f}ms" for name, ms in list(note["layers"].items())[:4])
+            lines.append(f"  {note['note']}: {note['total_ms']:.1f}ms, {note['memory_peak_kb']:.0f} KiB peak, "
+                         f"{note['chars']} chars ({layers})")
+    return "\n".join(lines)
@@ -0,0 +1,216 @@
+import bisect
+import threading
+
+# Upper bounds in seconds, from the microseconds of a regex layer to the minute of an LLM call
+DEFAULT_LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+class Histogram:
+    """
+    Fixed-bucket, thread-safe histogram, like a Prometheus histogram: constant memory
+    whatever the number of observations, and mergeable across processes.
+
+    Args:
+        buckets (tuple of float): Sorted upper bounds, an implicit +Inf bucket is added
+    """
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, fraction):
+        """
+        Estimate a quantile by linear interpolation inside its bucket.
+
+        Returns:
+            value (float | None): The estimate, None without observations
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                if index == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def snapshot(self, reset=False):
+        """Picklable copy of the histogram, emptied afterwards if `reset`"""
+        with self._lock:
+            snapshot = {"buckets": list(self.buckets), "counts": list(self.counts),
+                        "count": self.count, "sum": self.sum}
+            if reset:
+                self.counts = [0] * len(self.counts)
+                self.count = 0
+                self.sum = 0.0
+        return snapshot
+
+    def merge(self, snapshot):
+        """Add the observations of another histogram with the same buckets"""
+        with self._lock:
+            for index, count in enumerate(snapshot["counts"]):
+                self.counts[index] += count
+            self.count += snapshot["count"]
+            self.sum += snapshot["sum"]
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _series(name, labels):
+    # name{label="value",...} as in the Prometheus text format
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{label}="{value}"' for label, value in labels) + "}"
+
+
+class MetricsRegistry:
+    """
+    Thread-safe store of counters and latency histograms, identified by a name and
+    optional labels (i.e. observe("hcc_stage_seconds", 0.002, stage="scan_note")).
+
+    Snapshots of a registry can be merged into another one, which is how the metrics
+    of worker processes are collected by the parent. Histograms are never replaced, only
+    emptied, so hot paths can keep the one returned by series().
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, amount=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def series(self, name, buckets=DEFAULT_LATENCY_BUCKETS, **labels):
+        """The histogram of a series, created empty with `buckets` if needed"""
+        key = _key(name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(buckets)
+        return histogram
+
+    def observe(self, name, value, buckets=DEFAULT_LATENCY_BUCKETS, **labels):
+        self.series(name, buckets, **labels).observe(value)
+
+    def counter(self, name, **labels):
+        """Current value of a counter, 0 if it was never incremented"""
+        return self._counters.get(_key(name, labels), 0)
+
+    def histogram(self, name, **labels):
+        """The histogram of a series, None if nothing was observed"""
+        histogram = self._histograms.get(_key(name, labels))
+        return histogram if histogram is not None and histogram.count else None
+
+    def snapshot(self, reset=False):
+        """Picklable copy of every series, emptied afterwards if `reset`"""
+        with self._lock:
+            counters = list(self._counters.items())
+            if reset:
+                self._counters = {}
+            histograms = [(key, histogram.snapshot(reset)) for key, histogram in self._histograms.items()]
+        return {"counters": counters,
+                "histograms": [(key, snapshot) for key, snapshot in histograms if snapshot["count"]]}
+
+    def drain(self):
+        """snapshot() then reset()"""
+        return self.snapshot(reset=True)
+
+    def merge(self, snapshot):
+        """Add the series of a snapshot (i.e. from a worker process) to this registry"""
+        with self._lock:
+            for key, value in snapshot["counters"]:
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, histogram_snapshot in snapshot["histograms"]:
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(histogram_snapshot["buckets"])
+                histogram.merge(histogram_snapshot)
+
+    def reset(self):
+        self.snapshot(reset=True)
+
+    def summary(self):
+        """
+        Returns:
+            summary (dict): {"counters": {series: value}, "histograms": {series: {count,
+            sum, mean, p50, p99}}, "llm_cache_hit_rate": float | None,
+            "llm_plan_token_savings": float | None}
+        """
+        with self._lock:
+            counters = {_series(*key): value for key, value in sorted(self._counters.items())}
+            histograms = {}
+            for key, histogram in sorted(self._histograms.items()):
+                if not histogram.count:
+                    continue
+                histograms[_series(*key)] = {
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "mean": histogram.sum / histogram.count if histogram.count else None,
+                    "p50": histogram.quantile(0.50),
+                    "p99": histogram.quantile(0.99),
+                }
+        hits = self.counter("hcc_llm_cache_lookups_total", result="hit")
+        lookups = hits + self.counter("hcc_llm_cache_lookups_total", result="miss")
+        original = self.counter("hcc_llm_plan_tokens_total", stage="original")
+        compacted = self.counter("hcc_llm_plan_tokens_total", stage="compacted")
+        return {"counters": counters, "histograms": histograms,
+                "llm_cache_hit_rate": hits / lookups if lookups else None,
+                "llm_plan_token_savings": 1 - compacted / original if original else None}
+
+    def prometheus(self):
+        """The registry in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = [(key, histogram) for key, histogram in sorted(self._histograms.items()) if histogram.count]
+            typed = set()
+            for (name, labels), value in counters:
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{_series(name, labels)} {value}")
+            for (name, labels), histogram in histograms:
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{_series(name + '_bucket', labels + (('le', le),))} {cumulative}")
+                lines.append(f"{_series(name + '_sum', labels)} {histogram.sum}")
+                lines.append(f"{_series(name + '_count', labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry used by the instrumentation
+REGISTRY = MetricsRegistry()
+
+
+def get_registry():
+    """Return the process-wide MetricsRegistry"""
+    return REGISTRY
@@ -0,0 +1,212 @@
+import os
+import json
+import time
+from time import perf_counter
+import itertools
+import threading
+import tracemalloc
+import contextvars
+from functools import wraps
+from utils.metrics.registry import get_registry
+
+STAGE_METRIC = "hcc_stage_seconds"
+MEMORY_METRIC = "hcc_stage_memory_peak_bytes"
+# Upper bounds in bytes, from 1 KiB to 1 GiB
+MEMORY_BUCKETS = tuple(1024 * 4 ** exponent for exponent in range(11))
+# HCC_METRICS=0 leaves the functions decorated with instrumented() untouched
+METRICS_ENABLED = os.getenv('HCC_METRICS', '1') != '0'
+
+# Trace (note) and innermost span of the running code; contextvars follow asyncio tasks
+_current_trace = contextvars.ContextVar("hcc_trace", default=None)
+_current_span = contextvars.ContextVar("hcc_span", default=None)
+_span_ids = itertools.count(1)
+_writer = None
+# Peak memory of the spans, while tracemalloc traces the allocations (--profile)
+_track_memory = False
+_current_memory_span = contextvars.ContextVar("hcc_memory_span", default=None)
+# Histogram of each stage, bound once (the registry empties them in place)
+_stage_histograms = {}
+
+
+class SpanWriter:
+    """
+    Appends span records to a JSONL file. Worker processes open the same file in
+    append mode, each line being written in a single call.
+
+    Args:
+        path (str): The trace file
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._file = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file is None or self._pid != os.getpid():
+                self._file = open(self.path, 'a', buffering=1)
+                self._pid = os.getpid()
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None and self._pid == os.getpid():
+                self._file.close()
+            self._file = None
+
+
+def configure_tracing(path):
+    """
+    Start writing span records to `path`, or stop with None.
+
+    Returns:
+        writer (SpanWriter | None): The active writer
+    """
+    global _writer
+    if _writer is not None:
+        _writer.close()
+    _writer = SpanWriter(path) if path else None
+    return _writer
+
+
+def tracing_path():
+    """Path of the active trace file, None when tracing is off"""
+    return _writer.path if _writer is not None else None
+
+
+def configure_memory_tracking(enabled):
+    """
+    Record the peak memory allocated during each span, in the hcc_stage_memory_peak_bytes
+    histogram and as "memory_peak_kb" in the span records. tracemalloc is started if
+    needed. The peak is process-wide: it is exact when the spans run one at a time, and
+    mixes the allocations of the spans running concurrently in other threads.
+    """
+    global _track_memory
+    if enabled and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _track_memory = enabled
+
+
+class trace:
+    """
+    Context manager grouping the spans of one note under `trace_id`.
+
+    Args:
+        trace_id (str): Identifier of the note, i.e. its path
+    """
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+
+    def __enter__(self):
+        self._token = _current_trace.set(self.trace_id)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        _current_trace.reset(self._token)
+
+
+class span:
+    """
+    Context manager timing a stage: the latency always goes to the hcc_stage_seconds
+    histogram, and a span record is written when tracing is configured. Attributes
+    can be added to the record while the span is open.
+
+    Args:
+        name (str): The stage, i.e. "extract_condition_data"
+        **attributes: Attributes of the span record
+    """
+
+    __slots__ = ("name", "attributes", "_start", "_id", "_token", "_memory", "_peak", "_memory_token")
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        if _writer is not None:
+            self._id = next(_span_ids)
+            self._token = _current_span.set(self._id)
+        if _track_memory:
+            self._enter_memory()
+        self._start = time.perf_counter()
+        return self
+
+    def _enter_memory(self):
+        current, peak = tracemalloc.get_traced_memory()
+        parent = _current_memory_span.get()
+        if parent is not None:
+            # The enclosing span keeps the peak reached before this one resets it
+            parent._peak = max(parent._peak, peak)
+        tracemalloc.reset_peak()
+        self._memory = self._peak = current
+        self._memory_token = _current_memory_span.set(self)
+
+    def _exit_memory(self):
+        _current_memory_span.reset(self._memory_token)
+        self._peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+        parent = _current_memory_span.get()
+        if parent is not None:
+            parent._peak = max(parent._peak, self._peak)
+        grown = self._peak - self._memory
+        get_registry().observe(MEMORY_METRIC, grown, MEMORY_BUCKETS, stage=self.name)
+        return grown
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration = time.perf_counter() - self._start
+        _stage_histogram(self.name).observe(duration)
+        if hasattr(self, "_memory_token"):
+            self.attributes["memory_peak_kb"] = round(self._exit_memory() / 1024, 1)
+        writer = _writer
+        if writer is not None and hasattr(self, "_token"):
+            _current_span.reset(self._token)
+            record = {
+                "trace_id": _current_trace.get(),
+                "span_id": f"{os.getpid()}-{self._id}",
+                "parent_id": None,
+                "name": self.name,
+                "start": time.time() - duration,
+                "duration_ms": round(duration * 1000, 4),
+            }
+            parent = _current_span.get()
+            if parent is not None:
+                record["parent_id"] = f"{os.getpid()}-{parent}"
+            if exc_type is not None:
+                record["error"] = repr(exc)
+            record.update(self.attributes)
+            writer.write(record)
+        return False
+
+
+def _stage_histogram(stage):
+    histogram = _stage_histograms.get(stage)
+    if histogram is None:
+        histogram = _stage_histograms[stage] = get_registry().series(STAGE_METRIC, stage=stage)
+    return histogram
+
+
+def instrumented(stage):
+    """Decorator running a function inside span(stage), a no-op when HCC_METRICS=0"""
+    def decorator(function):
+        if not METRICS_ENABLED:
+            return function
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if _writer is not None:
+                with span(stage):
+                    return function(*args, **kwargs)
+            # Without a trace file only the latency is recorded, at a fraction of a span's cost
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _stage_histogram(stage).observe(perf_counter() - start)
+        return wrapper
+    return decorator
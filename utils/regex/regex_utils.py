@@ -1,5 +1,6 @@
-import re
-import json
+from utils.regex.scanner import find_assessment_plan, scan_plans, ICD10_PATTERN, CodeSpan
+from utils.hcc.code_index import get_code_index
+from utils.metrics.tracing import instrumented
 
 def extract_assessment_plan(text):
     """
@@ -19,41 +20,9 @@ def extract_assessment_plan(text):
         if not isinstance(text, str):
             raise ValueError("Input text must be a string")
 
-        # Define the pattern to extract the "Assessment / Plan" section
-        pattern = r"Assessment / Plan\n\n(.*?)(?=\n\nReturn to Office|\Z)"
-
-        # Extract the Assessment / Plan section using regex
-        match = re.search(pattern, text, re.DOTALL)
-
-        if match:
-            assessment_plan = match.group(1)
-            return assessment_plan
-        else:
-            # If regex doesn't match, split the text into lines and look for "Assessment / Plan"
-            lines = text.split('\n')
-            idxAss_Plam = None
-
-            # Find the index of the line containing "Assessment / Plan"
-            for idx, line in enumerate(lines):
-                if "Assessment / Plan" in line:
-                    idxAss_Plam = idx
-                    break  # Stop searching once we find the first occurrence
-
-            # If "Assessment / Plan" is not found, raise an error
-            if idxAss_Plam is None:
-                raise ValueError('"Assessment / Plan" section not found in the text')
-
-            # Set the start and end indices to extract the assessment plan text
-            start_index = idxAss_Plam + 1
-            end_index = len(lines)  # Assuming the end is the end of the document
-
-            # Ensure the start index is within bounds
-            if start_index >= end_index:
-                raise IndexError("Start index for assessment plan extraction is out of bounds")
-
-            # Extract the assessment plan text and return it
-            assessment_plan = '\n'.join(lines[start_index:end_index])
-            return assessment_plan
+        # Precompiled "Assessment / Plan" regex, falling back to the line after the heading
+        assessment_plan, _ = find_assessment_plan(text)
+        return assessment_plan
 
     except Exception as e:
         # Catch all exceptions and print an error message
@@ -77,43 +46,19 @@ def extract_each_plan(text):
     if not isinstance(text, str):
         raise TypeError("Input must be a string.")
     
-    # Removing white spaces in the beginning of each line
-    text = '\n'.join(line.lstrip() for line in text.splitlines())
-    
-    # Removing empty lines from the text
-    text = '\n'.join([line for line in text.splitlines() if line.strip()])
+    # Single pass: lines are left-stripped, empty lines dropped and plans split on "1. " / "1)"
+    plans, has_content = scan_plans(text)
 
     # Check if the cleaned text is empty after trimming
-    if not text.strip():
+    if not has_content:
         raise ValueError("The input text is empty after trimming whitespace.")
 
-    # Get indexes (start_of_section_idx_line) if section starts with 1. or 1)
-    lines = text.splitlines()
-    len_text = len(lines)
-    start_of_section_idx_line = []
-    #pattern = r"(^(\s?\d+)\.\s)|(^(\s\d+)\)\s)"  #2nd part was not picking 2)
-    pattern = r"(^(\s?\d+)\.\s)|(^\s*\d+\))"
-    
-    for index, line in enumerate(lines):
-        if re.match(pattern, line):
-            start_of_section_idx_line.append(index)
-    
     # Check if we found any sections
-    if not start_of_section_idx_line:
+    if not plans:
         raise ValueError("No sections found in the input text.")
 
-    # Get sections from index to index + 1 => i.e: [0:5] : Section 1
-    section = []
-    for i, e in enumerate(start_of_section_idx_line):
-        if e != start_of_section_idx_line[-1]:
-            unit_section = '\n'.join(lines[e:start_of_section_idx_line[i + 1]])
-            section.append(unit_section)
-        else:
-            unit_section = '\n'.join(lines[e:])
-            section.append(unit_section)
-    
     # Return the list of sections
-    return section
+    return [plan.text for plan in plans]
 
 def match_icd10_codes(text):
     """
@@ -134,24 +79,43 @@ def match_icd10_codes(text):
     if not isinstance(text, str):
         raise TypeError("Input must be a string.")
 
-    pattern = r"[A-TV-Z][0-9][0-9AB]\.?[0-9A-TV-Z]{0,4}"
-    #icd10 = []
-    icd10 = None
-
-    matches = re.findall(pattern, text)
-    if matches:
-        icd10 = matches[0]
-        return icd10
+    # The first match of the precompiled ICD-10 pattern
+    match = ICD10_PATTERN.search(text)
+    if match:
+        return match.group()
     return None
 
 
-def is_icd10_an_hcc(code, text):
+def match_all_icd10_codes(text):
+    """
+    Extract every icd-10 code of an individual assessment plan (text), with its position.
+
+    Args:
+        text (str): Each individual assessment plan.
+
+    Returns:
+        codes (list of CodeSpan): (code, start, end) of each match, in order
+
+    Raises:
+        TypeError: If the input is not a text string
+    """
+    if not isinstance(text, str):
+        raise TypeError("Input must be a string.")
+
+    return [CodeSpan(match.group(), match.start(), match.end()) for match in ICD10_PATTERN.finditer(text)]
+
+
+@instrumented("is_icd10_an_hcc")
+def is_icd10_an_hcc(code, text, hcc_json_file_path=None, version=None):
     """
     Verify if the icd-10 code provided as input is an HCC code according to the hash table located in HCC_relevant_codes.json
 
     Args:
         code (str): the icd-10 code.
         text (str): individual assessment plan
+        hcc_json_file_path (str | None): path to HCC_relevant_codes.json or to a compiled code set, loaded once
+            through the shared code index (the configured code set if None)
+        version (str | None): code set of a compiled file (i.e. V24 or V28), the configured one if None
 
     Returns:
         partial_output (dict): Returns this dictionary:
@@ -164,31 +128,23 @@ def is_icd10_an_hcc(code, text):
     Raises:
         TypeError: If the hcc_json_file_path.json is not a valid path, or if the json file is not formatted properly, or if the code provided as input is not a string
     """
-    try:
-        # Open the JSON file and load its contents into a dictionary
-        hcc_json_file_path = "HCC_relevant_codes.json"
-        # hcc_json_file_path = r"D:\\Doctustech\\DoctusTech_AI_engineer_technical-test\\HCC_relevant_codes.json"
-        with open(hcc_json_file_path, 'r') as json_file:
-            HCC_data = json.load(json_file)
-            
-        if not isinstance(code, str):
-            raise ValueError("Input code must be a string")
-
-        # Remove the dot from the code for HCC matching
-        code = code.replace('.', '')
-        
-        # Check if the code exists in the dictionary
-        partial_output = {}
-        if code in HCC_data:
-            partial_output["condition_code"] = code
-            partial_output["condition_name"] = HCC_data[code]
-            partial_output["is_hcc"] = True    
-        else:
-            partial_output["condition_code"] = code
-            partial_output["is_hcc"] = False
-        return partial_output
-    except FileNotFoundError:
-        raise FileNotFoundError(f"Error: The file '{hcc_json_file_path}' was not found.")
-    except json.JSONDecodeError:
-        raise ValueError(f"Error: The file '{hcc_json_file_path}' is not a valid JSON file.")
-    
+    if not isinstance(code, str):
+        raise ValueError("Input code must be a string")
+
+    # Shared index: the JSON file is parsed once per process and reloaded only when it changes
+    HCC_data = get_code_index(hcc_json_file_path, version)
+
+    # Remove the dot from the code for HCC matching
+    code = code.replace('.', '')
+
+    # Check if the code exists in the dictionary
+    partial_output = {}
+    condition_name = HCC_data.lookup(code)
+    if condition_name is not None:
+        partial_output["condition_code"] = code
+        partial_output["condition_name"] = condition_name
+        partial_output["is_hcc"] = True
+    else:
+        partial_output["condition_code"] = code
+        partial_output["is_hcc"] = False
+    return partial_output
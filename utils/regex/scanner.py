@@ -0,0 +1,198 @@
+import re
+from typing import NamedTuple
+from utils.metrics.tracing import instrumented
+
+# Patterns are compiled once, at import time
+ASSESSMENT_PLAN_PATTERN = re.compile(r"Assessment / Plan\n\n(.*?)(?=\n\nReturn to Office|\Z)", re.DOTALL)
+ICD10_PATTERN = re.compile(r"[A-TV-Z][0-9][0-9AB]\.?[0-9A-TV-Z]{0,4}")
+# Same boundaries as str.splitlines()
+LINE_BREAK_PATTERN = re.compile(r"\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]")
+# Line breaks other than "\n", which only the slow path of scan_plans handles
+OTHER_LINE_BREAK_PATTERN = re.compile(r"[\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]")
+# Lines are left-stripped before matching, so "1. " / "1)" must start the line
+PLAN_START_PATTERN = re.compile(r"\d+(?:\.\s|\))")
+# Tokens of the fast path: a plan line (group 1 is where its content starts) or an ICD-10 code
+SCAN_TOKEN_PATTERN = re.compile(r"\n[^\S\n]*(\d+(?:\.[^\S\n]|\)))|[A-TV-Z][0-9][0-9AB]\.?[0-9A-TV-Z]{0,4}")
+FIRST_PLAN_LINE_PATTERN = re.compile(r"[^\S\n]*(\d+(?:\.[^\S\n]|\)))")
+# A line break with the leading whitespace of the next line and any blank lines in between
+LINE_GAP_PATTERN = re.compile(r"\n[^\S\n]*(?:\n[^\S\n]*)*")
+
+ASSESSMENT_PLAN_HEADING = "Assessment / Plan"
+SECTION_END = "\n\nReturn to Office"
+
+
+class CodeSpan(NamedTuple):
+    """An ICD-10 candidate and its [start, end) character offsets in the note"""
+    code: str
+    start: int
+    end: int
+
+
+class ScannedPlan(NamedTuple):
+    """
+    An individual assessment plan found by the scanner.
+
+    text is exactly what extract_each_plan returns for the plan; start and end are
+    the offsets of its first and (one past) last non-blank characters in the scanned
+    text, and codes the ICD-10 candidates of the plan in order of appearance.
+    """
+    text: str
+    start: int
+    end: int
+    codes: list
+
+
+def find_assessment_plan(text):
+    """
+    Locate the "Assessment / Plan" section.
+
+    Args:
+        text (str): The progress note text
+
+    Returns:
+        (section, offset): The section text and its offset in `text`
+
+    Raises:
+        ValueError: If there is no "Assessment / Plan" heading
+        IndexError: If the heading is on the last line
+    """
+    # Same result as ASSESSMENT_PLAN_PATTERN.search, without testing the lookahead at
+    # every character of the section
+    heading = text.find(ASSESSMENT_PLAN_HEADING + "\n\n")
+    if heading != -1:
+        start = heading + len(ASSESSMENT_PLAN_HEADING) + 2
+        end = text.find(SECTION_END, start)
+        if end == -1:
+            end = len(text)
+        return text[start:end], start
+
+    # Fallback: everything after the line holding the first heading
+    heading = text.find(ASSESSMENT_PLAN_HEADING)
+    if heading == -1:
+        raise ValueError('"Assessment / Plan" section not found in the text')
+    end_of_line = text.find('\n', heading)
+    if end_of_line == -1:
+        raise IndexError("Start index for assessment plan extraction is out of bounds")
+    return text[end_of_line + 1:], end_of_line + 1
+
+
+def scan_plans(text, offset=0):
+    """
+    Split a plan section into individual plans in one walk over its lines, recording
+    the ICD-10 candidates of every plan with their offsets.
+
+    Lines are left-stripped and empty lines dropped, like extract_each_plan does, and
+    a plan starts at every line beginning with "<number>. " or "<number>)".
+
+    Args:
+        text (str): The plan section
+        offset (int): Offset of `text` in the note, added to every reported position
+
+    Returns:
+        (plans, has_content): The list of ScannedPlan, and whether `text` had any
+        non-blank line
+    """
+    if OTHER_LINE_BREAK_PATTERN.search(text) is None:
+        return _scan_newline_plans(text, offset)
+
+    plans = []
+    has_content = False
+    lines = []
+    codes = []
+    in_plan = False
+    plan_start = plan_end = 0
+    position = 0
+    length = len(text)
+    breaks = LINE_BREAK_PATTERN.finditer(text)
+    while position < length:
+        line_break = next(breaks, None)
+        line_end = line_break.start() if line_break else length
+        line = text[position:line_end]
+        content = line.lstrip()
+        if content:
+            has_content = True
+            content_start = offset + line_end - len(content)
+            if PLAN_START_PATTERN.match(content):
+                if lines:
+                    plans.append(ScannedPlan('\n'.join(lines), plan_start, plan_end, codes))
+                lines = []
+                codes = []
+                plan_start = content_start
+                in_plan = True
+            if in_plan:
+                lines.append(content)
+                plan_end = content_start + len(content.rstrip())
+                for match in ICD10_PATTERN.finditer(content):
+                    codes.append(CodeSpan(match.group(), content_start + match.start(), content_start + match.end()))
+        position = line_break.end() if line_break else length
+    if lines:
+        plans.append(ScannedPlan('\n'.join(lines), plan_start, plan_end, codes))
+    return plans, has_content
+
+
+def _scan_newline_plans(text, offset):
+    # Fast path of scan_plans for texts whose only line break is "\n": a single
+    # finditer walk over the section yields both the plan starts and the ICD-10 codes
+    plans = []
+    codes = []
+    start = None
+    first_line = FIRST_PLAN_LINE_PATTERN.match(text)
+    if first_line:
+        start = first_line.start(1)
+    for match in SCAN_TOKEN_PATTERN.finditer(text):
+        if match.lastindex:
+            if start is not None:
+                plans.append((start, match.start() + 1, codes))
+            start = match.start(1)
+            codes = []
+        elif start is not None:
+            codes.append(CodeSpan(match.group(), offset + match.start(), offset + match.end()))
+    if start is None:
+        return [], bool(text.strip())
+    plans.append((start, len(text), codes))
+
+    scanned_plans = []
+    for start, end, codes in plans:
+        chunk = text[start:end]
+        # Left-strip every line and drop the blank ones
+        plan_text = LINE_GAP_PATTERN.sub('\n', chunk).strip('\n')
+        scanned_plans.append(ScannedPlan(plan_text, offset + start, offset + start + len(chunk.rstrip()), codes))
+    return scanned_plans, True
+
+
+# The two phases of scan_note, timed as stages of their own
+_timed_find_assessment_plan = instrumented("find_assessment_plan")(find_assessment_plan)
+_timed_scan_plans = instrumented("scan_plans")(scan_plans)
+
+
+@instrumented("scan_note")
+def scan_note(text):
+    """
+    Fused parser: finds the Assessment / Plan section, splits it into numbered plans
+    and records the ICD-10 candidates of each plan with their offsets in the note.
+
+    Equivalent to extract_assessment_plan + extract_each_plan + match_icd10_codes
+    (the first code of each plan), in a single pass. Its latency is recorded as the
+    "scan_note" stage, which covers those three layers, split into the
+    "find_assessment_plan" and "scan_plans" stages.
+
+    Args:
+        text (str): The progress note text
+
+    Returns:
+        plans (list of ScannedPlan): The plans of the note
+
+    Raises:
+        ValueError: If the section has no plans (or could not be found)
+    """
+    try:
+        section, offset = _timed_find_assessment_plan(text)
+    except (ValueError, IndexError) as e:
+        # Same outcome as splitting the error message returned by extract_assessment_plan
+        section, offset = f"Error occurred: {str(e)}", 0
+    plans, has_content = _timed_scan_plans(section, offset)
+    if not has_content:
+        raise ValueError("The input text is empty after trimming whitespace.")
+    if not plans:
+        raise ValueError("No sections found in the input text.")
+    return plans
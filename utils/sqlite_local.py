@@ -0,0 +1,38 @@
+import os
+import sqlite3
+import threading
+
+
+class LocalConnection:
+    """
+    One SQLite connection per thread and per process: sqlite connections must not be
+    shared between threads nor cross a fork, so each gets its own on first use.
+
+    Args:
+        path (str): The SQLite file, its directory is created if needed
+        pragmas (tuple of str): PRAGMA statements run on every new connection, i.e. "journal_mode=WAL"
+        **options: Arguments of sqlite3.connect (timeout, isolation_level...)
+    """
+
+    def __init__(self, path, pragmas=(), **options):
+        self.path = path
+        self.pragmas = pragmas
+        self.options = options
+        self._local = threading.local()
+
+    def get(self):
+        """
+        Returns:
+            connection (sqlite3.Connection): The connection of the calling thread and process
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, **self.options)
+            for pragma in self.pragmas:
+                connection.execute(f"PRAGMA {pragma}")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection